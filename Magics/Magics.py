@@ -7,10 +7,16 @@
 # does it submit to any jurisdiction.
 #
 
+import contextlib
 import ctypes
 import ctypes.util
+import functools
 import json
+import os
 import sys
+import threading
+import time
+from collections import deque
 
 import numpy as np
 from numpy.ctypeslib import ndpointer
@@ -20,12 +26,126 @@ try:
 except ImportError:
     import findlibs
 
-lib = findlibs.find("MagPlus")
-if lib is None:
-    raise RuntimeError("Cannot find MagPlus library")
+if os.environ.get("MAGICS_STANDIN", "off") in ("on", "1", "yes"):
+    # Pure Python stand-in, for testing and benchmarking without libMagPlus
+    from . import standin
 
+    lib = standin.LIBRARY_PATH
+    dll = standin.Library()
+else:
+    lib = findlibs.find("MagPlus")
+    if lib is None:
+        raise RuntimeError("Cannot find MagPlus library")
+
+    dll = ctypes.CDLL(lib)
 
-dll = ctypes.CDLL(lib)
+
+####################################################################
+#
+# The optional entry points of libMagPlus are probed once per library (path
+# and mtime) and the result is cached on disk, so that new processes, and the
+# workers in particular, do not probe the library again.
+#
+
+SYMBOLS = (
+    "version",
+    "home",
+    "py_tile",
+    "py_detect",
+    "detect",
+    "py_set_python",
+    "py_keep_compatibility",
+    "py_mute",
+    "py_unmute",
+    "py_knowndrivers",
+    "py_strict_mode",
+    "py_set1f",
+    "py_set2f",
+    "mag_add_warning_listener",
+    "mag_add_error_listener",
+    "mag_add_info_listener",
+    "mag_add_debug_listener",
+)
+
+
+def cache_directory():
+    """Return the directory of the files cached by Magics, creating it."""
+    path = os.environ.get("MAGICS_CACHE_DIR")
+    if path is None:
+        path = os.path.join(
+            os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "magics"
+        )
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def write_atomic(path, data):
+    """
+    Write ``data``, bytes or str, to a temporary file renamed to ``path``,
+    so that the other processes and threads never read a partial file.
+    """
+    tmp = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+    try:
+        with open(tmp, "w" if isinstance(data, str) else "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def _probe():
+    result = {}
+    for name in SYMBOLS:
+        try:
+            getattr(dll, name)
+            result[name] = True
+        except AttributeError:
+            result[name] = False
+    return result
+
+
+def _capabilities():
+    try:
+        stat = os.stat(lib)
+    except OSError:
+        # The stand-in, nothing to cache
+        return _probe()
+
+    key = dict(library=os.path.realpath(lib), mtime=stat.st_mtime, size=stat.st_size)
+    try:
+        path = os.path.join(cache_directory(), "capabilities.json")
+    except OSError:
+        return _probe()
+
+    try:
+        with open(path) as f:
+            cached = json.load(f)
+        if cached["key"] == key and set(cached["symbols"]) == set(SYMBOLS):
+            return cached["symbols"]
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        pass
+
+    result = _probe()
+    try:
+        write_atomic(path, json.dumps(dict(key=key, symbols=result)))
+    except (IOError, OSError):
+        pass
+    return result
+
+
+CAPABILITIES = _capabilities()
+
+
+def capabilities():
+    """
+    Return, for each optional entry point of libMagPlus, whether the library
+    provides it.
+    """
+    return dict(CAPABILITIES)
 
 
 class FILE(ctypes.Structure):
@@ -103,12 +223,252 @@ c_int_p = ctypes.POINTER(c_int)
 c_double = ctypes.c_double
 c_double_p = ctypes.POINTER(c_double)
 
+c_float = ctypes.c_float
+c_float_p = ctypes.POINTER(c_float)
+
 c_char = ctypes.c_char
 c_char_p = ctypes.c_char_p
 
 c_void_p = ctypes.c_void_p
 
 
+####################################################################
+
+
+class BufferPool(object):
+    """
+    Pool of aligned buffers used to marshal arrays passed to Magics.
+
+    Buffers are bucketed by size (powers of two) and recycled from one call to
+    the next. At most ``max_bytes`` of idle buffers are kept, a value of 0
+    disables the pool. Buffers idle for more than ``max_idle`` seconds are
+    released, so that the memory of a burst of large plots is given back.
+    """
+
+    ALIGNMENT = 64
+    MIN_BUCKET = 4096
+
+    def __init__(self, max_bytes, max_idle=60.0):
+        self.max_bytes = max_bytes
+        self.max_idle = max_idle
+        self.buckets = {}
+        self.held = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def bucket(self, nbytes):
+        return max(self.MIN_BUCKET, 1 << (max(nbytes, 1) - 1).bit_length())
+
+    @contextlib.contextmanager
+    def borrow(self, shape, dtype):
+        """Yield an uninitialised aligned array of the given shape and dtype."""
+        dtype = np.dtype(dtype)
+        nbytes = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+        size = self.bucket(nbytes)
+
+        raw = None
+        with self.lock:
+            free = self.buckets.get(size)
+            if free:
+                raw, _ = free.pop()
+                self.held -= size
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if raw is None:
+            raw = np.empty(size + self.ALIGNMENT, dtype=np.uint8)
+
+        start = -raw.ctypes.data % self.ALIGNMENT
+        end = start + nbytes
+        try:
+            yield raw[start:end].view(dtype).reshape(shape)
+        finally:
+            now = time.monotonic()
+            with self.lock:
+                if self.held + size <= self.max_bytes:
+                    self.buckets.setdefault(size, []).append((raw, now))
+                    self.held += size
+                self._expire(now)
+
+    def _expire(self, now):
+        # Release the buffers idle for more than max_idle seconds, holding the lock
+        for size, free in list(self.buckets.items()):
+            kept = [x for x in free if now - x[1] <= self.max_idle]
+            self.held -= size * (len(free) - len(kept))
+            if kept:
+                self.buckets[size] = kept
+            else:
+                del self.buckets[size]
+
+    def expire(self, now=None):
+        """Release the buffers idle for more than max_idle seconds."""
+        with self.lock:
+            self._expire(time.monotonic() if now is None else now)
+
+    def resize(self, max_bytes):
+        """Set the maximum size of the idle buffers, releasing them if above."""
+        with self.lock:
+            self.max_bytes = max_bytes
+            if self.held > max_bytes:
+                self.buckets = {}
+                self.held = 0
+
+    def clear(self):
+        with self.lock:
+            self.buckets = {}
+            self.held = 0
+
+    def stats(self):
+        with self.lock:
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                bytes_held=self.held,
+                buffers=sum(len(v) for v in self.buckets.values()),
+                max_bytes=self.max_bytes,
+            )
+
+
+buffer_pool = BufferPool(
+    int(os.environ.get("MAGICS_BUFFER_POOL_SIZE", 64 * 1024 * 1024)),
+    float(os.environ.get("MAGICS_BUFFER_POOL_IDLE", 60)),
+)
+
+
+def set_buffer_pool_size(max_bytes):
+    buffer_pool.resize(max_bytes)
+
+
+@contextlib.contextmanager
+def marshalled(data, dtype):
+    """
+    Yield data as a C contiguous array of the given dtype, converting it into
+    a buffer of the pool if needed.
+    """
+    data = np.asarray(data)
+    if data.dtype == dtype and data.flags.c_contiguous:
+        yield data
+        return
+    with buffer_pool.borrow(data.shape, dtype) as buffer:
+        np.copyto(buffer, data, casting="unsafe")
+        yield buffer
+
+
+####################################################################
+#
+# Opt-in instrumentation of the calls to libMagPlus. It is enabled by setting
+# MAGICS_STATS=on or with the instrument() context manager.
+#
+
+
+class CallStats(object):
+    """
+    Number of calls, wall time and bytes marshalled for each binding.
+    The last ``samples`` durations of each binding are kept for percentiles.
+    """
+
+    def __init__(self, samples=10000):
+        self.enabled = False
+        self.samples = samples
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def clear(self):
+        with self.lock:
+            self.calls = {}
+
+    def record(self, name, elapsed, nbytes):
+        with self.lock:
+            entry = self.calls.get(name)
+            if entry is None:
+                entry = self.calls[name] = [0, 0.0, 0, deque(maxlen=self.samples)]
+            entry[0] += 1
+            entry[1] += elapsed
+            entry[2] += nbytes
+            entry[3].append(elapsed)
+
+    def summary(self):
+        with self.lock:
+            calls = {k: (v[0], v[1], v[2], list(v[3])) for k, v in self.calls.items()}
+
+        result = {}
+        for name, (count, total, nbytes, samples) in calls.items():
+            p50, p90, p99 = np.percentile(samples, [50, 90, 99])
+            result[name] = dict(
+                calls=count,
+                total=total,
+                mean=total / count,
+                p50=float(p50),
+                p90=float(p90),
+                p99=float(p99),
+                max=max(samples),
+                bytes=nbytes,
+            )
+        return result
+
+
+call_stats = CallStats()
+call_stats.enabled = os.environ.get("MAGICS_STATS", "off") in ("on", "1", "yes")
+
+
+def payload_bytes(values):
+    """
+    Return the approximate number of bytes of ``values`` passed to
+    libMagPlus: arrays by size, strings by length and scalars as 8 bytes.
+    """
+    total = 0
+    for a in values:
+        if isinstance(a, (str, bytes)):
+            total += len(a)
+        elif isinstance(a, (list, tuple)):
+            total += sum(len(x) if isinstance(x, (str, bytes)) else 8 for x in a)
+        else:
+            total += getattr(a, "nbytes", 8)
+    return total
+
+
+def instrumented(fn, name=None):
+    if name is None:
+        name = fn.__name__
+
+    @functools.wraps(fn)
+    def wrapped(*args):
+        if not call_stats.enabled:
+            return fn(*args)
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            call_stats.record(name, time.perf_counter() - start, payload_bytes(args))
+
+    wrapped.__name__ = name
+    return wrapped
+
+
+def stats():
+    """
+    Return, for each binding called while the instrumentation was enabled,
+    the number of calls, the total, mean, percentiles and max wall time in
+    seconds and the number of bytes passed.
+    """
+    return call_stats.summary()
+
+
+@contextlib.contextmanager
+def instrument(clear=True):
+    """Record the calls made to libMagPlus within the block."""
+    if clear:
+        call_stats.clear()
+    previous = call_stats.enabled
+    call_stats.enabled = True
+    try:
+        yield call_stats
+    finally:
+        call_stats.enabled = previous
+
+
 ####################################################################
 def checked_error_in_last_paramater(fn):
     def wrapped(*args):
@@ -126,6 +486,9 @@ def checked_error_in_last_paramater(fn):
 
 
 def checked_return_code(fn):
+    fn = instrumented(fn)
+
+    @functools.wraps(fn)
     def wrapped(*args):
         err = fn(*args)
         if err:
@@ -198,17 +561,17 @@ def oldversion():
     return msg.encode()
 
 
-try:
+if CAPABILITIES["version"]:
     version = dll.version
     version.restype = ctypes.c_char_p
     version.argtypes = None
-except Exception:
+else:
     version = oldversion
 
-try:
-    tile = dll.py_tile
-except Exception:
-    print("Tile not enabled: You are using an old version of magics ( < 4.1.0)")
+if CAPABILITIES["py_tile"]:
+    tile = instrumented(dll.py_tile, "tile")
+else:
+    # Tile not enabled: old version of magics ( < 4.1.0)
     tile = oldversion
 
 
@@ -228,8 +591,12 @@ metainput = dll.py_metainput
 metainput.restype = ctypes.c_char_p
 metainput.argtypes = None
 
+metanetcdf = instrumented(metanetcdf, "metanetcdf")
+metagrib = instrumented(metagrib, "metagrib")
+metainput = instrumented(metainput, "metainput")
 
-try:
+
+if CAPABILITIES["py_detect"]:
     py_detect = dll.py_detect
     py_detect.restype = ctypes.c_char_p
     py_detect.argtypes = (ctypes.c_char_p, ctypes.c_char_p)
@@ -237,7 +604,7 @@ try:
 
     detect = py_detect
 
-except Exception:
+else:
     detect = dll.detect
     detect.restype = ctypes.c_char_p
     detect.argtypes = (ctypes.c_char_p, ctypes.c_char_p)
@@ -663,6 +1030,8 @@ def seti(name, value):
 
 
 def known_drivers():
+    if not CAPABILITIES["py_knowndrivers"]:
+        return "known_drivers is not implemented in this version"
     try:
         drivers = dll.py_knowndrivers()
         drivers = json.loads(drivers.decode())
@@ -680,29 +1049,62 @@ py_set1i.restype = c_char_p
 
 @checked_return_code
 def set1i(name, data):
-    #    array = np.empty((size,), dtype=np.float64)
-    #    array_p = array.ctypes.data_as(c_double_p)
-    #    _set1r(name, array_p, size)
-    size = len(data)
     name = string_to_char(name)
-    array_p = (ctypes.c_int * size)(*data)
-    return py_set1i(ctypes.c_char_p(name), array_p, size)
+    with marshalled(data, np.intc) as data:
+        array_p = data.ctypes.data_as(c_int_p)
+        return py_set1i(ctypes.c_char_p(name), array_p, data.size)
 
 
 ####################################################################
 
-array_2d_int = ndpointer(dtype=int, ndim=2, flags="CONTIGUOUS")
-set2i = dll.py_set2i
-set2i.restype = None
-set2i.argtypes = (c_char_p, array_2d_int, c_int, c_int)
-set2i = convert_strings(set2i)
+array_2d_int = ndpointer(dtype=np.intc, ndim=2, flags="CONTIGUOUS")
+py_set2i = dll.py_set2i
+py_set2i.restype = None
+py_set2i.argtypes = (c_char_p, array_2d_int, c_int, c_int)
+py_set2i = convert_strings(py_set2i)
+
+
+@instrumented
+def set2i(name, data, dim1, dim2):
+    with marshalled(data, np.intc) as data:
+        return py_set2i(name, data, dim1, dim2)
+
 
 ####################################################################
 
 setr = dll.py_setr
 setr.restype = None
 setr.argtypes = (c_char_p, c_double)
-setr = convert_strings(setr)
+setr = instrumented(convert_strings(setr), "setr")
+
+####################################################################
+#
+# float32 payloads are passed to Magics as they are when the library provides
+# py_set1f/py_set2f, otherwise they are upcast to float64 into a buffer of the
+# pool. The upcast is not done by chunks: py_set1r and py_set2r take the whole
+# array at once.
+#
+
+array_2d_float = ndpointer(dtype=np.float32, ndim=2, flags="CONTIGUOUS")
+
+
+def _float32(library):
+    # Return the py_set1f and py_set2f functions of the library
+    py_set1f = library.py_set1f
+    py_set1f.restype = c_char_p
+    py_set1f.argtypes = (c_char_p, c_float_p, c_int)
+
+    py_set2f = library.py_set2f
+    py_set2f.restype = None
+    py_set2f.argtypes = (c_char_p, array_2d_float, c_int, c_int)
+    return py_set1f, convert_strings(py_set2f)
+
+
+if CAPABILITIES["py_set1f"] and CAPABILITIES["py_set2f"]:
+    py_set1f, py_set2f = _float32(dll)
+else:
+    py_set1f = None
+    py_set2f = None
 
 ####################################################################
 py_set1r = dll.py_set1r
@@ -712,26 +1114,42 @@ py_set1r.restype = c_char_p
 
 @checked_return_code
 def set1r(name, data):
-    size = len(data)
+    data = np.asarray(data)
     name = string_to_char(name)
-    array_p = (ctypes.c_double * size)(*data)
-    return py_set1r(ctypes.c_char_p(name), array_p, size)
+    if data.dtype == np.float32 and py_set1f is not None:
+        with marshalled(data, np.float32) as data:
+            array_p = data.ctypes.data_as(c_float_p)
+            return py_set1f(ctypes.c_char_p(name), array_p, data.size)
+    with marshalled(data, np.float64) as data:
+        array_p = data.ctypes.data_as(c_double_p)
+        return py_set1r(ctypes.c_char_p(name), array_p, data.size)
 
 
 ####################################################################
 
 array_2d_double = ndpointer(dtype=np.double, ndim=2, flags="CONTIGUOUS")
-set2r = dll.py_set2r
-set2r.restype = None
-set2r.argtypes = (c_char_p, array_2d_double, c_int, c_int)
-set2r = convert_strings(set2r)
+py_set2r = dll.py_set2r
+py_set2r.restype = None
+py_set2r.argtypes = (c_char_p, array_2d_double, c_int, c_int)
+py_set2r = convert_strings(py_set2r)
+
+
+@instrumented
+def set2r(name, data, dim1, dim2):
+    data = np.asarray(data)
+    if data.dtype == np.float32 and py_set2f is not None:
+        with marshalled(data, np.float32) as data:
+            return py_set2f(name, data, dim1, dim2)
+    with marshalled(data, np.float64) as data:
+        return py_set2r(name, data, dim1, dim2)
+
 
 ####################################################################
 
 setc = dll.py_setc
 setc.restype = None
 setc.argtypes = (c_char_p, c_char_p)
-setc = convert_strings(setc)
+setc = instrumented(convert_strings(setc), "setc")
 
 ####################################################################
 
@@ -740,12 +1158,37 @@ py_set1c.restype = c_char_p
 # py_set1c.argtypes = (c_char_p, c_char_p, c_int)
 
 
+class StringArray(object):
+    """
+    Array of C strings ready to be passed to py_set1c. The strings are encoded
+    at once into a single contiguous buffer, the array of pointers is computed
+    from the offsets of the separators.
+    """
+
+    def __init__(self, strings):
+        self.size = len(strings)
+        self.buffer = np.frombuffer(
+            string_to_char("\0".join(strings) + "\0"), dtype=np.uint8
+        )
+        ends = np.flatnonzero(self.buffer == 0)
+        if len(ends) != max(self.size, 1):
+            raise ValueError("Strings passed to Magics cannot contain NUL characters")
+        offsets = np.zeros(self.size, dtype=np.uintp)
+        offsets[1:] = ends[:-1] + 1
+        self.pointers = offsets + np.uintp(self.buffer.ctypes.data)
+        self.argv = self.pointers.ctypes.data_as(ctypes.POINTER(c_char_p))
+
+    @property
+    def nbytes(self):
+        return self.buffer.nbytes + self.pointers.nbytes
+
+
 @checked_return_code
 def set1c(name, data):
-    new_data = [string_to_char(s) for s in data]
+    if not isinstance(data, StringArray):
+        data = StringArray(data)
     name = string_to_char(name)
-    data_p = (c_char_p * (len(new_data)))(*new_data)
-    return py_set1c(ctypes.c_char_p(name), data_p, len(new_data))
+    return py_set1c(ctypes.c_char_p(name), data.argv, data.size)
 
 
 ####################################################################
@@ -753,14 +1196,14 @@ def set1c(name, data):
 new_page = dll.py_new
 new_page.restype = None
 new_page.argtypes = (c_char_p,)
-new_page = convert_strings(new_page)
+new_page = instrumented(convert_strings(new_page), "new_page")
 
 ####################################################################
 
 reset = dll.py_reset
 reset.restype = None
 reset.argtypes = (c_char_p,)
-reset = convert_strings(reset)
+reset = instrumented(convert_strings(reset), "reset")
 
 ####################################################################
 
@@ -783,7 +1226,16 @@ def not_implemented():
     print("Not Implemented, consider upgrading a version > 4.4.0 ")
 
 
-try:
+if all(
+    CAPABILITIES[x]
+    for x in (
+        "py_set_python",
+        "py_keep_compatibility",
+        "py_mute",
+        "py_unmute",
+        "py_knowndrivers",
+    )
+):
     set_python = dll.py_set_python
     set_python.restype = None
     set_python.argtypes = None
@@ -804,24 +1256,27 @@ try:
     knowndrivers.restype = ctypes.c_char_p
     knowndrivers.argtypes = None
 
-except Exception:
+else:
     set_python = not_implemented
     keep_compatibility = not_implemented
     mute = not_implemented
     unmute = not_implemented
     knowndrivers = not_implemented
 
-try:
+if CAPABILITIES["py_strict_mode"]:
     strict_mode = dll.py_strict_mode
     strict_mode.restype = None
     strict_mode.argtypes = None
-except Exception:
+else:
     strict_mode = not_implemented
 
 
 log = ctypes.CFUNCTYPE(ctypes.c_void_p, ctypes.c_void_p, c_char_p)
 
-try:
+if all(
+    CAPABILITIES["mag_add_%s_listener" % x]
+    for x in ("warning", "error", "info", "debug")
+):
     warning_log = dll.mag_add_warning_listener
     warning_log.restype = None
     warning_log.argtypes = (ctypes.c_void_p, log)
@@ -837,7 +1292,7 @@ try:
     debug_log = dll.mag_add_debug_listener
     debug_log.restype = None
     debug_log.argtypes = (ctypes.c_void_p, log)
-except Exception:
+else:
     error_log = no_log
     warning_log = no_log
     debug_log = no_log
@@ -15,6 +15,13 @@
 #
 
 import argparse
+import os
+import runpy
+import sys
+import tempfile
+import time
+
+PRODUCTS = ("contour", "coast", "symbols", "wind")
 
 
 def selfcheck():
@@ -26,15 +33,203 @@ def selfcheck():
     print("Your system is ready.")
 
 
+def _field(values, lat, lon):
+    return dict(
+        input_field_initial_latitude=float(lat[0]),
+        input_field_latitude_step=float(lat[1] - lat[0]),
+        input_field_initial_longitude=float(lon[0]),
+        input_field_longitude_step=float(lon[1] - lon[0]),
+    )
+
+
+def product(name, resolution):
+    """Return the actions plotting one of the synthetic PRODUCTS."""
+    from . import macro, synthetic
+
+    if name == "contour":
+        lat, lon, values = synthetic.field(resolution)
+        return [
+            macro.minput(input_field=values, **_field(values, lat, lon)),
+            macro.mcont(contour_automatic_setting="ecmwf"),
+        ]
+    if name == "coast":
+        return [macro.mcoast(map_coastline_resolution="high")]
+    if name == "symbols":
+        n = int(round(360.0 / resolution)) * 10
+        lat, lon, values = synthetic.points(n)
+        return [
+            macro.minput(
+                input_type="geographical",
+                input_latitude_values=lat,
+                input_longitude_values=lon,
+                input_values=values,
+            ),
+            macro.msymb(symbol_type="marker", symbol_advanced_table_selection="on"),
+        ]
+    if name == "wind":
+        lat, lon, u, v = synthetic.wind(resolution)
+        return [
+            macro.minput(
+                input_wind_u_component=u,
+                input_wind_v_component=v,
+                **_field(u, lat, lon)
+            ),
+            macro.mwind(wind_thinning_factor=4.0),
+        ]
+    raise ValueError("Unknown product %r" % (name,))
+
+
+def benchmark(products=PRODUCTS, resolutions=None, repeat=5):
+    """
+    Plot each product at each resolution ``repeat`` times and report the
+    throughput (plots/s, MB/s marshalled) and the latency percentiles.
+    """
+    import numpy
+
+    from . import Magics, macro, synthetic
+
+    if resolutions is None:
+        resolutions = synthetic.RESOLUTIONS
+
+    print("Magics %s (%s)" % (Magics.version().decode(), Magics.get_library_path()))
+    print(
+        "%-10s %10s %8s %10s %10s %10s %10s %10s"
+        % (
+            "product",
+            "resolution",
+            "plots",
+            "plots/s",
+            "MB/s",
+            "p50 ms",
+            "p90 ms",
+            "max ms",
+        )
+    )
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        output = macro.output(
+            output_formats=["png"],
+            output_name_first_page_number="off",
+            output_name=os.path.join(tmp, "benchmark"),
+        )
+        for name in products:
+            for resolution in resolutions:
+                actions = product(name, resolution)
+                latencies = []
+                with Magics.instrument() as stats:
+                    for i in range(repeat):
+                        start = time.perf_counter()
+                        macro.plot(output, macro.mmap(), *actions)
+                        latencies.append(time.perf_counter() - start)
+                    nbytes = sum(s["bytes"] for s in stats.summary().values())
+
+                total = sum(latencies)
+                p50, p90 = numpy.percentile(latencies, [50, 90])
+                result = dict(
+                    product=name,
+                    resolution=resolution,
+                    plots=repeat,
+                    plots_per_second=repeat / total,
+                    mb_per_second=nbytes / total / 1e6,
+                    p50=p50,
+                    p90=p90,
+                    max=max(latencies),
+                )
+                results.append(result)
+                print(
+                    "%-10s %10g %8d %10.2f %10.1f %10.2f %10.2f %10.2f"
+                    % (
+                        name,
+                        resolution,
+                        repeat,
+                        result["plots_per_second"],
+                        result["mb_per_second"],
+                        p50 * 1000,
+                        p90 * 1000,
+                        result["max"] * 1000,
+                    )
+                )
+    return results
+
+
+def profile(script, args=(), output="magics.folded", interval=0.001):
+    """
+    Run a plot script with the instrumentation on, and write the samples of
+    its stack as folded stacks to ``output``.
+    """
+    from . import Magics, flamegraph
+
+    sampler = flamegraph.Sampler(interval)
+    argv = sys.argv
+    sys.argv = [script] + list(args)
+    try:
+        with Magics.instrument() as stats:
+            with sampler:
+                runpy.run_path(script, run_name="__main__")
+    finally:
+        sys.argv = argv
+        sampler.save(output)
+
+    summary = stats.summary()
+    print("%d samples written to %s" % (sampler.samples, output))
+    print("%-24s %8s %10s %12s" % ("binding", "calls", "total ms", "bytes"))
+    for name, s in sorted(summary.items(), key=lambda x: -x[1]["total"]):
+        print(
+            "%-24s %8d %10.2f %12d" % (name, s["calls"], s["total"] * 1000, s["bytes"])
+        )
+    return sampler
+
+
 def main(argv=None):
     parser = argparse.ArgumentParser()
-    parser.add_argument("command", help="Supported commands: selfcheck.")
+    commands = parser.add_subparsers(
+        dest="command", help="Supported commands: selfcheck, benchmark, profile, serve."
+    )
+    commands.required = True
+
+    commands.add_parser("selfcheck", help="Check that libMagPlus can be found.")
+
+    p = commands.add_parser("benchmark", help="Plot synthetic products.")
+    p.add_argument("--product", action="append", choices=PRODUCTS, dest="products")
+    p.add_argument("--resolution", action="append", type=float, dest="resolutions")
+    p.add_argument("--repeat", type=int, default=5)
+
+    p = commands.add_parser("profile", help="Profile a plot script.")
+    p.add_argument("script")
+    p.add_argument("args", nargs=argparse.REMAINDER)
+    p.add_argument("--output", default="magics.folded")
+    p.add_argument("--interval", type=float, default=0.001)
+
+    p = commands.add_parser("serve", help="Serve WMS maps and tiles.")
+    p.add_argument(
+        "--layer",
+        action="append",
+        dest="layers",
+        required=True,
+        help="A layer, as name=path of a GRIB or NetCDF file.",
+    )
+    p.add_argument("--host", default="localhost")
+    p.add_argument("--port", type=int, default=8000)
+    p.add_argument("--workers", type=int, default=None)
+    p.add_argument("--cache-directory", default=None)
+
     args = parser.parse_args(args=argv)
     if args.command == "selfcheck":
         selfcheck()
-    else:
-        raise RuntimeError(
-            "Command not recognised %r. See usage with --help." % args.command
+    elif args.command == "benchmark":
+        benchmark(args.products or PRODUCTS, args.resolutions, args.repeat)
+    elif args.command == "profile":
+        profile(args.script, args.args, args.output, args.interval)
+    elif args.command == "serve":
+        from . import server
+
+        server.serve(
+            [server.layer(x) for x in args.layers],
+            args.host,
+            args.port,
+            workers=args.workers,
+            cache_directory=args.cache_directory,
         )
 
 
@@ -0,0 +1,124 @@
+# (C) Copyright 1996-2016 ECMWF.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+# In applying this licence, ECMWF does not waive the privileges and immunities
+# granted to it by virtue of its status as an intergovernmental organisation nor
+# does it submit to any jurisdiction.
+
+"""
+Asyncio interface: the plots are run by a pool of worker processes and
+awaited without blocking the event loop.
+
+At most ``queue_size`` plans are submitted to the pool at a time, further
+calls wait for a slot, which applies backpressure to the callers. The
+``timeout`` of a call covers the wait for a slot and the plot itself. A
+plan cancelled or timed out before it starts is removed from the pool, a
+running plan is left to finish in its worker, unless it exceeds the
+timeout of the watchdog of the pool (see Magics.workers).
+"""
+
+import asyncio
+import os
+import threading
+import weakref
+
+from . import macro, styles
+from .workers import RenderPool
+
+
+def _plot(args, kwargs):
+    return macro.plot(*args, **kwargs)
+
+
+def _wmsstyles(data):
+    return macro.wmsstyles(data)
+
+
+class PlotPool(object):
+    def __init__(self, workers=None, queue_size=None):
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if queue_size is None:
+            queue_size = 2 * workers
+        self.workers = workers
+        self.queue_size = queue_size
+        self.executor = RenderPool(workers)
+        self.slots = weakref.WeakKeyDictionary()
+
+    def _slots(self):
+        # One semaphore per event loop
+        loop = asyncio.get_event_loop()
+        slots = self.slots.get(loop)
+        if slots is None:
+            slots = self.slots[loop] = asyncio.Semaphore(self.queue_size)
+        return slots
+
+    async def _run(self, fn, *args):
+        slots = self._slots()
+        async with slots:
+            future = self.executor.submit(fn, *args)
+            try:
+                return await asyncio.wrap_future(future)
+            finally:
+                future.cancel()
+
+    async def run(self, fn, *args, timeout=None):
+        """Run fn(*args) in a worker process and return its result."""
+        return await asyncio.wait_for(self._run(fn, *args), timeout)
+
+    async def plot(self, *args, timeout=None, **kwargs):
+        """Run macro.plot(*args, **kwargs) in a worker process."""
+        return await self.run(_plot, args, kwargs, timeout=timeout)
+
+    async def wmsstyles(self, data, timeout=None):
+        """Run macro.wmsstyles(data) in a worker process."""
+        return await self.run(_wmsstyles, data, timeout=timeout)
+
+    def close(self):
+        self.executor.shutdown()
+
+
+pool = None
+_lock = threading.Lock()
+
+
+def default_pool():
+    """Return the pool used by macro.aplot and macro.awmsstyles."""
+    global pool
+    with _lock:
+        if pool is None:
+            pool = PlotPool(
+                int(os.environ.get("MAGICS_WORKERS", os.cpu_count() or 1)),
+            )
+        return pool
+
+
+def set_pool(new):
+    """Use the pool ``new`` for macro.aplot and macro.awmsstyles."""
+    global pool
+    with _lock:
+        previous, pool = pool, new
+    if previous is not None and previous is not new:
+        previous.close()
+
+
+async def aplot(*args, timeout=None, **kwargs):
+    """
+    Execute the actions in a worker process of the default pool, without
+    blocking the event loop. Raise asyncio.TimeoutError if the plot is not
+    done within ``timeout`` seconds.
+    """
+    return await default_pool().plot(*args, timeout=timeout, **kwargs)
+
+
+async def awmsstyles(data, timeout=None):
+    """Return the WMS styles of ``data``, resolved in a worker process if not cached."""
+    key = styles.fingerprint(data)
+    cached = styles.cache.get(key)
+    if cached is not None:
+        return cached
+    result = await default_pool().wmsstyles(data, timeout=timeout)
+    if result:
+        styles.cache.put(key, result)
+    return result
@@ -0,0 +1,103 @@
+# (C) Copyright 1996-2016 ECMWF.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+# In applying this licence, ECMWF does not waive the privileges and immunities
+# granted to it by virtue of its status as an intergovernmental organisation nor
+# does it submit to any jurisdiction.
+
+"""
+JSON encoding of the documents passed to Magics.
+
+orjson is used when it is installed, it serialises numpy arrays and scalars
+natively. Otherwise the standard library json module is used, with a hook
+converting numpy objects to their python equivalents. The encoder can be
+chosen with the MAGICS_JSON_ENCODER environment variable or set_encoder().
+
+The documents decoded from the two encoders are equal, except that:
+
+- NaN is written as ``NaN`` by json (not standard JSON) and as ``null`` by
+  orjson;
+- float32 values are written by orjson with the shortest representation of
+  the float32 (``0.1``), and by json as the float64 of the same value
+  (``0.10000000149011612``): they are equal once read back as float32.
+"""
+
+import json
+import os
+
+import numpy
+
+
+def encode_numpy(np_obj):
+    """
+    Encode numpy objects to their python equivalents.
+    e.g. numpy.int32 -> int
+
+    This is necessary because json is unable to serialize numpy types natively.
+    """
+    if isinstance(np_obj, numpy.ndarray):
+        # Nested array elements are cast from numpy.generic to Python object
+        return np_obj.tolist()
+    elif isinstance(np_obj, numpy.generic):
+        return np_obj.item()
+    else:
+        raise TypeError(
+            "Object of type '{}' is not JSON serializable".format(type(np_obj))
+        )
+
+
+class JsonEncoder(object):
+    name = "json"
+
+    def dumps(self, obj, indent=None):
+        return json.dumps(obj, default=encode_numpy, indent=indent)
+
+
+class OrjsonEncoder(object):
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+
+        self.orjson = orjson
+        self.option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj, indent=None):
+        option = self.option
+        if indent:
+            option |= self.orjson.OPT_INDENT_2
+        return self.orjson.dumps(obj, default=encode_numpy, option=option).decode()
+
+
+encoders = {"json": JsonEncoder()}
+
+try:
+    encoders["orjson"] = OrjsonEncoder()
+except ImportError:
+    pass
+
+
+def default_encoder():
+    name = os.environ.get("MAGICS_JSON_ENCODER")
+    if name is not None:
+        return encoders[name]
+    return encoders.get("orjson", encoders["json"])
+
+
+encoder = default_encoder()
+
+
+def set_encoder(name):
+    """
+    Select the encoder used by dumps(), by name or as an object with a
+    ``dumps(obj, indent=None)`` method.
+    """
+    global encoder
+    if isinstance(name, str):
+        name = encoders[name]
+    encoder = name
+
+
+def dumps(obj, indent=None):
+    return encoder.dumps(obj, indent=indent)
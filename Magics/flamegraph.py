@@ -0,0 +1,106 @@
+# (C) Copyright 1996-2016 ECMWF.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+# In applying this licence, ECMWF does not waive the privileges and immunities
+# granted to it by virtue of its status as an intergovernmental organisation nor
+# does it submit to any jurisdiction.
+
+"""
+Sampling profiler writing folded stacks, the input format of flamegraph.pl,
+speedscope and inferno.
+
+The stack of the profiled thread is sampled at a fixed interval. The trace
+spans open at the time of the sample (plot, init, execute of each action,
+finalize) are appended to the Python frames, so that the time spent in
+libMagPlus is attributed to the action being executed.
+"""
+
+import collections
+import os
+import sys
+import threading
+import time
+
+from . import trace
+
+
+def _frame(frame):
+    code = frame.f_code
+    return "%s (%s:%d)" % (
+        code.co_name,
+        os.path.basename(code.co_filename),
+        code.co_firstlineno,
+    )
+
+
+def _span(span):
+    if span.verb is not None:
+        return "[magics] %s %s" % (span.name, span.verb)
+    return "[magics] %s" % (span.name,)
+
+
+class Sampler(object):
+    def __init__(self, interval=0.001, thread=None):
+        if thread is None:
+            thread = threading.current_thread()
+        self.interval = interval
+        self.ident = thread.ident
+        self.stacks = collections.Counter()
+        self.spans = {}
+        self.samples = 0
+        self.running = False
+        self.thread = None
+
+    # Trace listener, keeps the spans open in each thread
+
+    def start(self, span):
+        self.spans.setdefault(span.thread, []).append(span)
+
+    def end(self, span):
+        stack = self.spans.get(span.thread)
+        if stack:
+            stack.pop()
+
+    def sample(self):
+        frame = sys._current_frames().get(self.ident)
+        if frame is None:
+            return
+        frames = []
+        while frame is not None:
+            frames.append(_frame(frame))
+            frame = frame.f_back
+        frames.reverse()
+        frames.extend(_span(s) for s in list(self.spans.get(self.ident, ())))
+        self.stacks[";".join(frames)] += 1
+        self.samples += 1
+
+    def run(self):
+        while self.running:
+            self.sample()
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        trace.add_listener(self)
+        self.running = True
+        self.thread = threading.Thread(
+            target=self.run, name="magics-sampler", daemon=True
+        )
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.running = False
+        self.thread.join()
+        self.thread = None
+        trace.remove_listener(self)
+
+    def folded(self):
+        """Return the samples as folded stacks, one ``frames count`` per line."""
+        return "".join(
+            "%s %d\n" % (stack, count) for stack, count in sorted(self.stacks.items())
+        )
+
+    def save(self, path):
+        with open(path, "w") as f:
+            f.write(self.folded())
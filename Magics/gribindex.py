@@ -0,0 +1,501 @@
+# (C) Copyright 1996-2016 ECMWF.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+# In applying this licence, ECMWF does not waive the privileges and immunities
+# granted to it by virtue of its status as an intergovernmental organisation nor
+# does it submit to any jurisdiction.
+
+"""
+Python side indexing of GRIB files.
+
+The messages are found from the lengths in their section 0, in one pass
+over the file. For each message, the offset, length and a few keys are
+recorded: shortName, level, typeOfLevel, step, date and time. The keys are
+decoded from the headers by this module (common parameters of the WMO and
+ECMWF tables only), or by eccodes if it is installed and ``decoder`` is
+"eccodes".
+
+The index is saved next to the file (``<file>.magidx``), or in the Magics
+cache directory if the directory of the file is not writable, and is used
+again as long as the size and mtime of the file do not change. Fields are
+selected by shortName, level and step with a dict lookup, and can be passed
+to mgrib by position or as a byte-range extract of the message.
+"""
+
+import hashlib
+import json
+import os
+import struct
+
+CHUNK = 65536
+VERSION = 2
+
+# indicatorOfParameter -> shortName, edition 1, ECMWF local table 128
+ECMWF_TABLE = {
+    34: "sst",
+    129: "z",
+    130: "t",
+    131: "u",
+    132: "v",
+    133: "q",
+    134: "sp",
+    135: "w",
+    138: "vo",
+    141: "sd",
+    151: "msl",
+    155: "d",
+    157: "r",
+    164: "tcc",
+    165: "10u",
+    166: "10v",
+    167: "2t",
+    168: "2d",
+    228: "tp",
+}
+
+WMO_TABLE = {
+    1: "pres",
+    2: "prmsl",
+    7: "gh",
+    11: "t",
+    33: "u",
+    34: "v",
+    51: "q",
+    52: "r",
+    61: "tp",
+    71: "tcc",
+}
+
+# table2Version -> names of the local tables, the WMO names are used for the
+# tables below 128, the other local tables are named "table.parameter"
+LOCAL_TABLES = {128: ECMWF_TABLE}
+
+# Hours in the units of time range common to both editions, but the minute
+HOURS = {1: 1, 2: 24, 10: 3, 11: 6, 12: 12}
+
+# (discipline, parameterCategory, parameterNumber) -> shortName, edition 2
+GRIB2_TABLE = {
+    (0, 0, 0): "t",
+    (0, 0, 6): "dpt",
+    (0, 1, 0): "q",
+    (0, 1, 1): "r",
+    (0, 1, 8): "tp",
+    (0, 2, 2): "u",
+    (0, 2, 3): "v",
+    (0, 2, 8): "w",
+    (0, 3, 0): "sp",
+    (0, 3, 1): "msl",
+    (0, 3, 4): "z",
+    (0, 3, 5): "gh",
+    (0, 6, 1): "tcc",
+    (10, 3, 0): "sst",
+}
+
+# Parameters named after the height above ground
+HEIGHT_NAMES = {
+    ("t", 2): "2t",
+    ("dpt", 2): "2d",
+    ("u", 10): "10u",
+    ("v", 10): "10v",
+}
+
+GRIB1_LEVELS = {
+    1: "surface",
+    100: "isobaricInhPa",
+    102: "meanSea",
+    105: "heightAboveGround",
+    109: "hybrid",
+}
+
+GRIB2_LEVELS = {
+    1: "surface",
+    100: "isobaricInhPa",
+    101: "meanSea",
+    103: "heightAboveGround",
+    105: "hybrid",
+}
+
+
+####################################################################
+#
+# Scanning
+#
+
+
+def messages(f):
+    """
+    Yield the offset, length and edition of each GRIB message of the open
+    binary file ``f``, skipping any padding between messages.
+    """
+    offset = 0
+    while True:
+        f.seek(offset)
+        header = f.read(16)
+        if len(header) < 8:
+            return
+        if not header.startswith(b"GRIB"):
+            data = header + f.read(CHUNK)
+            start = data.find(b"GRIB")
+            if start < 0:
+                if len(data) < 4:
+                    return
+                # Keep the last bytes, in case "GRIB" spans two chunks
+                offset += len(data) - 3
+            else:
+                offset += start
+            continue
+        edition = header[7]
+        if edition == 1:
+            length = struct.unpack(">I", b"\0" + header[4:7])[0]
+        else:
+            length = struct.unpack(">Q", header[8:16])[0]
+        if length < 8:
+            # Corrupt or truncated: the scan would not move forward
+            raise ValueError(
+                "Invalid GRIB message length %d at offset %d" % (length, offset)
+            )
+        yield offset, length, edition
+        offset += length
+
+
+def scan(path):
+    """Return the offset, length and edition of each message of a GRIB file."""
+    with open(path, "rb") as f:
+        return list(messages(f))
+
+
+def count(path):
+    """Return the number of messages of a GRIB file."""
+    return len(scan(path))
+
+
+def read(path, position):
+    """Return the message at ``position`` (1-based) of a GRIB file, or None."""
+    with open(path, "rb") as f:
+        for offset, length, edition in messages(f):
+            position -= 1
+            if position == 0:
+                f.seek(offset)
+                return f.read(length)
+    return None
+
+
+####################################################################
+#
+# Decoding of the keys
+#
+
+
+def _number(data):
+    return int.from_bytes(data, "big")
+
+
+def _signed(data):
+    # GRIB signed integers: sign bit and magnitude
+    value = _number(data)
+    sign = 1 << (8 * len(data) - 1)
+    return -(value & ~sign) if value & sign else value
+
+
+def _step(value, unit):
+    # Steps are given in hours
+    if unit == 0:
+        return value / 60.0
+    if unit not in HOURS:
+        raise ValueError("Unsupported unit of time range %d" % (unit,))
+    return value * HOURS[unit]
+
+
+def decode1(f, offset):
+    """Return the keys of the edition 1 message at ``offset``."""
+    f.seek(offset + 8)
+    pds = f.read(28)
+    table = pds[3]
+    parameter = pds[8]
+    level_type = pds[9]
+    if level_type in (100, 102, 103, 105, 109, 1):
+        level = _number(pds[10:12])
+    else:
+        level = pds[10]
+
+    p1, p2, indicator = pds[18], pds[19], pds[20]
+    if indicator == 10:
+        step = _number(pds[18:20])
+    elif indicator in (2, 3, 4, 5):
+        step = p2
+    else:
+        step = p1
+
+    if table < 128:
+        name = WMO_TABLE.get(parameter)
+    else:
+        name = LOCAL_TABLES.get(table, {}).get(parameter)
+    century = pds[24] or 21
+    year = (century - 1) * 100 + pds[12]
+    return dict(
+        shortName=name or "%d.%d" % (table, parameter),
+        paramId="%d.%d" % (table, parameter),
+        typeOfLevel=GRIB1_LEVELS.get(level_type, str(level_type)),
+        level=level,
+        step=_step(step, pds[17]),
+        date=year * 10000 + pds[13] * 100 + pds[14],
+        time=pds[15] * 100 + pds[16],
+    )
+
+
+def sections(f, offset, length, numbers=(1, 4)):
+    """
+    Yield the number and the content of the sections ``numbers`` of the
+    edition 2 message at ``offset``, up to section 4. The other sections
+    are skipped by their length, without being read.
+    """
+    position = offset + 16
+    end = offset + length
+    while position + 5 <= end:
+        f.seek(position)
+        header = f.read(5)
+        if header[:4] == b"7777":
+            return
+        size, number = struct.unpack(">IB", header)
+        if size < 5:
+            return
+        if number in numbers:
+            f.seek(position)
+            yield number, f.read(size)
+        if number >= 4:
+            return
+        position += size
+
+
+def decode2(f, offset, length):
+    """Return the keys of the edition 2 message at ``offset``."""
+    f.seek(offset + 6)
+    discipline = f.read(1)[0]
+    keys = {}
+    for number, section in sections(f, offset, length):
+        if number == 1:
+            keys["date"] = (
+                _number(section[12:14]) * 10000 + section[14] * 100 + section[15]
+            )
+            keys["time"] = section[16] * 100 + section[17]
+        else:
+            template = _number(section[7:9])
+            size = {8: 53, 11: 56}.get(template, 28)
+            if len(section) < size:
+                raise ValueError(
+                    "Truncated section 4 (template 4.%d, %d bytes) at offset %d"
+                    % (template, len(section), offset)
+                )
+            category, parameter = section[9], section[10]
+            unit = section[17]
+            step = _signed(section[18:22])
+            if template in (8, 11):
+                # End of the statistical processing
+                start = 49 if template == 8 else 52
+                end = start + 4
+                step += _signed(section[start:end])
+            surface = section[22]
+            scale = _signed(section[23:24])
+            level = _signed(section[24:28])
+            if scale:
+                level = level / 10.0**scale
+            if surface == 100:
+                level = level / 100.0
+            if level == int(level):
+                level = int(level)
+
+            name = GRIB2_TABLE.get((discipline, category, parameter))
+            if surface == 103:
+                name = HEIGHT_NAMES.get((name, level), name)
+            keys.update(
+                shortName=name or "%d.%d.%d" % (discipline, category, parameter),
+                paramId="%d.%d.%d" % (discipline, category, parameter),
+                typeOfLevel=GRIB2_LEVELS.get(surface, str(surface)),
+                level=level,
+                step=_step(step, unit),
+            )
+    return keys
+
+
+def decode_eccodes(f, offset, length):
+    """Return the keys of the message at ``offset``, decoded by eccodes."""
+    import eccodes
+
+    f.seek(offset)
+    handle = eccodes.codes_new_from_message(f.read(length))
+    try:
+        return dict(
+            (key, eccodes.codes_get(handle, key))
+            for key in (
+                "shortName",
+                "paramId",
+                "typeOfLevel",
+                "level",
+                "step",
+                "date",
+                "time",
+            )
+        )
+    finally:
+        eccodes.codes_release(handle)
+
+
+####################################################################
+#
+# Index
+#
+
+
+def _stat(path):
+    stat = os.stat(path)
+    return dict(size=stat.st_size, mtime=stat.st_mtime)
+
+
+def sidecars(path):
+    """Return the possible paths of the index of a GRIB file."""
+    from .Magics import cache_directory
+
+    result = [path + ".magidx"]
+    try:
+        digest = hashlib.sha1(os.path.realpath(path).encode()).hexdigest()
+        result.append(os.path.join(cache_directory(), "gribindex", digest + ".json"))
+    except OSError:
+        pass
+    return result
+
+
+class GribIndex(object):
+    """The messages of a GRIB file, with their keys."""
+
+    def __init__(self, path, messages):
+        self.path = path
+        self.messages = messages
+        self.keys = {}
+        for message in messages:
+            key = (message["shortName"], message["level"], message["step"])
+            self.keys.setdefault(key, []).append(message)
+
+    @classmethod
+    def build(cls, path, decoder="builtin"):
+        """Scan a GRIB file and decode the keys of each message."""
+        result = []
+        with open(path, "rb") as f:
+            for i, (offset, length, edition) in enumerate(list(messages(f))):
+                if decoder == "eccodes":
+                    keys = decode_eccodes(f, offset, length)
+                elif edition == 1:
+                    keys = decode1(f, offset)
+                else:
+                    keys = decode2(f, offset, length)
+                keys.update(position=i + 1, offset=offset, length=length)
+                keys["edition"] = edition
+                result.append(keys)
+        return cls(path, result)
+
+    @classmethod
+    def open(cls, path, decoder="builtin"):
+        """Return the index of a GRIB file, from its sidecar file if up to date."""
+        from .Magics import write_atomic
+
+        stat = _stat(path)
+        candidates = sidecars(path)
+        for sidecar in candidates:
+            try:
+                with open(sidecar) as f:
+                    saved = json.load(f)
+                if (
+                    saved["version"] == VERSION
+                    and saved["file"] == stat
+                    and saved["decoder"] == decoder
+                ):
+                    return cls(path, saved["messages"])
+            except (IOError, OSError, ValueError, KeyError):
+                pass
+
+        index = cls.build(path, decoder)
+        saved = dict(
+            version=VERSION, file=stat, decoder=decoder, messages=index.messages
+        )
+        for sidecar in candidates:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(sidecar)), exist_ok=True)
+                write_atomic(sidecar, json.dumps(saved))
+                break
+            except (IOError, OSError):
+                continue
+        return index
+
+    def __len__(self):
+        return len(self.messages)
+
+    def __iter__(self):
+        return iter(self.messages)
+
+    def select(self, shortName=None, level=None, step=None, **keys):
+        """Return the messages matching the keys."""
+        if shortName is not None and level is not None and step is not None:
+            candidates = self.keys.get((shortName, level, step), [])
+        else:
+            candidates = self.messages
+            keys.update(shortName=shortName, level=level, step=step)
+        return [
+            m
+            for m in candidates
+            if all(v is None or m.get(k) == v for k, v in keys.items())
+        ]
+
+    def position(self, **keys):
+        """Return the position (from 1) of the first message matching the keys."""
+        found = self.select(**keys)
+        if not found:
+            raise KeyError("No GRIB message matching %s in %s" % (keys, self.path))
+        return found[0]["position"]
+
+    def extract(self, directory=None, **keys):
+        """
+        Copy the first message matching the keys to a file of its own in
+        ``directory`` (the Magics cache directory by default) and return
+        its path.
+        """
+        from .Magics import cache_directory, write_atomic
+
+        message = self.select(**keys)
+        if not message:
+            raise KeyError("No GRIB message matching %s in %s" % (keys, self.path))
+        message = message[0]
+
+        if directory is None:
+            directory = os.path.join(cache_directory(), "gribindex")
+        os.makedirs(directory, exist_ok=True)
+        stat = _stat(self.path)
+        digest = hashlib.sha1(
+            repr(
+                (os.path.realpath(self.path), stat["mtime"], message["offset"])
+            ).encode()
+        ).hexdigest()
+        path = os.path.join(directory, digest + ".grib")
+        if not os.path.exists(path):
+            with open(self.path, "rb") as f:
+                f.seek(message["offset"])
+                data = f.read(message["length"])
+            write_atomic(path, data)
+        return path
+
+    def mgrib(self, extract=False, **keys):
+        """
+        Return an mgrib action for the first message matching ``keys``,
+        by position in the file, or as a byte-range extract.
+        """
+        from . import macro
+
+        if extract:
+            return macro.mgrib(grib_input_file_name=self.extract(**keys))
+        return macro.mgrib(
+            grib_input_file_name=self.path, grib_field_position=self.position(**keys)
+        )
+
+
+def index(path, decoder="builtin"):
+    """Return the index of a GRIB file, see GribIndex.open."""
+    return GribIndex.open(path, decoder)
@@ -0,0 +1,207 @@
+# (C) Copyright 1996-2016 ECMWF.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+# In applying this licence, ECMWF does not waive the privileges and immunities
+# granted to it by virtue of its status as an intergovernmental organisation nor
+# does it submit to any jurisdiction.
+
+"""
+Asynchronous handling of the messages sent by libMagPlus.
+
+The listeners called by libMagPlus only append the raw message to a bounded
+buffer. A background thread decodes the messages and passes them to the
+``Magics`` logger. Within each ``period``, a message is logged at most
+``burst`` times; the number of further repetitions is logged at the end of
+the period, even if no other message arrives.
+"""
+
+import atexit
+import collections
+import logging
+import threading
+import time
+
+LEVELS = {
+    "error": logging.ERROR,
+    "warning": logging.WARNING,
+    "info": logging.INFO,
+    "debug": logging.DEBUG,
+}
+
+
+def decode(msg):
+    try:
+        return msg.decode().rstrip()
+    except Exception:
+        return str(msg)
+
+
+class LogPipeline(object):
+    def __init__(self, logger=None, capacity=10000, period=1.0, burst=5, interval=0.05):
+        if logger is None:
+            logger = logging.getLogger("Magics")
+        self.logger = logger
+        self.capacity = capacity
+        self.period = period
+        self.burst = burst
+        self.interval = interval
+
+        self.buffer = collections.deque()
+        self.received = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.suppressed = 0
+
+        self.counts = {}
+        self.window = time.monotonic()
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.running = False
+        self.thread = None
+
+    def push(self, level, msg):
+        # Called by the listeners with the GIL held: keep it short
+        self.received += 1
+        if len(self.buffer) >= self.capacity:
+            self.dropped += 1
+            return
+        self.buffer.append((level, msg))
+
+    def start(self):
+        if self.thread is None:
+            self.running = True
+            self.thread = threading.Thread(
+                target=self.run, name="magics-log", daemon=True
+            )
+            self.thread.start()
+        return self
+
+    def stop(self):
+        if self.thread is not None:
+            self.running = False
+            self.wake.set()
+            self.thread.join()
+            self.thread = None
+        self.flush()
+
+    def run(self):
+        while self.running:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            self.drain()
+            with self.lock:
+                self.expire()
+
+    def drain(self):
+        with self.lock:
+            while True:
+                try:
+                    level, msg = self.buffer.popleft()
+                except IndexError:
+                    break
+                self.emit(level, msg)
+
+    def flush(self):
+        """Log all the pending messages and the pending repeat counts."""
+        self.drain()
+        with self.lock:
+            self.repeats()
+
+    def expire(self):
+        # Log the repeat counts of the period if it is over
+        now = time.monotonic()
+        if now - self.window >= self.period:
+            self.repeats()
+            self.window = now
+
+    def emit(self, level, msg):
+        self.expire()
+
+        key = (level, msg)
+        count = self.counts.get(key, 0) + 1
+        self.counts[key] = count
+        if count > self.burst:
+            self.suppressed += 1
+            return
+
+        self.delivered += 1
+        self.logger.log(LEVELS.get(level, logging.INFO), decode(msg))
+
+    def repeats(self):
+        for (level, msg), count in self.counts.items():
+            if count > self.burst:
+                self.logger.log(
+                    LEVELS.get(level, logging.INFO),
+                    "%s [repeated %d more times]",
+                    decode(msg),
+                    count - self.burst,
+                )
+        self.counts = {}
+
+    def stats(self):
+        return dict(
+            received=self.received,
+            delivered=self.delivered,
+            dropped=self.dropped,
+            suppressed=self.suppressed,
+            pending=len(self.buffer),
+        )
+
+
+class Diagnostics(object):
+    """
+    Messages sent by libMagPlus while rendering one plot: the number of
+    messages of each level and the first ``samples`` messages.
+    """
+
+    def __init__(self, samples=20):
+        self.samples = samples
+        self.counts = dict((level, 0) for level in LEVELS)
+        self.messages = []
+
+    def add(self, level, msg):
+        self.counts[level] = self.counts.get(level, 0) + 1
+        if len(self.messages) < self.samples:
+            self.messages.append((level, decode(msg)))
+
+    @property
+    def errors(self):
+        return self.counts["error"]
+
+    @property
+    def warnings(self):
+        return self.counts["warning"]
+
+    def to_dict(self):
+        return dict(
+            counts=dict(self.counts),
+            messages=[dict(level=level, message=msg) for level, msg in self.messages],
+        )
+
+    def __repr__(self):
+        return "Diagnostics(%s)" % (
+            ", ".join("%s=%d" % (k, v) for k, v in self.counts.items()),
+        )
+
+
+pipeline = None
+
+
+def start(**kwargs):
+    """Start passing the messages of libMagPlus to the logging module."""
+    global pipeline
+    if pipeline is None:
+        pipeline = LogPipeline(**kwargs).start()
+    return pipeline
+
+
+def stop():
+    """Go back to printing the messages of libMagPlus."""
+    global pipeline
+    if pipeline is not None:
+        pipeline.stop()
+        pipeline = None
+
+
+atexit.register(stop)
@@ -6,6 +6,8 @@
 # granted to it by virtue of its status as an intergovernmental organisation nor
 # does it submit to any jurisdiction.
 
+import contextlib
+import copy
 import json
 import os
 import sys
@@ -14,7 +16,9 @@ import threading
 
 import numpy
 
-from . import Magics
+from . import memprofile  # noqa: F401 (enabled by MAGICS_MEMPROFILE)
+from . import Magics, encoding, logs, styles, thinning, trace
+from .encoding import encode_numpy  # noqa: F401
 
 LOCK = threading.RLock()
 
@@ -65,36 +69,39 @@ def keep_compatibility():
         Magics.keep_compatibility()
 
 
-@Magics.log
-def warning(int, msg):
+diagnostics = None
+
+
+def _log(level, msg):
+    if diagnostics is not None:
+        diagnostics.add(level, msg)
+    if logs.pipeline is not None:
+        logs.pipeline.push(level, msg)
+        return
     try:
         print(msg.decode().rstrip())
     except Exception:
         print(msg)
 
 
+@Magics.log
+def warning(int, msg):
+    _log("warning", msg)
+
+
 @Magics.log
 def error(int, msg):
-    try:
-        print(msg.decode().rstrip())
-    except Exception:
-        print(msg)
+    _log("error", msg)
 
 
 @Magics.log
 def info_log(int, msg):
-    try:
-        print(msg.decode().rstrip())
-    except Exception:
-        print(msg)
+    _log("info", msg)
 
 
 @Magics.log
 def debug_log(int, msg):
-    try:
-        print(msg.decode().rstrip())
-    except Exception:
-        print(msg)
+    _log("debug", msg)
 
 
 Magics.warning_log(3, warning)
@@ -109,6 +116,22 @@ def info():
     Magics.info_log(3, info_log)
 
 
+def use_logging(enable=True, **kwargs):
+    """
+    Pass the messages of Magics to the ``Magics`` logger from a background
+    thread instead of printing them, see Magics.logs.LogPipeline for the
+    options. Returns the pipeline, whose stats() counts the dropped and
+    suppressed messages.
+    """
+    if enable:
+        return logs.start(**kwargs)
+    logs.stop()
+
+
+if os.environ.get("MAGICS_LOG_PIPELINE", "off") in ("on", "1", "yes"):
+    use_logging()
+
+
 actions = {
     "mobs": "pobs",
     "mcoast": "pcoast",
@@ -140,6 +163,13 @@ actions = {
     "pinput": "pinput",
 }
 
+# Parameters handled by the Python layer, they are never passed to Magics
+python_parameters = ("input_thinning", "input_thinning_cell_size")
+
+
+def _is_on(value):
+    return value is True or value in ("on", "true", "yes")
+
 
 class Action(object):
     def __init__(self, verb, action, html, args):
@@ -150,6 +180,7 @@ class Action(object):
             args["output_formats"] = ["png"]
 
         self.args = args
+        self.strings = {}
         if html == "":
             self.html = verb
         else:
@@ -164,6 +195,19 @@ class Action(object):
             x = x + " %s = '%s'\n" % (key, self.args[key])
         return x
 
+    def __getstate__(self):
+        # The Magics function is pickled by name, for the worker processes
+        state = dict(self.__dict__)
+        state["strings"] = {}
+        if self.action is not None:
+            state["action"] = _function_names()[id(self.action)]
+        return state
+
+    def __setstate__(self, state):
+        if state["action"] is not None:
+            state["action"] = getattr(Magics, state["action"])
+        self.__dict__.update(state)
+
     def inspect(self):
         print(self)
 
@@ -222,11 +266,38 @@ class Action(object):
                 return "float"
         return "int"
 
+    def encode_strings(self, key):
+        """
+        Return the list parameter ``key`` ready to be passed to Magics.set1c,
+        lists of dictionaries are encoded to JSON. The result is cached until
+        the value of the parameter changes.
+        """
+        value = self.args[key]
+        cached = self.strings.get(key)
+        try:
+            unchanged = cached is not None and cached[0] == value
+        except (ValueError, TypeError):
+            # The arrays in the dictionaries cannot be compared, encode again
+            unchanged = False
+        if unchanged:
+            return cached[1]
+
+        # A deep copy, so that a nested value changed in place is seen
+        snapshot = copy.deepcopy(value)
+        if isinstance(value[0], dict):
+            strings = Magics.StringArray([encoding.dumps(p) for p in value])
+        else:
+            strings = Magics.StringArray(value)
+        self.strings[key] = (snapshot, strings)
+        return strings
+
     def set(self):  # noqa C901
         for key in list(self.args.keys()):
 
-            if isinstance(self.args[key], dict):
-                Magics.setc(key, json.dumps(self.args[key]))
+            if key in python_parameters:
+                continue
+            elif isinstance(self.args[key], dict):
+                Magics.setc(key, encoding.dumps(self.args[key]))
             elif isinstance(self.args[key], bool):
                 if self.args[key]:
                     Magics.setc(key, "on")
@@ -242,13 +313,8 @@ class Action(object):
             elif isinstance(self.args[key], float):
                 Magics.setr(key, self.args[key])
             elif isinstance(self.args[key], list) and len(self.args[key]):
-                if isinstance(self.args[key][0], str):
-                    Magics.set1c(key, self.args[key])
-                elif isinstance(self.args[key][0], dict):
-                    np = []
-                    for p in self.args[key]:
-                        np.append(json.dumps(p))
-                    Magics.set1c(key, np)
+                if isinstance(self.args[key][0], (str, dict)):
+                    Magics.set1c(key, self.encode_strings(key))
                 else:
                     type = self.find_type(self.args[key])
                     if type == "int":
@@ -256,43 +322,78 @@ class Action(object):
                     else:
                         Magics.set1r(key, numpy.array(self.args[key]))
             elif isinstance(self.args[key], numpy.ndarray):
-                type = self.args[key].dtype
-                data = self.args[key].copy()
+                data = self.args[key]
                 size = data.shape
                 dim = len(size)
                 type = self.find_type(self.args[key])
                 if type == "int":
                     if dim == 2:
-                        Magics.set2i(key, data.astype(numpy.int64), size[0], size[1])
+                        Magics.set2i(key, data, size[0], size[1])
                     else:
-                        Magics.set1i(key, data.astype(numpy.int64), size[0])
+                        Magics.set1i(key, data)
                 elif type == "float":
+                    # float32 is kept as is, Magics.set1r/set2r convert if needed
                     if dim == 2:
-                        Magics.set2r(key, data.astype(numpy.float64), size[1], size[0])
+                        Magics.set2r(key, data, size[1], size[0])
                     else:
-                        Magics.set1r(key, data.astype(numpy.float64))
+                        Magics.set1r(key, data)
                 else:
                     print("can not interpret type %s for %s ???->", (type, key))
             else:
                 self.args[key].execute(key)
 
+    def thin(self, projection=None):
+        """
+        Return a copy of this action keeping at most one point per screen cell
+        of the subpage described by the mmap action ``projection``.
+        Every list parameter with one value per point is thinned.
+        """
+        points = thinning.coordinates(self.args)
+        if projection is not None:
+            projection = projection.args
+        corners = thinning.area(projection)
+        if points is None or corners is None:
+            return self
+        latitudes, longitudes = points
+
+        cell_size = self.args.get("input_thinning_cell_size", thinning.CELL_SIZE)
+        index = thinning.grid_thin(
+            latitudes, longitudes, corners, thinning.cells(projection, cell_size)
+        )
+
+        size = len(latitudes)
+        args = {}
+        for key, value in self.args.items():
+            if isinstance(value, (list, tuple, numpy.ndarray)) and len(value) == size:
+                value = thinning.subset(value, index)
+            args[key] = value
+
+        thinned = copy.copy(self)
+        thinned.args = args
+        thinned.strings = {}
+        return thinned
+
     def execute(self):
 
         if self.action != Magics.odb:
             self.args = self.clean_object(self.args)
 
-        self.set()
+        with trace.span("set", self.verb, self.args):
+            self.set()
 
         if self.action is not None:
             if self.action != Magics.new_page:
                 if self.action == Magics.legend:
                     Magics.setc("legend", "on")
-                self.action()
+                with trace.span("call", self.verb):
+                    self.action()
                 if self.action != Magics.obs and self.action != Magics.minput:
-                    for key in list(self.args.keys()):
-                        Magics.reset(key)
+                    with trace.span("reset", self.verb):
+                        for key in list(self.args.keys()):
+                            Magics.reset(key)
             else:
-                self.action("page")
+                with trace.span("call", self.verb):
+                    self.action("page")
 
     def style(self):
 
@@ -310,26 +411,8 @@ class Action(object):
             return Magics.metainput()
 
 
-def encode_numpy(np_obj):
-    """
-    Encode numpy objects to their python equivalents.
-    e.g. numpy.int32 -> int
-
-    This is necessary because json is unable to serialize numpy types natively.
-    """
-    if isinstance(np_obj, numpy.ndarray):
-        # Nested array elements are cast from numpy.generic to Python object
-        return np_obj.tolist()
-    elif isinstance(np_obj, numpy.generic):
-        return np_obj.item()
-    else:
-        raise TypeError(
-            "Object of type '{}' is not JSON serializable".format(type(np_obj))
-        )
-
-
 def detect(attributes, dimension):
-    return Magics.detect(json.dumps(attributes, default=encode_numpy), dimension)
+    return Magics.detect(encoding.dumps(attributes), dimension)
 
 
 def detect_lat_lon(xarray_dataset, ds_attributes):
@@ -342,6 +425,16 @@ def detect_lat_lon(xarray_dataset, ds_attributes):
     return lat_name, lon_name
 
 
+def is_netcdf(path):
+    """Return True if the file is NetCDF (classic or HDF5 based), from its magic bytes."""
+    try:
+        with open(path, "rb") as f:
+            magic = f.read(4)
+    except (IOError, OSError):
+        return False
+    return magic.startswith(b"CDF") or magic == b"\x89HDF"
+
+
 def mxarray(xarray_dataset, xarray_variable_name, xarray_dimension_settings={}):
     """
     Convert an xarray dataset containing a variable with latitude and longitude data into
@@ -402,16 +495,25 @@ def _mxarray(
             )
 
 
+def _as_float(values):
+    # float32 data is passed through to Magics, anything else becomes float64
+    if values.dtype == numpy.float32:
+        return values
+    return values.astype(numpy.float64, copy=False)
+
+
 def _mxarray_1d(
     xarray_dataset, xarray_variable_name, lat_name, lon_name, xarray_dimension_settings
 ):
-    lat = xarray_dataset[lat_name].values.astype(numpy.float64)
-    lon = xarray_dataset[lon_name].values.astype(numpy.float64)
-    input_field_values = _mxarray_flatten(
-        xarray_dataset[xarray_variable_name],
-        xarray_dimension_settings,
-        [lat_name, lon_name],
-    ).values.astype(numpy.float64)
+    lat = _as_float(xarray_dataset[lat_name].values)
+    lon = _as_float(xarray_dataset[lon_name].values)
+    input_field_values = _as_float(
+        _mxarray_flatten(
+            xarray_dataset[xarray_variable_name],
+            xarray_dimension_settings,
+            [lat_name, lon_name],
+        ).values
+    )
 
     data = minput(
         input_field=input_field_values,
@@ -430,11 +532,15 @@ def _mxarray_2d(
     xarray_dimension_settings,
     dims_to_ignore,
 ):
-    lat = xarray_dataset[lat_name].values.astype(numpy.float64)
-    lon = xarray_dataset[lon_name].values.astype(numpy.float64)
-    input_field_values = _mxarray_flatten(
-        xarray_dataset[xarray_variable_name], xarray_dimension_settings, dims_to_ignore
-    ).values.astype(numpy.float64)
+    lat = _as_float(xarray_dataset[lat_name].values)
+    lon = _as_float(xarray_dataset[lon_name].values)
+    input_field_values = _as_float(
+        _mxarray_flatten(
+            xarray_dataset[xarray_variable_name],
+            xarray_dimension_settings,
+            dims_to_ignore,
+        ).values
+    )
 
     data = minput(
         input_field=input_field_values,
@@ -480,6 +586,17 @@ def _mxarray_flatten(xarray_dataset, dims_to_flatten, dims_to_ignore):
     return xarray_dataset
 
 
+_names = {}
+
+
+def _function_names():
+    if not _names:
+        for name, value in vars(Magics).items():
+            if callable(value) and not name.startswith("_"):
+                _names.setdefault(id(value), name)
+    return _names
+
+
 def make_action(verb, action, html=""):
     def f(_m=None, **kw):
         args = {}
@@ -561,12 +678,37 @@ def examine(*args):
             break
 
 
+def _flatten(args):
+    for n in args:
+        if isinstance(n, (list, tuple)):
+            for x in _flatten(n):
+                yield x
+        else:
+            yield n
+
+
+def _thin(args):
+    # Apply the Python side thinning of the minput actions, using the area of
+    # the last mmap action seen before them.
+    projection = None
+    actions = []
+    for n in _flatten(args):
+        verb = getattr(n, "verb", None)
+        if verb in ("mmap", "pmap"):
+            projection = n
+        elif verb in ("minput", "pinput") and _is_on(n.args.get("input_thinning")):
+            n = n.thin(projection)
+        actions.append(n)
+    return actions
+
+
 def _execute(o):
     if isinstance(o, (list, tuple)):
         for x in o:
             _execute(x)
     else:
-        o.execute()
+        with trace.span("execute", getattr(o, "verb", None)):
+            o.execute()
 
 
 def _plot(*args):
@@ -584,14 +726,20 @@ def _plot(*args):
         print(yaml.dump(dict(plot=actions), default_flow_style=False))
         return
 
-    context.set()
-    # try :
-    Magics.init()
-    for n in args:
-        _execute(n)
+    with trace.span("plot"):
+        args = _thin(args)
+
+        context.set()
+        # try :
+        with trace.span("init"):
+            Magics.init()
+        for n in args:
+            _execute(n)
+
+        # Collect the drivers!
+        with trace.span("finalize"):
+            Magics.finalize()
 
-    # Collect the drivers!
-    Magics.finalize()
     for f in context.tmp:
         if os.path.exists(f):
             os.remove(f)
@@ -693,7 +841,36 @@ def _jplot(*args):
     return image
 
 
+@contextlib.contextmanager
+def capture(samples=20):
+    """
+    Collect the messages sent by Magics within the block into a
+    Magics.logs.Diagnostics object.
+    """
+    global diagnostics
+    with LOCK:
+        previous = diagnostics
+        diagnostics = logs.Diagnostics(samples)
+        try:
+            yield diagnostics
+        finally:
+            diagnostics = previous
+
+
 def plot(*args, **kwargs):
+    """
+    Execute the actions. With ``diagnostics=True``, return a tuple of the
+    result and of the Magics.logs.Diagnostics collected during the plot;
+    they are also attached to the exception raised if the plot fails.
+    """
+    if kwargs.pop("diagnostics", False):
+        with capture() as collected:
+            try:
+                return plot(*args, **kwargs), collected
+            except Exception as e:
+                e.diagnostics = collected
+                raise
+
     with LOCK:
         if ipython_active:
             return _jplot(*args, **kwargs)
@@ -701,37 +878,128 @@ def plot(*args, **kwargs):
             return _plot(*args, **kwargs)
 
 
+def aplot(*args, **kwargs):
+    """
+    Return a coroutine executing the actions in a worker process, see
+    Magics.aio.aplot: ``await macro.aplot(...)``.
+    """
+    from . import aio
+
+    return aio.aplot(*args, **kwargs)
+
+
+def awmsstyles(data, timeout=None):
+    """Return a coroutine returning the WMS styles of data, see Magics.aio.awmsstyles."""
+    from . import aio
+
+    return aio.awmsstyles(data, timeout=timeout)
+
+
+def _styles(data):
+    try:
+        styles = data.style()
+        return json.loads(styles.decode())
+    except Exception:
+        return None
+    finally:
+        for key in list(data.args.keys()):
+            Magics.reset(key)
+
+
 def wmsstyles(data):
-    with LOCK:
-        context.set()
-        try:
+    """
+    Return the WMS styles proposed by Magics for the mgrib, mnetcdf or minput
+    action ``data``. The styles are cached by fingerprint of the metadata.
+    """
+    return wmsstyles_batch([data])[0]
+
+
+def wmsstyles_batch(layers):
+    """
+    Return the styles of several layers, the layers missing from the cache
+    are resolved in one Magics session.
+    """
+    keys = [styles.fingerprint(data) for data in layers]
+    found = {}
+    missing = {}
+    for key, data in zip(keys, layers):
+        if key in found or key in missing:
+            continue
+        cached = styles.cache.get(key)
+        if cached is None:
+            missing[key] = data
+        else:
+            found[key] = cached
+
+    if missing:
+        with LOCK:
+            context.set()
             Magics.init()
-            styles = data.style()
-            Magics.finalize()
-            styles = json.loads(styles.decode())
-            return styles
-        except Exception:
-            Magics.finalize()
-            return {}
+            try:
+                for key, data in missing.items():
+                    found[key] = _styles(data)
+            finally:
+                Magics.finalize()
+
+        for key in missing:
+            if found[key] is None:
+                # Not cached, the data may not be ready yet
+                found[key] = {}
+            else:
+                styles.cache.put(key, found[key])
 
+    return [copy.deepcopy(found[key]) for key in keys]
 
-def known_drivers():
+
+####################################################################
+#
+# The metadata of the library is memoised: a cache hit does not take LOCK,
+# so that capability requests do not wait for the plots being rendered.
+#
+
+_metadata = {}
+
+
+def _memoised(name, key, compute):
+    cached = _metadata.get(name)
+    if cached is not None and cached[0] == key:
+        return cached[1]
     with LOCK:
-        return Magics.known_drivers()
+        value = compute()
+    _metadata[name] = (key, value)
+    return value
+
+
+def _home():
+    return _memoised("home", Magics.get_library_path(), lambda: Magics.home().decode())
+
+
+def known_drivers():
+    drivers = _memoised(
+        "known_drivers", Magics.get_library_path(), Magics.known_drivers
+    )
+    if isinstance(drivers, list):
+        drivers = list(drivers)
+    return drivers
 
 
 def version():
-    with LOCK:
-        version = Magics.version()
-        return version.decode()
+    return _memoised(
+        "version", Magics.get_library_path(), lambda: Magics.version().decode()
+    )
 
 
 def predefined_areas():
-    with LOCK:
-        home = Magics.home()
-        with open("%s/share/magics/styles/projections.json" % (home.decode())) as input:
-            projections = json.load(input)
-        return list(projections.keys())
+    path = "%s/share/magics/styles/projections.json" % (_home(),)
+    stat = os.stat(path)
+
+    def areas():
+        with open(path) as input:
+            return list(json.load(input).keys())
+
+    return list(
+        _memoised("predefined_areas", (path, stat.st_mtime, stat.st_size), areas)
+    )
 
 
 def wmscrs():
@@ -0,0 +1,129 @@
+# (C) Copyright 1996-2016 ECMWF.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+# In applying this licence, ECMWF does not waive the privileges and immunities
+# granted to it by virtue of its status as an intergovernmental organisation nor
+# does it submit to any jurisdiction.
+
+"""
+Memory profiling of the plots.
+
+When MAGICS_MEMPROFILE is set, the Python allocations (tracemalloc) and the
+resident set size of the process are measured before and after Magics.init,
+the execution of each action and Magics.finalize. The growth of the RSS that
+is not explained by Python allocations is attributed to native memory, i.e.
+libMagPlus. A JSON report is written for each plot in the directory given by
+MAGICS_MEMPROFILE (the current directory if it is set to "on").
+"""
+
+import json
+import os
+import tracemalloc
+
+from . import trace
+
+STEPS = ("plot", "init", "execute", "finalize")
+
+
+def rss():
+    """Return the resident set size of the process in bytes, or None."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError, ValueError):
+        pass
+    try:
+        import psutil
+
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return None
+
+
+class MemoryProfiler(object):
+    def __init__(self, directory=".", top=10):
+        self.directory = directory
+        self.top = top
+        self.plots = 0
+        self.stack = []
+        self.steps = []
+        self.snapshot = None
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def start(self, span):
+        if span.name not in STEPS:
+            return
+        if span.name == "plot":
+            self.steps = []
+            self.snapshot = tracemalloc.take_snapshot()
+        self.stack.append((tracemalloc.get_traced_memory()[0], rss()))
+
+    def end(self, span):
+        if span.name not in STEPS:
+            return
+        python_before, rss_before = self.stack.pop()
+        python = tracemalloc.get_traced_memory()[0] - python_before
+        step = dict(step=span.name, verb=span.verb, python=python)
+        rss_after = rss()
+        if rss_after is not None and rss_before is not None:
+            step["rss"] = rss_after - rss_before
+            step["native"] = max(0, step["rss"] - python)
+        self.steps.append(step)
+
+        if span.name == "plot":
+            self.report(step)
+
+    def report(self, total):
+        self.plots += 1
+        growth = tracemalloc.take_snapshot().compare_to(self.snapshot, "lineno")
+        report = dict(
+            pid=os.getpid(),
+            plot=self.plots,
+            total=total,
+            peak_python=tracemalloc.get_traced_memory()[1],
+            rss=rss(),
+            steps=self.steps[:-1],
+            python_allocations=[
+                dict(
+                    location=str(stat.traceback),
+                    size=stat.size_diff,
+                    count=stat.count_diff,
+                )
+                for stat in growth[: self.top]
+            ],
+        )
+        path = os.path.join(
+            self.directory,
+            "magics-memprofile-%d-%d.json" % (os.getpid(), self.plots),
+        )
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        self.snapshot = None
+        return report
+
+
+profiler = None
+
+
+def enable(directory="."):
+    """Profile the memory of every plot, writing the reports to directory."""
+    global profiler
+    if profiler is None:
+        profiler = trace.add_listener(MemoryProfiler(directory))
+    return profiler
+
+
+def disable():
+    global profiler
+    if profiler is not None:
+        trace.remove_listener(profiler)
+        profiler = None
+
+
+if os.environ.get("MAGICS_MEMPROFILE"):
+    directory = os.environ["MAGICS_MEMPROFILE"]
+    if directory in ("on", "1", "yes"):
+        directory = "."
+    enable(directory)
@@ -9,7 +9,7 @@
 import os
 import tempfile
 
-import simplejson
+from . import encoding
 
 magics = {}
 magics["info"] = "on"
@@ -292,8 +292,8 @@ def metgram(*args):
             haxis = "haxis_last"
         map["map"]["horizontal_axis"]["use_id"] = haxis
 
-    s = simplejson.dumps(magics, indent=4 * " ")
-    f = tempfile.NamedTemporaryFile()
+    s = encoding.dumps(magics, indent=4)
+    f = tempfile.NamedTemporaryFile("w")
     f.write(s)
     f.flush()
 
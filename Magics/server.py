@@ -0,0 +1,431 @@
+# (C) Copyright 1996-2016 ECMWF.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+# In applying this licence, ECMWF does not waive the privileges and immunities
+# granted to it by virtue of its status as an intergovernmental organisation nor
+# does it submit to any jurisdiction.
+
+"""
+Local WMS and tile server.
+
+    python -m Magics serve --layer t2m=2m_temperature.grib
+
+serves GetCapabilities and GetMap on /wms and tiles on
+/tiles/<layer>/<crs>/<z>/<x>/<y>.png. The maps are rendered by a pool of
+worker processes. Concurrent identical requests are coalesced into one
+render, the images are kept in a memory cache backed by a disk cache, and
+responses carry an ETag so that clients can revalidate with If-None-Match.
+"""
+
+import collections
+import concurrent.futures
+import hashlib
+import http.server
+import os
+import threading
+from urllib.parse import parse_qsl, urlparse
+from xml.sax.saxutils import escape
+
+from . import macro, tiles
+from .Magics import write_atomic
+from .workers import RenderPool, set_state, state
+
+FORMATS = ("image/png",)
+
+
+####################################################################
+
+
+class Layer(object):
+    """
+    A layer of the server: a data action (mgrib, mnetcdf or minput) and the
+    visual actions plotting it, contouring with the default style if None.
+    """
+
+    def __init__(self, name, data, visuals=None, title=None):
+        self.name = name
+        self.data = data
+        self.visuals = visuals
+        self.title = title or name
+
+    def actions(self, style=None):
+        if self.visuals is not None:
+            return [self.data] + list(self.visuals)
+        if style:
+            contour = macro.mcont(
+                contour_automatic_setting="style_name", contour_style_name=style
+            )
+        else:
+            contour = macro.mcont(contour_automatic_setting="ecmwf")
+        return [self.data, contour]
+
+    def version(self):
+        """Return the mtime and size of the files of the layer."""
+        result = []
+        for key, value in sorted(self.data.args.items()):
+            if isinstance(value, str) and os.path.isfile(value):
+                stat = os.stat(value)
+                result.append((key, stat.st_mtime, stat.st_size))
+        return result
+
+    def styles(self):
+        return _style_names(macro.wmsstyles(self.data))
+
+
+def _style_names(styles):
+    styles = (styles or {}).get("styles", [])
+    return [s["name"] if isinstance(s, dict) else s for s in styles]
+
+
+def layer(spec):
+    """Return the layer described by ``name=path`` on the command line."""
+    name, path = spec.split("=", 1)
+    if macro.is_netcdf(path):
+        data = macro.mnetcdf(netcdf_filename=path)
+    else:
+        data = macro.mgrib(grib_input_file_name=path)
+    return Layer(name, data)
+
+
+####################################################################
+
+
+class Cache(object):
+    """
+    Least recently used memory cache of at most ``max_bytes``, backed by
+    files in ``directory`` if given.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        with self.lock:
+            data = self.entries.get(key)
+            if data is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return data
+
+        if self.directory is not None:
+            try:
+                with open(self.path(key), "rb") as f:
+                    data = f.read()
+            except (IOError, OSError):
+                pass
+            else:
+                self.disk_hits += 1
+                self.put(key, data, disk=False)
+                return data
+
+        self.misses += 1
+        return None
+
+    def put(self, key, data, disk=True):
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = data
+                self.bytes += len(data)
+            while self.bytes > self.max_bytes and len(self.entries) > 1:
+                _, old = self.entries.popitem(last=False)
+                self.bytes -= len(old)
+
+        if disk and self.directory is not None:
+            path = self.path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_atomic(path, data)
+
+    def stats(self):
+        with self.lock:
+            return dict(
+                hits=self.hits,
+                disk_hits=self.disk_hits,
+                misses=self.misses,
+                entries=len(self.entries),
+                bytes=self.bytes,
+            )
+
+
+class Coalescer(object):
+    """Run a single computation for concurrent calls with the same key."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.coalesced = 0
+
+    def run(self, key, submit):
+        with self.lock:
+            future = self.pending.get(key)
+            first = future is None
+            if first:
+                future = self.pending[key] = submit()
+            else:
+                self.coalesced += 1
+        if first:
+            future.add_done_callback(lambda f: self.done(key))
+        return future.result()
+
+    def done(self, key):
+        with self.lock:
+            self.pending.pop(key, None)
+
+
+####################################################################
+#
+# Rendering, in the worker processes
+#
+
+
+def _render(names, style, crs, bbox, width, height):
+    layers = state("server")
+    actions = []
+    for name in names:
+        actions.extend(layers[name].actions(style))
+    return tiles.render_area(crs, bbox, width, height, actions)
+
+
+def _styles(names):
+    layers = state("server")
+    styles = macro.wmsstyles_batch([layers[name].data for name in names])
+    return dict((name, _style_names(x)) for name, x in zip(names, styles))
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super(HTTPError, self).__init__(message)
+        self.status = status
+
+
+####################################################################
+
+
+class Server(object):
+    """
+    The WMS and tile requests, independently of HTTP: ``handle`` returns the
+    status, headers and body of the response to a request.
+    """
+
+    def __init__(
+        self, layers, workers=None, cache_directory=None, max_bytes=256 * 1024 * 1024
+    ):
+        self.layers = collections.OrderedDict((x.name, x) for x in layers)
+        self.crss = dict((c["name"], c) for c in macro.wmscrs()["crss"])
+        self.grids = {}
+        self.cache = Cache(max_bytes, cache_directory)
+        self.coalescer = Coalescer()
+        self.renders = 0
+        self.styles = None
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if workers > 1:
+            self.executor = RenderPool(
+                workers, initializer=set_state, initargs=("server", self.layers)
+            )
+        else:
+            set_state("server", self.layers)
+            self.executor = concurrent.futures.ThreadPoolExecutor(1)
+
+    def close(self):
+        self.executor.shutdown()
+
+    def key(self, names, style, crs, bbox, width, height):
+        """Return the key of a map in the cache, also its ETag."""
+        for name in names:
+            if name not in self.layers:
+                raise HTTPError(404, "Unknown layer %r" % (name,))
+        if crs not in self.crss:
+            raise HTTPError(400, "Unsupported CRS %r" % (crs,))
+
+        versions = [self.layers[name].version() for name in names]
+        return hashlib.sha1(
+            repr((names, style, crs, bbox, width, height, versions)).encode()
+        ).hexdigest()
+
+    def render(self, names, style, crs, bbox, width, height, key=None):
+        """Return the PNG image of a map and its ETag, from the cache if possible."""
+        if key is None:
+            key = self.key(names, style, crs, bbox, width, height)
+
+        data = self.cache.get(key)
+        if data is None:
+
+            def submit():
+                self.renders += 1
+                return self.executor.submit(
+                    _render, names, style, crs, bbox, width, height
+                )
+
+            data = self.coalescer.run(key, submit)
+            self.cache.put(key, data)
+        return data, '"%s"' % (key,)
+
+    def handle(self, path, query, headers=None):
+        headers = headers or {}
+        try:
+            if path.rstrip("/") == "/wms":
+                query = dict((k.lower(), v) for k, v in query.items())
+                request = query.get("request", "").lower()
+                if request == "getcapabilities":
+                    return self.capabilities()
+                if request == "getmap":
+                    return self.image(self.getmap(query), headers)
+                raise HTTPError(400, "Unsupported request %r" % (request,))
+            if path.startswith("/tiles/"):
+                return self.image(self.tile(path), headers)
+            raise HTTPError(404, "Not found %r" % (path,))
+        except HTTPError as e:
+            return e.status, {"Content-Type": "text/plain"}, str(e).encode()
+        except Exception as e:
+            return 500, {"Content-Type": "text/plain"}, str(e).encode()
+
+    def image(self, request, headers):
+        # The ETag is known before rendering: a revalidation does not render
+        key = self.key(*request)
+        etag = '"%s"' % (key,)
+        if headers.get("If-None-Match") == etag:
+            return 304, {"ETag": etag}, b""
+        data, etag = self.render(*request, key=key)
+        return 200, {"Content-Type": "image/png", "ETag": etag}, data
+
+    def getmap(self, query):
+        try:
+            names = [x for x in query["layers"].split(",") if x]
+            crs = query.get("crs", query.get("srs"))
+            bbox = tuple(float(x) for x in query["bbox"].split(","))
+            width = int(query["width"])
+            height = int(query["height"])
+        except (KeyError, ValueError):
+            raise HTTPError(400, "Invalid GetMap request")
+        if len(bbox) != 4:
+            raise HTTPError(400, "Invalid bbox")
+        if query.get("format", FORMATS[0]) not in FORMATS:
+            raise HTTPError(400, "Unsupported format %r" % (query["format"],))
+        if crs == "EPSG:4326" and query.get("version", "1.3.0") == "1.3.0":
+            # WMS 1.3.0 has latitudes first
+            bbox = (bbox[1], bbox[0], bbox[3], bbox[2])
+        style = query.get("styles", "").split(",")[0]
+        return names, style, crs, bbox, width, height
+
+    def tile(self, path):
+        try:
+            _, _, name, crs, z, x, y = path.split("/")
+            tile = tiles.Tile(int(z), int(x), int(y.split(".")[0]))
+        except ValueError:
+            raise HTTPError(400, "Expected /tiles/<layer>/<crs>/<z>/<x>/<y>.png")
+        crs = crs.replace("-", ":")
+        if crs not in self.crss:
+            raise HTTPError(400, "Unsupported CRS %r" % (crs,))
+        grid = self.grids.get(crs)
+        if grid is None:
+            grid = self.grids[crs] = tiles.Grid(crs)
+        columns, rows = grid.shape(tile.z)
+        if not (0 <= tile.x < columns and 0 <= tile.y < rows):
+            raise HTTPError(404, "No tile %s" % (tile,))
+        return [name], "", crs, grid.bbox(tile), 256, 256
+
+    def layer_styles(self):
+        """
+        Return the styles of the layers by name, resolved once by the
+        workers, not under the macro.LOCK of this process.
+        """
+        if self.styles is None:
+            names = list(self.layers)
+            self.styles = self.coalescer.run(
+                "styles", lambda: self.executor.submit(_styles, names)
+            )
+        return self.styles
+
+    def capabilities(self):
+        styles = self.layer_styles()
+        crss = "".join("<CRS>%s</CRS>" % (escape(c),) for c in self.crss)
+        box = macro.wmscrs()["geographic_bounding_box"]
+        layers = []
+        for layer in self.layers.values():
+            styles = "".join(
+                "<Style><Name>%s</Name><Title>%s</Title></Style>"
+                % (escape(s), escape(s))
+                for s in styles[layer.name]
+            )
+            layers.append(
+                '<Layer queryable="0"><Name>%s</Name><Title>%s</Title>%s</Layer>'
+                % (escape(layer.name), escape(layer.title), styles)
+            )
+        xml = (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<WMS_Capabilities version="1.3.0" xmlns="http://www.opengis.net/wms">'
+            "<Service><Name>WMS</Name><Title>Magics</Title></Service>"
+            "<Capability><Request>"
+            "<GetCapabilities><Format>text/xml</Format></GetCapabilities>"
+            "<GetMap>%s</GetMap>"
+            "</Request><Layer><Title>Magics</Title>%s"
+            "<EX_GeographicBoundingBox>"
+            "<westBoundLongitude>%s</westBoundLongitude>"
+            "<eastBoundLongitude>%s</eastBoundLongitude>"
+            "<southBoundLatitude>%s</southBoundLatitude>"
+            "<northBoundLatitude>%s</northBoundLatitude>"
+            "</EX_GeographicBoundingBox>%s</Layer></Capability></WMS_Capabilities>"
+        ) % (
+            "".join("<Format>%s</Format>" % (f,) for f in FORMATS),
+            crss,
+            box["w_lon"],
+            box["e_lon"],
+            box["s_lat"],
+            box["n_lat"],
+            "".join(layers),
+        )
+        return 200, {"Content-Type": "text/xml"}, xml.encode()
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    server_version = "Magics"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        status, headers, body = self.server.magics.handle(
+            url.path, dict(parse_qsl(url.query)), self.headers
+        )
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_server(layers, host="localhost", port=8000, **kwargs):
+    """Return an HTTP server of the layers, ``kwargs`` are passed to Server."""
+    httpd = http.server.ThreadingHTTPServer((host, port), Handler)
+    httpd.daemon_threads = True
+    httpd.magics = Server(layers, **kwargs)
+    return httpd
+
+
+def serve(layers, host="localhost", port=8000, **kwargs):
+    """Serve the layers until interrupted."""
+    httpd = make_server(layers, host, port, **kwargs)
+    print(
+        "Serving %s on http://%s:%d/wms"
+        % (", ".join(httpd.magics.layers), host, httpd.server_port)
+    )
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        httpd.magics.close()
@@ -0,0 +1,314 @@
+# (C) Copyright 1996-2016 ECMWF.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+# In applying this licence, ECMWF does not waive the privileges and immunities
+# granted to it by virtue of its status as an intergovernmental organisation nor
+# does it submit to any jurisdiction.
+
+"""
+Pure Python stand-in for libMagPlus.
+
+It is used instead of the real library when MAGICS_STANDIN=on is set before
+Magics is imported. It implements the entry points used by the bindings,
+keeps the parameters it receives and counts the calls and the bytes received
+for each entry point. On py_close, it writes a blank PNG for each page if a
+png output was requested, so that the Python side can be tested and
+benchmarked without a MagPlus installation.
+"""
+
+import ctypes
+import json
+import os
+import struct
+import threading
+import zlib
+
+import numpy
+
+LIBRARY_PATH = "<standin>"
+
+ACTIONS = (
+    "py_axis",
+    "py_boxplot",
+    "py_coast",
+    "py_cont",
+    "py_eps",
+    "py_epsbar",
+    "py_epscloud",
+    "py_epsgraph",
+    "py_epsinput",
+    "py_epslight",
+    "py_epsplumes",
+    "py_epsshading",
+    "py_epswave",
+    "py_epswind",
+    "py_geo",
+    "py_geojson",
+    "py_graph",
+    "py_grib",
+    "py_image",
+    "py_import",
+    "py_info",
+    "py_input",
+    "py_legend",
+    "py_line",
+    "py_mapgen",
+    "py_metbufr",
+    "py_metgraph",
+    "py_netcdf",
+    "py_obs",
+    "py_odb",
+    "py_plot",
+    "py_raw",
+    "py_symb",
+    "py_table",
+    "py_taylor",
+    "py_tephi",
+    "py_text",
+    "py_tile",
+    "py_wind",
+    "py_wrepjson",
+)
+
+SWITCHES = (
+    "py_keep_compatibility",
+    "py_mute",
+    "py_set_python",
+    "py_strict_mode",
+    "py_unmute",
+)
+
+LISTENERS = {
+    "mag_add_warning_listener": "warning",
+    "mag_add_error_listener": "error",
+    "mag_add_info_listener": "info",
+    "mag_add_debug_listener": "debug",
+}
+
+DRIVERS = ["png", "pdf", "ps", "eps", "svg", "kml", "geojson"]
+
+LATITUDE = (("standard_name", "latitude"), ("units", "degrees_north"))
+LONGITUDE = (("standard_name", "longitude"), ("units", "degrees_east"))
+
+
+def png(width, height):
+    """Return a blank (transparent) RGBA PNG image."""
+
+    def chunk(kind, data):
+        body = kind + data
+        return (
+            struct.pack(">I", len(data))
+            + body
+            + struct.pack(">I", zlib.crc32(body) & 0xFFFFFFFF)
+        )
+
+    rows = b"\0" * (width * 4 + 1) * height
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(rows))
+        + chunk(b"IEND", b"")
+    )
+
+
+def _string(x):
+    if isinstance(x, ctypes.c_char_p):
+        x = x.value
+    if isinstance(x, bytes):
+        x = x.decode()
+    return x
+
+
+def _array(pointer, size, ctype):
+    return numpy.ctypeslib.as_array(
+        ctypes.cast(pointer, ctypes.POINTER(ctype)), (size,)
+    )
+
+
+class Function(object):
+    """Callable standing for a foreign function of the library."""
+
+    def __init__(self, library, name, implementation):
+        self.library = library
+        self.__name__ = name
+        self.implementation = implementation
+        self.restype = None
+        self.argtypes = None
+
+    def __call__(self, *args):
+        with self.library.lock:
+            return self.implementation(*args)
+
+
+class Library(object):
+    """
+    The stand-in library. With ``float32``, it also provides the optional
+    py_set1f and py_set2f entry points, taking float32 arrays.
+    """
+
+    def __init__(self, float32=False):
+        self.lock = threading.RLock()
+        self.listeners = {}
+        self.clear()
+
+        functions = dict(
+            py_open=self.open,
+            py_close=self.close,
+            py_new=self.new_page,
+            py_reset=self.reset,
+            py_setc=self.setc,
+            py_setr=self.setr,
+            py_seti=self.seti,
+            py_set1c=self.set1c,
+            py_set1r=self.set1r,
+            py_set1i=self.set1i,
+            py_set2r=self.set2,
+            py_set2i=self.set2,
+            py_detect=self.detect,
+            py_knowndrivers=self.known_drivers,
+            py_metagrib=self.style,
+            py_metanetcdf=self.style,
+            py_metainput=self.style,
+            version=lambda: b"Magics stand-in",
+            home=lambda: os.path.dirname(__file__).encode(),
+        )
+        if float32:
+            functions.update(py_set1f=self.set1f, py_set2f=self.set2)
+        for name in ACTIONS:
+            functions[name] = self.action(name)
+        for name in SWITCHES:
+            functions[name] = self.action(name)
+        for name, level in LISTENERS.items():
+            functions[name] = self.add_listener(level)
+
+        self.functions = dict(
+            (name, Function(self, name, f)) for name, f in functions.items()
+        )
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__["functions"][name]
+        except KeyError:
+            raise AttributeError("function '%s' not found" % (name,))
+
+    def clear(self):
+        """Forget the parameters, calls and pages recorded so far."""
+        self.parameters = {}
+        self.calls = {}
+        self.bytes = {}
+        self.pages = 0
+        self.outputs = []
+
+    def record(self, name, nbytes=0):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        self.bytes[name] = self.bytes.get(name, 0) + nbytes
+
+    def emit(self, level, message):
+        """Send a message to the listener registered for ``level``."""
+        callback = self.listeners.get(level)
+        if callback is not None:
+            callback(None, message.encode())
+
+    def add_listener(self, level):
+        def add(data, callback):
+            self.listeners[level] = callback
+
+        return add
+
+    def action(self, name):
+        def call():
+            self.record(name)
+
+        return call
+
+    def open(self):
+        self.record("py_open")
+        self.parameters = {}
+        self.pages = 1
+
+    def new_page(self, name):
+        self.record("py_new")
+        self.pages += 1
+
+    def close(self):
+        self.record("py_close")
+        p = self.parameters
+        name = p.get("output_name")
+        formats = p.get("output_formats", ["png"])
+        if name is None or "png" not in formats:
+            return
+        width = int(p.get("output_width", 800))
+        x = float(p.get("super_page_x_length", 29.7))
+        y = float(p.get("super_page_y_length", 21.0))
+        height = max(1, int(round(width * y / x)))
+        numbered = p.get("output_name_first_page_number", "on") != "off"
+        digits = int(p.get("output_file_minimal_width", 1))
+        image = png(width, height)
+        for page in range(1, self.pages + 1):
+            if page == 1 and not numbered:
+                path = "%s.png" % (name,)
+            else:
+                path = "%s.%s.png" % (name, str(page).zfill(digits))
+            with open(path, "wb") as f:
+                f.write(image)
+            self.outputs.append(path)
+
+    def reset(self, name):
+        self.record("py_reset")
+        self.parameters.pop(_string(name), None)
+
+    def setc(self, name, value):
+        value = _string(value)
+        self.record("py_setc", len(value))
+        self.parameters[_string(name)] = value
+
+    def setr(self, name, value):
+        self.record("py_setr", 8)
+        self.parameters[_string(name)] = float(value)
+
+    def seti(self, name, value):
+        self.record("py_seti", 4)
+        self.parameters[_string(name)] = int(value)
+
+    def set1c(self, name, data, size):
+        values = [data[i].decode() for i in range(size)]
+        self.record("py_set1c", sum(len(v) + 1 for v in values))
+        self.parameters[_string(name)] = values
+
+    def set1r(self, name, data, size):
+        values = _array(data, size, ctypes.c_double).copy()
+        self.record("py_set1r", values.nbytes)
+        self.parameters[_string(name)] = values
+
+    def set1f(self, name, data, size):
+        values = _array(data, size, ctypes.c_float).copy()
+        self.record("py_set1f", values.nbytes)
+        self.parameters[_string(name)] = values
+
+    def set1i(self, name, data, size):
+        values = _array(data, size, ctypes.c_int).copy()
+        self.record("py_set1i", values.nbytes)
+        self.parameters[_string(name)] = values
+
+    def set2(self, name, data, dim1, dim2):
+        values = numpy.array(data)
+        kind = dict(i="i", f="f" if values.dtype == numpy.float32 else "r")
+        self.record("py_set2%s" % (kind[values.dtype.kind],), values.nbytes)
+        self.parameters[_string(name)] = values
+
+    def detect(self, attributes, dimension):
+        self.record("py_detect")
+        wanted = dict(latitude=LATITUDE, longitude=LONGITUDE)[_string(dimension)]
+        for name, attrs in json.loads(_string(attributes)).items():
+            for key, value in wanted:
+                if attrs.get(key) == value:
+                    return name.encode()
+        return b""
+
+    def known_drivers(self):
+        return json.dumps({"drivers": DRIVERS}).encode()
+
+    def style(self):
+        self.record("py_meta")
+        return b"{}"
@@ -0,0 +1,160 @@
+# (C) Copyright 1996-2016 ECMWF.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+# In applying this licence, ECMWF does not waive the privileges and immunities
+# granted to it by virtue of its status as an intergovernmental organisation nor
+# does it submit to any jurisdiction.
+
+"""
+Cache of the WMS styles returned by Magics for the mgrib, mnetcdf and minput
+actions.
+
+The styles only depend on the metadata of the data, so the cache is keyed by
+a fingerprint of the action: its parameters, with the arrays replaced by their
+shape and type, and the files replaced by the identification of the field
+(parameter, level type and level) for GRIB or the identity of the file for
+the other formats.
+"""
+
+import collections
+import copy
+import hashlib
+import os
+import struct
+import threading
+
+import numpy
+
+from . import gribindex
+
+CACHE_SIZE = int(os.environ.get("MAGICS_STYLE_CACHE_SIZE", 1024))
+
+
+def _grib2_identification(f, offset, length):
+    # Discipline, then the sections up to the product definition, or None if
+    # section 4 is missing or truncated
+    f.seek(offset + 6)
+    identification = [f.read(2)]
+    for number, section in gribindex.sections(f, offset, length, (1, 3, 4)):
+        if number == 1:
+            # Centre and tables versions
+            identification.append(section[5:11])
+        elif number == 3:
+            # Grid definition template and shape of the grid
+            identification.append(section[12:14] + section[30:38])
+        elif len(section) >= 34:
+            # Product definition template, parameter and fixed surfaces
+            identification.append(section[7:11] + section[22:34])
+            return b"".join(identification)
+    return None
+
+
+def grib_identification(path, position=1):
+    """
+    Return the bytes identifying the field of a GRIB message: parameter,
+    level type and level, but not the date and step. Return None if the
+    message, or its product definition, is not found.
+    """
+    with open(path, "rb") as f:
+        for offset, length, edition in gribindex.messages(f):
+            position -= 1
+            if position == 0:
+                break
+        else:
+            return None
+
+        if edition == 1:
+            # Section 1 (PDS): table version, centre, process, grid, flags,
+            # parameter, level type and level
+            f.seek(offset + 7)
+            header = f.read(13)
+            return header[0:1] + header[4:13]
+
+        return _grib2_identification(f, offset, length)
+
+
+def _file(key, path, args):
+    try:
+        stat = os.stat(path)
+    except (TypeError, OSError):
+        return path
+    if key == "grib_input_file_name":
+        try:
+            position = int(args.get("grib_field_position", 1))
+            identification = grib_identification(path, position)
+        except (IOError, OSError, ValueError, struct.error):
+            identification = None
+        if identification is not None:
+            return identification
+    return (os.path.realpath(path), stat.st_mtime, stat.st_size)
+
+
+def _value(key, value, args):
+    if isinstance(value, numpy.ndarray):
+        return ("array", value.shape, value.dtype.str)
+    if isinstance(value, str) and (
+        key.endswith("file_name") or key.endswith("filename")
+    ):
+        return _file(key, value, args)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _value(k, v, value)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_value(key, v, args) for v in value)
+    return value
+
+
+def fingerprint(action):
+    """Return a digest of the metadata of an mgrib, mnetcdf or minput action."""
+    args = action.args
+    key = (action.verb,) + tuple(
+        sorted((k, _value(k, v, args)) for k, v in args.items())
+    )
+    return hashlib.sha1(repr(key).encode()).hexdigest()
+
+
+class StyleCache(object):
+    """Least recently used cache of the styles, keyed by fingerprint."""
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            try:
+                styles = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        return copy.deepcopy(styles)
+
+    def put(self, key, styles):
+        with self.lock:
+            self.entries[key] = copy.deepcopy(styles)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self.lock:
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                entries=len(self.entries),
+                size=self.size,
+            )
+
+
+cache = StyleCache()
@@ -0,0 +1,270 @@
+# (C) Copyright 1996-2016 ECMWF.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+# In applying this licence, ECMWF does not waive the privileges and immunities
+# granted to it by virtue of its status as an intergovernmental organisation nor
+# does it submit to any jurisdiction.
+
+"""
+Synthetic data for the benchmarks: global fields at a given resolution,
+scattered points, GRIB messages and files, meteogram station files and MGB streams.
+"""
+
+import json
+import math
+import struct
+
+import numpy
+
+RESOLUTIONS = (1.0, 0.25, 0.1)
+
+
+def grid(resolution):
+    """Return the latitudes and longitudes of a global regular grid."""
+    lat = numpy.linspace(90.0, -90.0, int(round(180.0 / resolution)) + 1)
+    lon = numpy.linspace(0.0, 360.0 - resolution, int(round(360.0 / resolution)))
+    return lat, lon
+
+
+def field(resolution, dtype=numpy.float64):
+    """
+    Return the latitudes, longitudes and values of a smooth global field,
+    looking like a 2 metre temperature in K.
+    """
+    lat, lon = grid(resolution)
+    y = numpy.radians(lat)[:, numpy.newaxis]
+    x = numpy.radians(lon)[numpy.newaxis, :]
+    values = 250.0 + 40.0 * numpy.cos(y) + 5.0 * numpy.sin(3 * x) * numpy.cos(2 * y)
+    return lat, lon, values.astype(dtype)
+
+
+def wind(resolution, dtype=numpy.float64):
+    """Return the latitudes, longitudes, u and v components of a wind field."""
+    lat, lon = grid(resolution)
+    y = numpy.radians(lat)[:, numpy.newaxis]
+    x = numpy.radians(lon)[numpy.newaxis, :]
+    u = (20.0 * numpy.cos(2 * y) + 5.0 * numpy.sin(x)).astype(dtype)
+    v = (5.0 * numpy.cos(3 * x) * numpy.cos(y)).astype(dtype)
+    return lat, lon, u, v
+
+
+def points(n, seed=0):
+    """Return the latitudes, longitudes and values of n scattered points."""
+    rng = numpy.random.RandomState(seed)
+    lat = numpy.degrees(numpy.arcsin(rng.uniform(-1.0, 1.0, n)))
+    lon = rng.uniform(-180.0, 180.0, n)
+    return lat, lon, rng.uniform(0.0, 100.0, n)
+
+
+def dataset(resolution, dtype=numpy.float32):
+    """Return the field as an xarray dataset with CF attributes."""
+    import xarray
+
+    lat, lon, values = field(resolution, dtype)
+    return xarray.Dataset(
+        {
+            "t2m": (
+                ("latitude", "longitude"),
+                values,
+                {"units": "K", "long_name": "2 metre temperature"},
+            )
+        },
+        coords={
+            "latitude": (
+                "latitude",
+                lat,
+                {"units": "degrees_north", "standard_name": "latitude"},
+            ),
+            "longitude": (
+                "longitude",
+                lon,
+                {"units": "degrees_east", "standard_name": "longitude"},
+            ),
+        },
+    )
+
+
+def mgb(path, lines=100, size=1000, seed=0):
+    """
+    Write a MGB stream, as produced by the Magics binary driver, with a
+    projection and ``lines`` polylines of ``size`` points each.
+    """
+    rng = numpy.random.RandomState(seed)
+    with open(path, "wb") as f:
+        f.write(b"MAGICS")
+        f.write(struct.pack("iii", 10, 1, 0))
+        f.write(struct.pack("dd", 29.7, 21.0))
+
+        f.write(b"P")
+        f.write(struct.pack("8d", 0.0, 0.0, 100.0, 100.0, -180.0, -90.0, 180.0, 90.0))
+        for i in range(lines):
+            f.write(b"C")
+            f.write(struct.pack("4d", *rng.uniform(0.0, 1.0, 4)))
+            f.write(b"L")
+            f.write(struct.pack("=id", 0, 1.0))
+            f.write(b"H")
+            f.write(struct.pack("i", size))
+            x = numpy.cumsum(rng.uniform(-1.0, 1.0, size))
+            y = numpy.cumsum(rng.uniform(-1.0, 1.0, size))
+            f.write(x.astype(numpy.float64).tobytes())
+            f.write(y.astype(numpy.float64).tobytes())
+        f.write(b"U")
+
+
+def _ibm(x):
+    # The IBM single precision float closest to x from below, and its value
+    if x == 0:
+        return 0, 0.0
+    sign = 0x80000000 if x < 0 else 0
+    exponent = int(math.floor(math.log(abs(x), 16))) + 65
+    mantissa = int(math.floor(abs(x) / 16.0 ** (exponent - 64) * 2**24))
+    if mantissa >= 2**24:
+        mantissa >>= 4
+        exponent += 1
+    value = mantissa / 2.0**24 * 16.0 ** (exponent - 64)
+    return sign | (exponent << 24) | mantissa, -value if sign else value
+
+
+def _millidegrees(x):
+    # 3 bytes, sign and magnitude
+    value = int(round(abs(x) * 1000))
+    return (value | (0x800000 if x < 0 else 0)).to_bytes(3, "big")
+
+
+def grib1_message(
+    parameter=167,
+    level_type=1,
+    level=0,
+    step=0,
+    unit=1,
+    date=20240101,
+    hour=0,
+    table=128,
+    sections=b"",
+):
+    """
+    Return a GRIB edition 1 message with the given keys. ``sections`` are
+    the grid and data sections following the product definition, if any.
+    """
+    century = (date // 10000 - 1) // 100 + 1
+    pds = bytearray(28)
+    pds[0:3] = (28).to_bytes(3, "big")
+    pds[3:8] = bytes([table, 98, 0, 255, 0x80 if sections else 0])
+    pds[8:10] = bytes([parameter, level_type])
+    pds[10:12] = level.to_bytes(2, "big")
+    pds[12:17] = bytes(
+        [date // 10000 - (century - 1) * 100, date // 100 % 100, date % 100, hour, 0]
+    )
+    pds[17:19] = bytes([unit, step])
+    pds[24] = century
+    length = 8 + len(pds) + len(sections) + 4
+    return (
+        b"GRIB" + length.to_bytes(3, "big") + b"\x01" + bytes(pds) + sections + b"7777"
+    )
+
+
+def grib2_message(
+    discipline=0,
+    category=0,
+    number=0,
+    surface=1,
+    level=0,
+    step=0,
+    date=20240101,
+    hour=0,
+    section3=b"",
+    section4=34,
+):
+    """
+    Return a GRIB edition 2 message with the given keys, without data.
+    ``section3`` is the grid definition, if any, and ``section4`` the length
+    of the product definition (template 4.0), which is truncated if less
+    than 34.
+    """
+    section1 = bytearray(21)
+    section1[0:5] = (21).to_bytes(4, "big") + b"\x01"
+    section1[12:14] = (date // 10000).to_bytes(2, "big")
+    section1[14:17] = bytes([date // 100 % 100, date % 100, hour])
+    product = bytearray(section4)
+    product[0:5] = section4.to_bytes(4, "big") + b"\x04"
+    if section4 >= 34:
+        product[9:11] = bytes([category, number])
+        product[17] = 1
+        product[18:22] = step.to_bytes(4, "big")
+        product[22] = surface
+        product[24:28] = level.to_bytes(4, "big")
+    length = 16 + len(section1) + len(section3) + len(product) + 4
+    header = b"GRIB\0\0" + bytes([discipline, 2]) + length.to_bytes(8, "big")
+    return header + bytes(section1) + section3 + bytes(product) + b"7777"
+
+
+def grib(path, resolution=1.0, bits=16):
+    """
+    Write the field as a GRIB edition 1 2 metre temperature on a regular
+    latitude/longitude grid, with simple packing.
+    """
+    lat, lon, values = field(resolution)
+
+    step = int(round(resolution * 1000))
+    gds = bytearray(32)
+    gds[0:6] = (32).to_bytes(3, "big") + bytes([0, 255, 0])
+    gds[6:10] = len(lon).to_bytes(2, "big") + len(lat).to_bytes(2, "big")
+    gds[10:16] = _millidegrees(lat[0]) + _millidegrees(lon[0])
+    gds[16] = 0x80
+    gds[17:23] = _millidegrees(lat[-1]) + _millidegrees(lon[-1])
+    gds[23:27] = step.to_bytes(2, "big") + step.to_bytes(2, "big")
+
+    reference, minimum = _ibm(float(values.min()))
+    spread = float(values.max()) - minimum
+    scale = int(math.ceil(math.log(spread / (2**bits - 1), 2))) if spread else 0
+    packed = numpy.round((values.ravel() - minimum) / 2.0**scale)
+    data = packed.astype(">u2" if bits == 16 else ">u4").tobytes()
+    length = 11 + len(data)
+    unused = 0
+    if length % 2:
+        data += b"\0"
+        length += 1
+        unused = 8
+    bds = (
+        length.to_bytes(3, "big")
+        + bytes([unused])
+        + ((abs(scale) | (0x8000 if scale < 0 else 0)).to_bytes(2, "big"))
+        + reference.to_bytes(4, "big")
+        + bytes([bits])
+        + data
+    )
+
+    with open(path, "wb") as f:
+        f.write(grib1_message(sections=bytes(gds) + bds))
+
+
+def station(path, parameters=("2t",), steps=61, seed=0):
+    """
+    Write a meteogram station file with the EPS quantiles and the climate of
+    ``parameters`` every 6 hours.
+    """
+    rng = numpy.random.RandomState(seed)
+    quantiles = ("min", "ten", "twenty_five", "median", "seventy_five", "ninety", "max")
+    data = dict(
+        station_name="Synthetic",
+        location=dict(latitude=51.4, longitude=-1.0),
+        height=60,
+        date="20240101",
+        time="0000",
+        clim={},
+    )
+    for parameter in parameters:
+        base = 280.0 + numpy.cumsum(rng.normal(0.0, 0.5, steps))
+        spread = numpy.linspace(0.5, 5.0, steps)
+        eps = dict(steps=list(range(0, 6 * steps, 6)))
+        for i, name in enumerate(quantiles):
+            offset = (i - 3) / 3.0 * spread
+            eps[name] = [round(float(x), 2) for x in base + offset]
+        data[parameter] = dict(eps=eps)
+        data["clim"][parameter] = dict(
+            (name, [round(280.0 + (i - 3), 2)] * (steps // 4))
+            for i, name in enumerate(quantiles)
+        )
+    with open(path, "w") as f:
+        json.dump(data, f)
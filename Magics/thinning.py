@@ -0,0 +1,109 @@
+# (C) Copyright 1996-2016 ECMWF.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+# In applying this licence, ECMWF does not waive the privileges and immunities
+# granted to it by virtue of its status as an intergovernmental organisation nor
+# does it submit to any jurisdiction.
+
+"""
+Spatial thinning of scattered point input.
+
+Points are dropped into a regular grid of buckets, one bucket per screen
+cell of the target subpage, and only the first point of each bucket is kept.
+"""
+
+import numpy
+
+# Size of a screen cell in cm, used when ``input_thinning_cell_size`` is not given
+CELL_SIZE = 0.1
+
+# Magics defaults for the size of the subpage, in cm
+SUBPAGE_X_LENGTH = 25.7
+SUBPAGE_Y_LENGTH = 17.0
+
+GLOBAL = (-90.0, -180.0, 90.0, 180.0)
+
+# The parameters of the coordinates of the points, in both spellings
+COORDINATES = (
+    ("input_latitudes_list", "input_longitudes_list"),
+    ("input_latitude_values", "input_longitude_values"),
+)
+
+
+def area(projection):
+    """
+    Return the (south, west, north, east) corners of the area described by
+    the arguments of a mmap action, or None if the projection is not
+    cylindrical.
+    """
+    if projection is None:
+        return GLOBAL
+    if projection.get("subpage_map_projection", "cylindrical") != "cylindrical":
+        return None
+    if projection.get("subpage_map_area_name"):
+        return None
+    return (
+        float(projection.get("subpage_lower_left_latitude", GLOBAL[0])),
+        float(projection.get("subpage_lower_left_longitude", GLOBAL[1])),
+        float(projection.get("subpage_upper_right_latitude", GLOBAL[2])),
+        float(projection.get("subpage_upper_right_longitude", GLOBAL[3])),
+    )
+
+
+def cells(projection, cell_size=CELL_SIZE):
+    """
+    Return the number of (rows, columns) of screen cells in the subpage
+    described by the arguments of a mmap action.
+    """
+    if projection is None:
+        projection = {}
+    x = float(projection.get("subpage_x_length", SUBPAGE_X_LENGTH))
+    y = float(projection.get("subpage_y_length", SUBPAGE_Y_LENGTH))
+    return (max(1, int(y / cell_size)), max(1, int(x / cell_size)))
+
+
+def grid_thin(latitudes, longitudes, corners, shape):
+    """
+    Return the sorted indices of the points to keep so that there is at most
+    one point per cell of a ``shape`` grid covering ``corners``.
+    Points outside the area are dropped. All the points are kept if the
+    area is empty.
+    """
+    lat = numpy.asarray(latitudes, dtype=numpy.float64)
+    lon = numpy.asarray(longitudes, dtype=numpy.float64)
+    south, west, north, east = corners
+    rows, cols = shape
+
+    if north <= south or east == west:
+        return numpy.arange(len(lat))
+
+    if east <= west:
+        east += 360.0
+    lon = numpy.mod(lon - west, 360.0) + west
+
+    inside = (lat >= south) & (lat <= north) & (lon <= east)
+    index = numpy.flatnonzero(inside)
+
+    row = ((lat[index] - south) * (rows / (north - south))).astype(numpy.int64)
+    col = ((lon[index] - west) * (cols / (east - west))).astype(numpy.int64)
+    numpy.clip(row, 0, rows - 1, out=row)
+    numpy.clip(col, 0, cols - 1, out=col)
+
+    _, first = numpy.unique(row * cols + col, return_index=True)
+    return numpy.sort(index[first])
+
+
+def coordinates(args):
+    """Return the latitudes and longitudes of the points of minput arguments, or None."""
+    for latitudes, longitudes in COORDINATES:
+        if args.get(latitudes) is not None and args.get(longitudes) is not None:
+            return args[latitudes], args[longitudes]
+    return None
+
+
+def subset(value, index):
+    """Return the elements of a list or array at the given indices."""
+    if isinstance(value, numpy.ndarray):
+        return value[index]
+    return [value[i] for i in index]
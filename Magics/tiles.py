@@ -0,0 +1,630 @@
+# (C) Copyright 1996-2016 ECMWF.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+# In applying this licence, ECMWF does not waive the privileges and immunities
+# granted to it by virtue of its status as an intergovernmental organisation nor
+# does it submit to any jurisdiction.
+
+"""
+Pre-generation of tile pyramids.
+
+The tiles of each zoom level cover the extent of the CRS given by
+macro.wmscrs(), or the standard web-mercator square for EPSG:3857: the
+extent is split into 2**zoom rows and columns of square tiles (2 columns
+for 1 row at zoom 0 for EPSG:4326). Each tile is rendered by a plot of its
+own, in worker processes, to a directory or MBTiles store. With metatiles,
+a block of n x n tiles is rendered by one plot and the image is sliced,
+which amortises the fixed cost of a plot and avoids seams.
+
+Before a tile is rendered, a cheap pre-check tells whether it can be
+skipped: the tile does not intersect the valid values of the minput layers,
+or the ``skip`` hook returns True (see LandMask to skip the tiles without
+land). The children of a skipped tile are skipped too. Tiles already in
+the store are not rendered again, so an interrupted generation can be
+resumed.
+"""
+
+import collections
+import concurrent.futures
+import io
+import math
+import os
+import sqlite3
+import tempfile
+
+import numpy
+
+from . import macro
+from .Magics import write_atomic
+from .workers import RenderPool, set_state, state
+
+RADIUS = 6378137.0
+
+# The extent of the web-mercator tiles of the XYZ clients and of MBTiles,
+# used for EPSG:3857 instead of the extent of macro.wmscrs() (about
+# 20026376 x 20048966 metres) so that the tiles line up with theirs
+MERCATOR = math.pi * RADIUS
+
+# Magics default of symbol_height, in cm
+SYMBOL_HEIGHT = 0.2
+
+Tile = collections.namedtuple("Tile", ["z", "x", "y"])
+
+
+####################################################################
+
+
+class Grid(object):
+    """
+    The tiles of a CRS, from the extents of macro.wmscrs(), except for
+    EPSG:3857 which covers the standard web-mercator square.
+    """
+
+    def __init__(self, crs):
+        extents = dict((c["name"], c) for c in macro.wmscrs()["crss"])
+        if crs not in extents:
+            raise ValueError(
+                "Unknown CRS %r, expected one of %s" % (crs, sorted(extents))
+            )
+        e = extents[crs]
+        self.crs = crs
+        self.west = min(e["w_lon"], e["e_lon"])
+        self.east = max(e["w_lon"], e["e_lon"])
+        self.south = min(e["s_lat"], e["n_lat"])
+        self.north = max(e["s_lat"], e["n_lat"])
+        if crs == "EPSG:3857":
+            self.west = self.south = -MERCATOR
+            self.east = self.north = MERCATOR
+
+        width = self.east - self.west
+        height = self.north - self.south
+        self.columns = max(1, int(round(width / height)))
+        self.rows = max(1, int(round(height / width)))
+
+    def shape(self, z):
+        return self.columns << z, self.rows << z
+
+    def tiles(self, z):
+        columns, rows = self.shape(z)
+        for y in range(rows):
+            for x in range(columns):
+                yield Tile(z, x, y)
+
+    def children(self, tile):
+        for dy in (0, 1):
+            for dx in (0, 1):
+                yield Tile(tile.z + 1, 2 * tile.x + dx, 2 * tile.y + dy)
+
+    def parent(self, tile):
+        return Tile(tile.z - 1, tile.x // 2, tile.y // 2)
+
+    def bbox(self, tile):
+        """Return the west, south, east and north of a tile in CRS units."""
+        columns, rows = self.shape(tile.z)
+        dx = (self.east - self.west) / columns
+        dy = (self.north - self.south) / rows
+        return (
+            self.west + tile.x * dx,
+            self.north - (tile.y + 1) * dy,
+            self.west + (tile.x + 1) * dx,
+            self.north - tile.y * dy,
+        )
+
+    def geographic(self, tile):
+        """
+        Return the west, south, east and north of a tile in degrees, or None
+        if the CRS is not supported by the pre-check.
+        """
+        west, south, east, north = self.bbox(tile)
+        if self.crs == "EPSG:4326":
+            return west, south, east, north
+        if self.crs == "EPSG:3857":
+
+            def latitude(y):
+                return math.degrees(2 * math.atan(math.exp(y / RADIUS)) - math.pi / 2)
+
+            return (
+                math.degrees(west / RADIUS),
+                latitude(south),
+                math.degrees(east / RADIUS),
+                latitude(north),
+            )
+        return None
+
+
+####################################################################
+#
+# Pre-check
+#
+
+
+def _latitudes(lat, bbox):
+    return (lat >= bbox[1]) & (lat <= bbox[3])
+
+
+def _longitudes(lon, bbox):
+    west, east = bbox[0], bbox[2]
+    if east - west >= 360.0:
+        return numpy.ones(lon.shape, dtype=bool)
+    return numpy.mod(lon - west, 360.0) <= east - west
+
+
+class Coverage(object):
+    """
+    Points, or the nodes of a regular grid, holding valid values. For a
+    regular grid, ``lat`` are the rows and ``lon`` the columns of ``valid``.
+
+    A bounding box is padded before the nodes are tested: by one grid step
+    for a regular grid, so that the nodes of the cells overlapping the box
+    are found even when it is smaller than a cell, and by ``extent`` times
+    its size for points, the size of their symbols relative to a tile.
+    """
+
+    def __init__(self, lat, lon, valid=None, regular=False, extent=0.0):
+        self.lat = numpy.asarray(lat, dtype=numpy.float64)
+        self.lon = numpy.asarray(lon, dtype=numpy.float64)
+        self.valid = valid
+        self.regular = regular
+        self.extent = extent
+        self.margin = (0.0, 0.0)
+        if regular:
+            # Strictly less than a step, not to reach the nodes of the
+            # cells that only touch the box
+            self.margin = (
+                _step(self.lat) * (1 - 1e-9),
+                _step(self.lon) * (1 - 1e-9),
+            )
+
+    def pad(self, bbox):
+        west, south, east, north = bbox
+        dlat = self.margin[0] + self.extent * (north - south)
+        dlon = self.margin[1] + self.extent * (east - west)
+        return (west - dlon, south - dlat, east + dlon, north + dlat)
+
+    def intersects(self, bbox):
+        bbox = self.pad(bbox)
+        rows = _latitudes(self.lat, bbox)
+        columns = _longitudes(self.lon, bbox)
+        if self.regular:
+            if self.valid is None:
+                return rows.any() and columns.any()
+            return self.valid[numpy.ix_(rows, columns)].any()
+        inside = rows & columns
+        if self.valid is not None:
+            inside &= self.valid
+        return inside.any()
+
+
+def _step(values):
+    if len(values) < 2:
+        return 0.0
+    return abs(values[1] - values[0])
+
+
+def _valid(values, missing=None):
+    values = numpy.asarray(values)
+    valid = numpy.isfinite(values)
+    if missing is not None:
+        valid &= values != missing
+    return valid
+
+
+def _symbol_extent(layers, size):
+    # The height of the largest symbol relative to the size of a tile (in cm,
+    # see render_area)
+    heights = [
+        float(layer.args.get("symbol_height", SYMBOL_HEIGHT))
+        for layer in layers
+        if layer.verb in ("msymb", "psymb")
+    ]
+    return max(heights or [SYMBOL_HEIGHT]) / (size / 40.0)
+
+
+def coverage(layers, size=256):
+    """
+    Return the coverage of the minput layers with geographical values, an
+    empty list if the coverage of the data is unknown. ``size`` is the size
+    of the tiles in pixels, used to pad the points by their symbols.
+    """
+    result = []
+    extent = _symbol_extent(layers, size)
+    for layer in layers:
+        if layer.verb not in ("minput", "pinput"):
+            continue
+        args = layer.args
+        missing = args.get("input_mv")
+        if "input_field" in args and "input_field_initial_latitude" in args:
+            field = numpy.asarray(args["input_field"])
+            rows, columns = field.shape
+            lat = args["input_field_initial_latitude"] + args.get(
+                "input_field_latitude_step", 1.0
+            ) * numpy.arange(rows)
+            lon = args.get("input_field_initial_longitude", 0.0) + args.get(
+                "input_field_longitude_step", 1.0
+            ) * numpy.arange(columns)
+            result.append(Coverage(lat, lon, _valid(field, missing), regular=True))
+        elif "input_latitudes_list" in args and "input_longitudes_list" in args:
+            valid = None
+            if "input_values" in args:
+                valid = _valid(args["input_values"], missing)
+            result.append(
+                Coverage(
+                    args["input_latitudes_list"],
+                    args["input_longitudes_list"],
+                    valid,
+                    extent=extent,
+                )
+            )
+        elif "input_latitude_values" in args and "input_longitude_values" in args:
+            valid = None
+            if "input_values" in args:
+                valid = _valid(args["input_values"], missing)
+            result.append(
+                Coverage(
+                    args["input_latitude_values"],
+                    args["input_longitude_values"],
+                    valid,
+                    extent=extent,
+                )
+            )
+        else:
+            # A layer of unknown coverage: the pre-check cannot skip tiles
+            return []
+    return result
+
+
+class LandMask(object):
+    """
+    ``skip`` hook of generate(), skipping the tiles without land. ``mask``
+    is a boolean field, True over land, on the regular grid of latitudes
+    ``lat`` and longitudes ``lon``, e.g. a thresholded land-sea mask.
+    """
+
+    def __init__(self, mask, lat, lon):
+        self.coverage = Coverage(
+            lat, lon, numpy.asarray(mask, dtype=bool), regular=True
+        )
+
+    def __call__(self, grid, tile):
+        bbox = grid.geographic(tile)
+        if bbox is None:
+            return False
+        return not self.coverage.intersects(bbox)
+
+
+####################################################################
+#
+# Stores
+#
+
+
+class DirectoryStore(object):
+    """Tiles written to ``path/z/x/y.png``."""
+
+    def __init__(self, path, extension="png"):
+        self.path = path
+        self.extension = extension
+
+    def filename(self, tile):
+        return os.path.join(
+            self.path, str(tile.z), str(tile.x), "%d.%s" % (tile.y, self.extension)
+        )
+
+    def __contains__(self, tile):
+        return os.path.exists(self.filename(tile))
+
+    def put(self, tile, data):
+        path = self.filename(tile)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_atomic(path, data)
+
+    def get(self, tile):
+        try:
+            with open(self.filename(tile), "rb") as f:
+                return f.read()
+        except (IOError, OSError):
+            return None
+
+    def close(self):
+        pass
+
+
+class MBTilesStore(object):
+    """
+    Tiles written to an MBTiles (SQLite) file. Rows are numbered from the
+    bottom, as required by the MBTiles specification.
+    """
+
+    def __init__(self, path, grid=None, name="magics", commit_every=100):
+        self.path = path
+        self.grid = grid
+        self.commit_every = commit_every
+        self.pending = 0
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS metadata (name TEXT, value TEXT)")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS tiles (zoom_level INTEGER, tile_column INTEGER,"
+            " tile_row INTEGER, tile_data BLOB)"
+        )
+        self.db.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles"
+            " (zoom_level, tile_column, tile_row)"
+        )
+        metadata = dict(name=name, format="png", type="overlay")
+        if grid is not None:
+            metadata["crs"] = grid.crs
+        for key, value in metadata.items():
+            if self.metadata(key) is None:
+                self.db.execute("INSERT INTO metadata VALUES (?, ?)", (key, value))
+        self.db.commit()
+
+    def metadata(self, key):
+        row = self.db.execute(
+            "SELECT value FROM metadata WHERE name = ?", (key,)
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def row(self, tile):
+        rows = 1 << tile.z
+        if self.grid is not None:
+            rows = self.grid.shape(tile.z)[1]
+        return rows - 1 - tile.y
+
+    def __contains__(self, tile):
+        return (
+            self.db.execute(
+                "SELECT 1 FROM tiles WHERE zoom_level = ? AND tile_column = ?"
+                " AND tile_row = ?",
+                (tile.z, tile.x, self.row(tile)),
+            ).fetchone()
+            is not None
+        )
+
+    def put(self, tile, data):
+        self.db.execute(
+            "INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)",
+            (tile.z, tile.x, self.row(tile), sqlite3.Binary(data)),
+        )
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.db.commit()
+            self.pending = 0
+
+    def get(self, tile):
+        row = self.db.execute(
+            "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ?"
+            " AND tile_row = ?",
+            (tile.z, tile.x, self.row(tile)),
+        ).fetchone()
+        return None if row is None else bytes(row[0])
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+def store(path, grid=None):
+    """Return an MBTiles store if path ends with .mbtiles, else a directory store."""
+    if path.endswith(".mbtiles"):
+        return MBTilesStore(path, grid)
+    return DirectoryStore(path)
+
+
+####################################################################
+#
+# Rendering
+#
+
+
+def render_area(crs, bbox, width, height, layers):
+    """Plot the layers on the bounding box in the CRS ``crs`` and return the PNG image."""
+    west, south, east, north = bbox
+    x = width / 40.0
+    y = height / 40.0
+    with tempfile.TemporaryDirectory() as tmp:
+        name = os.path.join(tmp, "tile")
+        output = macro.output(
+            output_formats=["png"],
+            output_name_first_page_number="off",
+            output_cairo_transparent_background=True,
+            output_width=width,
+            output_name=name,
+        )
+        area = macro.mmap(
+            subpage_map_projection=crs,
+            subpage_lower_left_latitude=south,
+            subpage_lower_left_longitude=west,
+            subpage_upper_right_latitude=north,
+            subpage_upper_right_longitude=east,
+            subpage_coordinates_system="projection",
+            subpage_frame="off",
+            page_x_length=x,
+            page_y_length=y,
+            super_page_x_length=x,
+            super_page_y_length=y,
+            subpage_x_length=x,
+            subpage_y_length=y,
+            subpage_x_position=0.0,
+            subpage_y_position=0.0,
+            output_width=width,
+            page_frame="off",
+            skinny_mode="on",
+            page_id_line="off",
+        )
+        macro.plot(output, area, *layers)
+        with open(name + ".png", "rb") as f:
+            return f.read()
+
+
+def render(grid, tile, layers, size=256):
+    """Plot the layers on a tile and return the PNG image."""
+    return render_area(grid.crs, grid.bbox(tile), size, size, layers)
+
+
+def metatiles(grid, tiles, n):
+    """Group tiles of the same zoom level by blocks of n x n tiles."""
+    blocks = collections.OrderedDict()
+    for tile in tiles:
+        blocks.setdefault((tile.z, tile.x // n, tile.y // n), []).append(tile)
+    return list(blocks.values())
+
+
+def render_metatile(grid, tiles, layers, size=256, n=4, buffer=0):
+    """
+    Plot the layers once on the n x n block of tiles holding ``tiles``, with
+    a margin of ``buffer`` pixels around it, and slice the image. Return a
+    list of the tiles and their PNG images.
+    """
+    # PIL is only needed for metatiles
+    from PIL import Image
+
+    z = tiles[0].z
+    columns, rows = grid.shape(z)
+    x0 = (tiles[0].x // n) * n
+    y0 = (tiles[0].y // n) * n
+    x1 = min(x0 + n, columns)
+    y1 = min(y0 + n, rows)
+
+    west, _, _, north = grid.bbox(Tile(z, x0, y0))
+    _, south, east, _ = grid.bbox(Tile(z, x1 - 1, y1 - 1))
+    margin_x = (east - west) / ((x1 - x0) * size) * buffer
+    margin_y = (north - south) / ((y1 - y0) * size) * buffer
+    bbox = (west - margin_x, south - margin_y, east + margin_x, north + margin_y)
+    width = (x1 - x0) * size + 2 * buffer
+    height = (y1 - y0) * size + 2 * buffer
+
+    image = Image.open(io.BytesIO(render_area(grid.crs, bbox, width, height, layers)))
+    if image.size != (width, height):
+        image = image.resize((width, height))
+    pixels = numpy.asarray(image.convert("RGBA"))
+
+    result = []
+    for tile in tiles:
+        top = buffer + (tile.y - y0) * size
+        left = buffer + (tile.x - x0) * size
+        bottom = top + size
+        right = left + size
+        f = io.BytesIO()
+        Image.fromarray(pixels[top:bottom, left:right]).save(f, "png")
+        result.append((tile, f.getvalue()))
+    return result
+
+
+def _render(grid, tiles, size, n, buffer):
+    if n == 1:
+        return [(tile, render(grid, tile, state("tiles"), size)) for tile in tiles]
+    return render_metatile(grid, tiles, state("tiles"), size, n, buffer)
+
+
+class Pyramid(object):
+    """The tiles of the zoom levels to render, with the pre-check."""
+
+    def __init__(self, grid, layers, output, skip=None, size=256):
+        self.grid = grid
+        self.output = output
+        self.skip = skip
+        self.coverages = coverage(layers, size)
+        self.skipped = set()
+        self.stats = dict(rendered=0, skipped=0, existing=0, failed=0, errors={})
+
+    def empty(self, tile):
+        if self.coverages:
+            bbox = self.grid.geographic(tile)
+            if bbox is not None and not any(c.intersects(bbox) for c in self.coverages):
+                return True
+        return self.skip is not None and self.skip(self.grid, tile)
+
+    def pruned(self, tile):
+        while tile.z > 0:
+            tile = self.grid.parent(tile)
+            if tile in self.skipped:
+                return True
+        return False
+
+    def todo(self, z):
+        """Return the tiles of zoom level z that must be rendered."""
+        result = []
+        for tile in self.grid.tiles(z):
+            if self.pruned(tile) or self.empty(tile):
+                self.skipped.add(tile)
+                self.stats["skipped"] += 1
+            elif tile in self.output:
+                self.stats["existing"] += 1
+            else:
+                result.append(tile)
+        return result
+
+    def done(self, tiles, result):
+        try:
+            for tile, data in result():
+                self.output.put(tile, data)
+                self.stats["rendered"] += 1
+        except Exception as e:
+            for tile in tiles:
+                self.stats["failed"] += 1
+                self.stats["errors"][tile] = str(e)
+
+
+def generate(
+    layers,
+    crs="EPSG:3857",
+    zoom_levels=range(0, 4),
+    workers=None,
+    output="tiles",
+    size=256,
+    skip=None,
+    metatile=1,
+    buffer=0,
+):
+    """
+    Render the tiles of ``layers`` (a list of actions) for the CRS ``crs``
+    at each zoom level to the store ``output`` (a path or a store), in
+    ``workers`` processes (os.cpu_count() by default, 1 renders in this
+    process). ``skip(grid, tile)`` is called before a tile is rendered, the
+    tile is skipped if it returns True. With ``metatile`` n > 1, blocks of
+    n x n tiles are rendered as one image, with a margin of ``buffer``
+    pixels, and sliced into tiles. Return the number of tiles rendered,
+    skipped, found in the store and failed, and the failed tiles.
+    """
+    grid = Grid(crs)
+    close = isinstance(output, str)
+    if close:
+        output = store(output, grid)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    pyramid = Pyramid(grid, layers, output, skip, size)
+
+    executor = None
+    if workers > 1:
+        executor = RenderPool(
+            workers, initializer=set_state, initargs=("tiles", list(layers))
+        )
+    else:
+        set_state("tiles", list(layers))
+
+    try:
+        for z in sorted(zoom_levels):
+            blocks = metatiles(grid, pyramid.todo(z), metatile)
+            if executor is None:
+                for block in blocks:
+                    pyramid.done(
+                        block, lambda: _render(grid, block, size, metatile, buffer)
+                    )
+            else:
+                futures = dict(
+                    (
+                        executor.submit(_render, grid, block, size, metatile, buffer),
+                        block,
+                    )
+                    for block in blocks
+                )
+                for future in concurrent.futures.as_completed(futures):
+                    pyramid.done(futures[future], future.result)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if close:
+            output.close()
+
+    return pyramid.stats
@@ -6,7 +6,14 @@
 # granted to it by virtue of its status as an intergovernmental organisation nor
 # does it submit to any jurisdiction.
 
-from . import macro
+import itertools
+import os
+import shutil
+import tempfile
+import time
+
+from . import gribindex, macro, wrepcache
+from .workers import RenderPool, set_state, state
 
 
 def substitute(default, user):
@@ -17,16 +24,7 @@ def substitute(default, user):
     return out
 
 
-def geoplot(
-    data,
-    contour=None,
-    output=None,
-    background=None,
-    foreground=None,
-    area=None,
-    title=[],
-):
-
+def _geolayers(contour, background, foreground, area, title):
     default = {
         "area": {},
         "contour": {},
@@ -52,13 +50,211 @@ def geoplot(
     contour = macro.mcont(substitute(default["contour"], contour))
 
     # Define the title
-    title = macro.mtext(text_lines=title, text_font_size=0.8, text_justification="left")
+    if title:
+        title = macro.mtext(
+            text_lines=title, text_font_size=0.8, text_justification="left"
+        )
+    else:
+        title = macro.mtext(text_font_size=0.8, text_justification="left")
+    return projection, background, contour, foreground, title
+
+
+def geoplot(
+    data,
+    contour=None,
+    output=None,
+    background=None,
+    foreground=None,
+    area=None,
+    title=[],
+):
+
+    projection, background, contour, foreground, title = _geolayers(
+        contour, background, foreground, area, title
+    )
     if output is None:
         return macro.plot(projection, background, data, contour, foreground, title)
 
     return macro.plot(output, projection, background, data, contour, foreground, title)
 
 
+_latitudes = ("latitude", "lat")
+_longitudes = ("longitude", "lon")
+
+
+def _netcdf_fields(path):
+    # Every combination of the indices of the other dimensions of every
+    # variable on a latitude/longitude grid
+    import xarray
+
+    fields = []
+    with xarray.open_dataset(path) as ds:
+        for name, variable in ds.data_vars.items():
+            lat = [d for d in variable.dims if d in _latitudes]
+            lon = [d for d in variable.dims if d in _longitudes]
+            if not lat or not lon:
+                continue
+            field = dict(
+                netcdf_value_variable=name,
+                netcdf_latitude_variable=lat[0],
+                netcdf_longitude_variable=lon[0],
+            )
+            dims = [d for d in variable.dims if d not in (lat[0], lon[0])]
+            if not dims:
+                fields.append(field)
+                continue
+            for indices in itertools.product(*[range(variable.sizes[d]) for d in dims]):
+                fields.append(
+                    dict(
+                        field,
+                        netcdf_dimension_setting_method="index",
+                        netcdf_dimension_setting=[
+                            "%s:%d" % x for x in zip(dims, indices)
+                        ],
+                    )
+                )
+    return fields
+
+
+def _geoplot_pages(name, layers, pages, targets):
+    # Plot the fields as the pages of one session, then name the pages
+    projection, background, contour, foreground, title = layers
+    output = macro.output(
+        output_formats=["png"],
+        output_name=name,
+        output_name_first_page_number="on",
+    )
+    actions = [output]
+    for i, data in enumerate(pages):
+        if i:
+            actions.append(macro.page())
+        actions.extend([projection, background, data, contour, foreground, title])
+    macro.plot(*actions)
+
+    for i, target in enumerate(targets):
+        os.replace("%s.%d.png" % (name, i + 1), target)
+    return targets
+
+
+def _geoplot_fields(source, fields, output_pattern):
+    netcdf = macro.is_netcdf(source)
+    if fields is None:
+        if netcdf:
+            fields = _netcdf_fields(source)
+        else:
+            fields = list(range(1, gribindex.count(source) + 1))
+
+    data = []
+    targets = []
+    grib = None
+    for index, field in enumerate(fields):
+        if netcdf:
+            args = dict(netcdf_filename=source, netcdf_type="geomatrix")
+            args.update(field)
+            data.append(macro.mnetcdf(args))
+            # The variable and the indices of its dimensions
+            name = "_".join(
+                [field.get("netcdf_value_variable", "")]
+                + [
+                    x.replace(":", "_")
+                    for x in field.get("netcdf_dimension_setting", [])
+                ]
+            )
+        elif isinstance(field, dict):
+            if grib is None:
+                grib = gribindex.index(source)
+            data.append(grib.mgrib(**field))
+            name = "_".join(str(v) for v in field.values())
+        else:
+            data.append(
+                macro.mgrib(grib_input_file_name=source, grib_field_position=field)
+            )
+            name = field
+        targets.append(output_pattern.format(index=index, field=name) + ".png")
+    return fields, data, targets
+
+
+def _run(fn, tasks, workers, initializer=None, initargs=()):
+    # Return the result of fn(*task), or its exception, for each task
+    results = []
+    if workers is not None and workers > 1:
+        with RenderPool(workers, initializer=initializer, initargs=initargs) as pool:
+            futures = [pool.submit(fn, *task) for task in tasks]
+            for future in futures:
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    results.append(e)
+    else:
+        if initializer is not None:
+            initializer(*initargs)
+        for task in tasks:
+            try:
+                results.append(fn(*task))
+            except Exception as e:
+                results.append(e)
+    return results
+
+
+def geoplot_batch(
+    source,
+    fields=None,
+    output_pattern="geoplot.{index}",
+    contour=None,
+    background=None,
+    foreground=None,
+    area=None,
+    title=[],
+    workers=None,
+    pages=50,
+):
+    """
+    Plot every field of the GRIB or NetCDF file ``source`` with the layers
+    of geoplot, built once for all the fields.
+
+    ``fields`` are the positions (from 1) of the GRIB messages, dicts of
+    GRIB keys (shortName, level, step...) resolved with the index of the
+    file (see Magics.gribindex), or dicts of mnetcdf parameters selecting
+    a variable and the indices of its dimensions; by default all the
+    messages, or all the combinations of the indices of the dimensions
+    other than latitude/lat and longitude/lon of all the variables (which
+    needs xarray). The fields are plotted as the pages of sessions of at
+    most ``pages`` pages, in this process or in ``workers`` worker
+    processes. The image of each field is written to
+    ``output_pattern.format(index=..., field=...) + ".png"``, where
+    ``field`` is the position of a GRIB message, the values of its keys,
+    or the NetCDF variable and the indices of its dimensions
+    (``t2m_time_3_level_0``).
+    The NetCDF files are recognised by their magic bytes.
+
+    Return the list of the images, and a dict of the errors by field.
+    """
+    fields, data, targets = _geoplot_fields(source, fields, output_pattern)
+    layers = _geolayers(contour, background, foreground, area, title)
+
+    tmp = tempfile.mkdtemp(prefix="geoplot-")
+    try:
+        tasks = []
+        for start in range(0, len(data), pages):
+            end = start + pages
+            name = os.path.join(tmp, str(start))
+            tasks.append((name, layers, data[start:end], targets[start:end]))
+        results = _run(_geoplot_pages, tasks, workers)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    outputs = []
+    errors = {}
+    for start, result in zip(range(0, len(data), pages), results):
+        if isinstance(result, Exception):
+            end = start + pages
+            for field in fields[start:end]:
+                errors[str(field)] = str(result)
+        else:
+            outputs.extend(result)
+    return outputs, errors
+
+
 def xyplot(data, contour=None, output=None):
 
     default = {"contour": {}}
@@ -261,8 +457,17 @@ defaults = {
 }
 
 
+def _input(parameter, input, args):
+    # With cache=True, or MAGICS_WREPJSON_SLIM=on, read the parameter from its
+    # slim file (see Magics.wrepcache)
+    if args.get("cache", wrepcache.ENABLED):
+        return wrepcache.input(input, parameter)
+    return input
+
+
 def epswave(parameter, input, **args):
     actions = []
+    input = _input(parameter, input, args)
 
     projection = macro.mmap(
         substitute(defaults["epswave"]["projection"], args.get("projection", None))
@@ -334,6 +539,7 @@ def epswave(parameter, input, **args):
 
 def epswind(parameter, input, **args):
     actions = []
+    input = _input(parameter, input, args)
 
     projection = macro.mmap(
         substitute(defaults["epswind"]["projection"], args.get("projection", None))
@@ -406,6 +612,7 @@ def epswind(parameter, input, **args):
 def epsgraph(parameter, input, **args):
 
     actions = []
+    input = _input(parameter, input, args)
 
     projection = macro.mmap(
         substitute(defaults["eps"]["projection"], args.get("projection", None))
@@ -646,3 +853,171 @@ def epsgram(parameter, input, **args):
     args["title"] = eps["title"]
 
     return eps["method"](parameter, input, **args)
+
+
+####################################################################
+#
+# Batch of meteograms
+#
+
+_visuals = {
+    "epsgraph": macro.mepsgraph,
+    "epswind": macro.mepswind,
+    "epswave": macro.mepswave,
+}
+
+
+def _epslayers(kind, args):
+    # The actions of the eps plots of kind that do not depend on the station
+    group = "eps" if kind == "epsgraph" else kind
+    layers = dict(
+        projection=macro.mmap(
+            substitute(defaults[group]["projection"], args.get("projection", None))
+        ),
+        vertical=macro.maxis(
+            substitute(
+                defaults[group]["vertical_axis"], args.get("vertical_axis", None)
+            )
+        ),
+        horizontal=macro.maxis(
+            substitute(
+                defaults["eps"]["horizontal_axis"], args.get("horizontal_axis", None)
+            )
+        ),
+        visual=_visuals[kind](substitute(defaults[group][kind], args.get(kind, None))),
+        text=macro.mtext(
+            text_colour="navy",
+            text_font_size=font_size * 2,
+            text_justification="left",
+            text_lines=[
+                "ENS Meteogram",
+                "<json_info key='station_name'/><json_info key='location'/>",
+                "<json_info key='grid_point'/><json_info key='height'/>",
+                "<json_info key='product_info'/><json_info key='date'/>",
+                "<font size='0.5' colour='white'>.</font>",
+                "<json_info key='parameter_info'/>",
+            ],
+        ),
+        position=1.0 if kind == "epsgraph" else 1.5,
+    )
+    if kind == "epsgraph":
+        layers["climate"] = macro.mepsshading(
+            substitute(defaults["eps"]["epsclim"], args.get("epsclim", None))
+        )
+    return layers
+
+
+def _epsdata(kind, parameter, input, eps, keyword="eps"):
+    args = dict(
+        wrepjson_family="eps",
+        wrepjson_keyword=keyword,
+        wrepjson_input_filename=input,
+        wrepjson_parameter=parameter,
+        wrepjson_parameter_information=eps["title"],
+        wrepjson_parameter_scaling_factor=eps["scaling"],
+    )
+    if kind == "epsgraph":
+        args.update(
+            wrepjson_missing_value=eps.get("missing", 9999.0),
+            wrepjson_parameter_offset_factor=eps["offset"],
+        )
+    if keyword == "clim":
+        args.update(
+            wrepjson_ignore_keys=["100"],
+            wrepjson_parameter_information="none",
+            wrepjson_position_information="off",
+        )
+    return macro.mwrepjson(args)
+
+
+def _epsgram_station(station, parameters, targets, climate, cache):
+    # Plot the parameters of one station, return the outputs and the errors
+    outputs = []
+    errors = {}
+    for parameter, target in zip(parameters, targets):
+        input = wrepcache.input(station, parameter) if cache else station
+        eps = params.get(
+            parameter,
+            {"scaling": 1.0, "offset": 0.0, "method": epsgraph, "title": parameter},
+        )
+        kind = eps["method"].__name__
+        layers = state("epsgram")[kind]
+        actions = [
+            macro.output(
+                output_formats=["png"],
+                output_name_first_page_number="off",
+                output_name=target,
+                super_page_y_length=10.0,
+                subpage_y_length=5.0,
+                subpage_y_position=layers["position"],
+            ),
+            layers["projection"],
+            layers["vertical"],
+            layers["horizontal"],
+        ]
+        if climate and kind == "epsgraph":
+            actions.append(_epsdata(kind, parameter, input, eps, "clim"))
+            actions.append(layers["climate"])
+        actions.append(_epsdata(kind, parameter, input, eps))
+        actions.extend([layers["visual"], layers["text"]])
+        try:
+            macro.plot(*actions)
+            outputs.append(target + ".png")
+        except Exception as e:
+            errors[parameter] = str(e)
+    return outputs, errors
+
+
+def epsgram_batch(
+    stations,
+    parameters,
+    output_pattern="{station}.{parameter}",
+    workers=None,
+    climate=False,
+    cache=True,
+    **args
+):
+    """
+    Plot the meteograms of ``parameters`` for every station of
+    ``stations``, a dict of the wrepjson input files by station name.
+
+    The axes, projections and visuals are built once from ``defaults``
+    (overridden by ``args``, as for epsgraph) and shared by all the plots.
+    The stations are plotted in this process, or in ``workers`` worker
+    processes. With ``cache``, each station file is parsed once and split
+    in slim files by parameter (see Magics.wrepcache). The image of each
+    plot is written to
+    ``output_pattern.format(station=..., parameter=...) + ".png"``.
+
+    Return the list of the images, a dict of the errors by parameter by
+    station, and a dict of statistics: the number of plots, of failures,
+    the elapsed seconds and the plots per second.
+    """
+    start = time.time()
+    layers = dict((kind, _epslayers(kind, args)) for kind in _visuals)
+    tasks = []
+    for station, input in stations.items():
+        targets = [
+            output_pattern.format(station=station, parameter=p) for p in parameters
+        ]
+        tasks.append((input, list(parameters), targets, climate, cache))
+
+    results = _run(_epsgram_station, tasks, workers, set_state, ("epsgram", layers))
+
+    outputs = []
+    errors = {}
+    for station, result in zip(stations, results):
+        if isinstance(result, Exception):
+            result = ([], dict((p, str(result)) for p in parameters))
+        outputs.extend(result[0])
+        if result[1]:
+            errors[station] = result[1]
+
+    elapsed = time.time() - start
+    stats = dict(
+        plots=len(outputs),
+        failures=sum(len(e) for e in errors.values()),
+        seconds=elapsed,
+        throughput=len(outputs) / elapsed if elapsed else 0.0,
+    )
+    return outputs, errors, stats
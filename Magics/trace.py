@@ -0,0 +1,173 @@
+# (C) Copyright 1996-2016 ECMWF.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+# In applying this licence, ECMWF does not waive the privileges and immunities
+# granted to it by virtue of its status as an intergovernmental organisation nor
+# does it submit to any jurisdiction.
+
+"""
+Trace spans of the plots executed by macro.plot.
+
+Spans are only created while at least one listener is registered, otherwise
+span() returns a shared no-op context manager. A listener is either a
+callable, called with each finished span, or an object with ``start(span)``
+and ``end(span)`` methods.
+
+Setting MAGICS_TRACE to a file name records every plot of the process and
+writes them as a Chrome trace (chrome://tracing, Perfetto, speedscope) at exit.
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+
+from .Magics import payload_bytes
+
+listeners = []
+enabled = False
+
+
+class Span(object):
+    def __init__(self, name, verb=None, args=None):
+        self.name = name
+        self.verb = verb
+        self.args = args
+        self.thread = threading.current_thread().ident
+        self.start = None
+        self.end = None
+
+    @property
+    def elapsed(self):
+        return self.end - self.start
+
+    def attributes(self):
+        attributes = {}
+        if self.verb is not None:
+            attributes["verb"] = self.verb
+        if self.args is not None:
+            attributes["keys"] = len(self.args)
+            attributes["bytes"] = payload_bytes(self.args.values())
+        return attributes
+
+    def __enter__(self):
+        for listener in listeners:
+            listener.start(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.end = time.perf_counter()
+        for listener in listeners:
+            listener.end(self)
+
+
+class NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+def span(name, verb=None, args=None):
+    """
+    Return a context manager timing a step of a plot. ``args`` are the
+    parameters of the action, their number and size are added to the span.
+    """
+    if not enabled:
+        return NULL_SPAN
+    return Span(name, verb, args)
+
+
+class Callback(object):
+    def __init__(self, callback):
+        self.callback = callback
+
+    def start(self, span):
+        pass
+
+    def end(self, span):
+        self.callback(span)
+
+
+def add_listener(listener):
+    global enabled
+    if not hasattr(listener, "end"):
+        listener = Callback(listener)
+    listeners.append(listener)
+    enabled = True
+    return listener
+
+
+def remove_listener(listener):
+    global enabled
+    for x in list(listeners):
+        if x is listener or getattr(x, "callback", None) == listener:
+            listeners.remove(x)
+    enabled = len(listeners) > 0
+
+
+class ChromeTrace(object):
+    """Collect spans as Chrome trace events."""
+
+    def __init__(self):
+        self.events = []
+        self.pid = os.getpid()
+
+    def start(self, span):
+        pass
+
+    def end(self, span):
+        name = span.name
+        if span.verb is not None:
+            name = "%s %s" % (span.verb, span.name)
+        self.events.append(
+            {
+                "name": name,
+                "cat": span.name,
+                "ph": "X",
+                "ts": span.start * 1e6,
+                "dur": span.elapsed * 1e6,
+                "pid": self.pid,
+                "tid": span.thread,
+                "args": span.attributes(),
+            }
+        )
+
+    def to_json(self):
+        return {"traceEvents": self.events, "displayTimeUnit": "ms"}
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_json(), f)
+
+
+class tracing(object):
+    """
+    Context manager recording the spans of the plots made within the block,
+    and writing them as a Chrome trace to ``path`` if given.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.trace = ChromeTrace()
+
+    def __enter__(self):
+        add_listener(self.trace)
+        return self.trace
+
+    def __exit__(self, *args):
+        remove_listener(self.trace)
+        if self.path is not None:
+            self.trace.save(self.path)
+
+
+if os.environ.get("MAGICS_TRACE"):
+    _trace = add_listener(ChromeTrace())
+    atexit.register(_trace.save, os.environ["MAGICS_TRACE"])
@@ -0,0 +1,399 @@
+# (C) Copyright 1996-2016 ECMWF.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+# In applying this licence, ECMWF does not waive the privileges and immunities
+# granted to it by virtue of its status as an intergovernmental organisation nor
+# does it submit to any jurisdiction.
+
+"""
+Pool of render worker processes, managing their lifecycle.
+
+- Warm start: a new worker renders a throwaway coastline before accepting
+  plans, so that the shapefiles and styles are loaded.
+- Recycling: a worker is replaced after ``max_plots`` plans, or when its
+  resident set size exceeds ``max_rss`` bytes after a plan.
+- Watchdog: a worker running a plan for more than ``timeout`` seconds is
+  killed and replaced; the future of the plan fails with WorkerTimeout.
+
+The defaults are read from MAGICS_WORKER_MAX_PLOTS, MAGICS_WORKER_MAX_RSS
+(in MiB) and MAGICS_WORKER_TIMEOUT (in seconds). RenderPool implements the
+submit() and shutdown() methods of concurrent.futures executors.
+
+The workers are started with the forkserver (or spawn) method by default:
+they are started by the threads of the pool, and a worker forked while
+another thread holds macro.LOCK would inherit it held and never plot.
+"""
+
+import concurrent.futures
+import logging
+import multiprocessing
+import os
+import pickle
+import queue
+import tempfile
+import threading
+import time
+
+LOG = logging.getLogger("Magics")
+
+
+def _environ(name, convert, scale=1):
+    value = os.environ.get(name)
+    if value is None:
+        return None
+    return convert(value) * scale
+
+
+def default_context():
+    """Return the multiprocessing context used to start the workers."""
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+class WorkerError(Exception):
+    """A plan failed because its worker died or was killed."""
+
+    def __init__(self, message, plan=None):
+        super(WorkerError, self).__init__(message)
+        self.plan = plan
+
+
+class WorkerTimeout(WorkerError):
+    pass
+
+
+class WorkerCrashed(WorkerError):
+    pass
+
+
+def describe(fn, args):
+    """Return a short description of a plan, for the failure reports."""
+    from . import macro
+
+    def describe_arg(x):
+        if isinstance(x, macro.Action):
+            return x.verb
+        if isinstance(x, (list, tuple)):
+            return "[%s]" % (", ".join(describe_arg(y) for y in x),)
+        if isinstance(x, dict):
+            return "{%s}" % (", ".join(str(k) for k in x),)
+        text = repr(x)
+        return text if len(text) < 60 else text[:57] + "..."
+
+    return "%s(%s)" % (
+        getattr(fn, "__name__", fn),
+        ", ".join(describe_arg(x) for x in args),
+    )
+
+
+def plot(*args, **kwargs):
+    """Run macro.plot in a worker: the function submitted by RenderPool.plot."""
+    from . import macro
+
+    return macro.plot(*args, **kwargs)
+
+
+# The state shared by the plans run in this process, by name
+_state = {}
+
+
+def set_state(name, value):
+    """
+    Set the state ``name`` shared by the plans, e.g. the layers they plot:
+    the initializer of the pools, or called directly when the plans are run
+    in this process.
+    """
+    _state[name] = value
+
+
+def state(name):
+    """Return the state ``name`` set by set_state in this process."""
+    return _state[name]
+
+
+####################################################################
+#
+# Worker process
+#
+
+
+def warm_start():
+    """Render a throwaway coastline map."""
+    from . import macro
+
+    with tempfile.TemporaryDirectory() as tmp:
+        macro.plot(
+            macro.output(
+                output_formats=["png"],
+                output_name=os.path.join(tmp, "warm"),
+                output_name_first_page_number="off",
+            ),
+            macro.mmap(),
+            macro.mcoast(),
+        )
+
+
+def _call(fn, args, kwargs):
+    try:
+        return ("ok", fn(*args, **kwargs))
+    except Exception as e:
+        return ("error", e)
+
+
+def _setup(warm, initializer, initargs):
+    if warm:
+        try:
+            warm_start()
+        except Exception as e:
+            LOG.warning("Magics worker warm start failed: %s", e)
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def _main(conn, warm, max_plots, max_rss, initializer, initargs):
+    from .memprofile import rss
+
+    _setup(warm, initializer, initargs)
+    conn.send("ready")
+
+    plots = 0
+    retire = False
+    while not retire:
+        try:
+            task = conn.recv()
+        except EOFError:
+            task = None
+        if task is None:
+            break
+
+        result = _call(*task)
+        plots += 1
+        retire = max_plots is not None and plots >= max_plots
+        if max_rss is not None:
+            retire = retire or (rss() or 0) > max_rss
+        try:
+            conn.send(result + (retire,))
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            error = RuntimeError("Cannot return result: %s" % (e,))
+            conn.send(("error", error, retire))
+
+
+####################################################################
+#
+# Pool
+#
+
+
+class Worker(object):
+    """The thread of the pool driving one worker process at a time."""
+
+    def __init__(self, pool, index):
+        self.pool = pool
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.thread = threading.Thread(
+            target=self.run, name="magics-worker-%d" % (index,), daemon=True
+        )
+        self.thread.start()
+
+    def start(self):
+        pool = self.pool
+        parent, child = pool.context.Pipe()
+        self.process = pool.context.Process(
+            target=_main,
+            args=(
+                child,
+                pool.warm,
+                pool.max_plots,
+                pool.max_rss,
+                pool.initializer,
+                pool.initargs,
+            ),
+            daemon=True,
+        )
+        self.process.start()
+        child.close()
+        self.conn = parent
+        if not parent.poll(pool.startup_timeout):
+            self.kill()
+            raise WorkerTimeout("Worker not ready after %ss" % (pool.startup_timeout,))
+        try:
+            parent.recv()
+        except EOFError:
+            self.stop()
+            raise WorkerCrashed("Worker died while starting")
+        pool.started += 1
+
+    def stop(self):
+        if self.process is not None:
+            try:
+                self.conn.send(None)
+            except (IOError, OSError):
+                pass
+            self.process.join(5)
+            if self.process.is_alive():
+                self.process.kill()
+                self.process.join()
+            self.conn.close()
+            self.process = None
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+        self.process = None
+
+    def run(self):
+        while True:
+            if self.process is None:
+                # Start, or replace, the worker before the next plan arrives
+                try:
+                    self.start()
+                except Exception as e:
+                    LOG.error("Magics worker failed to start: %s", e)
+            task = self.pool.tasks.get()
+            if task is None:
+                self.stop()
+                return
+            future, fn, args, kwargs = task
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                self.execute(future, fn, args, kwargs)
+            except Exception as e:
+                future.set_exception(e)
+
+    def execute(self, future, fn, args, kwargs):
+        pool = self.pool
+        if self.process is None:
+            self.start()
+
+        plan = describe(fn, args)
+        self.conn.send((fn, args, kwargs))
+        if not self.conn.poll(pool.timeout):
+            self.kill()
+            pool.report("killed", plan, "timeout after %ss" % (pool.timeout,))
+            future.set_exception(
+                WorkerTimeout(
+                    "Plan timed out after %ss: %s" % (pool.timeout, plan), plan
+                )
+            )
+            return
+
+        try:
+            status, value, retire = self.conn.recv()
+        except EOFError:
+            self.process.join(5)
+            code = self.process.exitcode
+            self.kill()
+            pool.report("crashed", plan, "exit code %s" % (code,))
+            future.set_exception(
+                WorkerCrashed("Worker died (%s) running %s" % (code, plan), plan)
+            )
+            return
+
+        if retire:
+            self.stop()
+            pool.recycled += 1
+
+        if status == "ok":
+            future.set_result(value)
+        else:
+            future.set_exception(value)
+
+
+class RenderPool(object):
+    def __init__(
+        self,
+        max_workers=None,
+        initializer=None,
+        initargs=(),
+        warm=True,
+        max_plots=None,
+        max_rss=None,
+        timeout=None,
+        startup_timeout=120,
+        context=None,
+    ):
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        if max_plots is None:
+            max_plots = _environ("MAGICS_WORKER_MAX_PLOTS", int)
+        if max_rss is None:
+            max_rss = _environ("MAGICS_WORKER_MAX_RSS", float, 1024 * 1024)
+        if timeout is None:
+            timeout = _environ("MAGICS_WORKER_TIMEOUT", float)
+        if context is None:
+            context = default_context()
+        elif isinstance(context, str):
+            context = multiprocessing.get_context(context)
+
+        self.initializer = initializer
+        self.initargs = initargs
+        self.warm = warm
+        self.max_plots = max_plots
+        self.max_rss = max_rss
+        self.timeout = timeout
+        self.startup_timeout = startup_timeout
+        self.context = context
+
+        self.lock = threading.Lock()
+        self.failures = []
+        self.started = 0
+        self.recycled = 0
+        self.killed = 0
+        self.crashed = 0
+
+        self.tasks = queue.Queue()
+        self.workers = [Worker(self, i) for i in range(max_workers)]
+
+    def submit(self, fn, *args, **kwargs):
+        future = concurrent.futures.Future()
+        self.tasks.put((future, fn, args, kwargs))
+        return future
+
+    def plot(self, *args, **kwargs):
+        """Return the future of macro.plot(*args, **kwargs) run by a worker."""
+        return self.submit(plot, *args, **kwargs)
+
+    def report(self, kind, plan, reason):
+        LOG.error("Magics worker %s: %s, %s", kind, reason, plan)
+        with self.lock:
+            setattr(self, kind, getattr(self, kind) + 1)
+            self.failures.append(
+                dict(time=time.time(), kind=kind, plan=plan, reason=reason)
+            )
+
+    def stats(self):
+        return dict(
+            workers=len(self.workers),
+            started=self.started,
+            recycled=self.recycled,
+            killed=self.killed,
+            crashed=self.crashed,
+            pending=self.tasks.qsize(),
+        )
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        if cancel_futures:
+            while True:
+                try:
+                    task = self.tasks.get_nowait()
+                except queue.Empty:
+                    break
+                if task is not None:
+                    task[0].cancel()
+        for worker in self.workers:
+            self.tasks.put(None)
+        if wait:
+            for worker in self.workers:
+                worker.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
@@ -0,0 +1,194 @@
+# (C) Copyright 1996-2016 ECMWF.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+# In applying this licence, ECMWF does not waive the privileges and immunities
+# granted to it by virtue of its status as an intergovernmental organisation nor
+# does it submit to any jurisdiction.
+
+"""
+Cache of the wrepjson input files of the meteograms.
+
+A station file holds the data of all the parameters, and libMagPlus parses
+all of it for every mwrepjson action. The file is parsed once here, and
+split in one slim file per parameter, holding the data of the parameter
+(eps and clim) and the metadata of the station; the mwrepjson actions of a
+parameter read its slim file.
+
+The parameters are the entries of the file named after a parameter, or the
+entries named after a parameter of the objects of the file (as in
+``{"eps": {"2t": ...}, "clim": {"2t": ...}}``); the other entries are kept
+in every slim file. The slim files are written to MAGICS_WREPJSON_CACHE
+(/dev/shm for example), or the Magics cache directory, in a directory by
+station file and a subdirectory by version (mtime and size) of the file.
+When a station file is split, the older versions of its slim files are
+removed, and the station files not used for MAGICS_WREPJSON_CACHE_AGE
+seconds (a day by default) are removed.
+
+toolbox.epsgram_batch uses the cache by default; epsgraph, epswind and
+epswave use it with ``cache=True``, or if MAGICS_WREPJSON_SLIM=on is set.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+ENABLED = os.environ.get("MAGICS_WREPJSON_SLIM", "off") in ("on", "1", "yes")
+
+MAX_AGE = float(os.environ.get("MAGICS_WREPJSON_CACHE_AGE", 24 * 3600))
+
+# Seconds between two evictions of the old station files
+EVICTION_INTERVAL = 600
+
+_lock = threading.Lock()
+_evicted = 0
+
+
+def directory():
+    """Return the directory of the slim files, creating it."""
+    path = os.environ.get("MAGICS_WREPJSON_CACHE")
+    if path is None:
+        from .Magics import cache_directory
+
+        path = os.path.join(cache_directory(), "wrepjson")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _keys(path):
+    # The keys of the station file and of its version
+    stat = os.stat(path)
+    station = hashlib.sha1(os.path.realpath(path).encode()).hexdigest()
+    version = hashlib.sha1(repr((stat.st_mtime, stat.st_size)).encode()).hexdigest()
+    return station, version
+
+
+def evict(max_age=None):
+    """Remove the slim files of the station files not used for ``max_age`` seconds."""
+    if max_age is None:
+        max_age = MAX_AGE
+    root = directory()
+    limit = time.time() - max_age
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        try:
+            if os.stat(path).st_mtime < limit:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            pass
+
+
+def _evict_versions(station, version):
+    for name in os.listdir(station):
+        if name != version:
+            shutil.rmtree(os.path.join(station, name), ignore_errors=True)
+
+
+def _parameters(data, known):
+    # The names of the parameters of the file
+    result = set()
+    for key, value in data.items():
+        if key in known:
+            result.add(key)
+        elif isinstance(value, dict):
+            result.update(k for k in value if k in known)
+    return result
+
+
+def slim(data, parameter, parameters):
+    """Return the entries of ``data`` needed to plot ``parameter``."""
+    result = {}
+    for key, value in data.items():
+        if key in parameters:
+            if key == parameter:
+                result[key] = value
+        elif isinstance(value, dict) and any(k in parameters for k in value):
+            result[key] = dict(
+                (k, v)
+                for k, v in value.items()
+                if k == parameter or k not in parameters
+            )
+        else:
+            result[key] = value
+    return result
+
+
+def _used(station, done):
+    # Whether the slim files exist, setting the mtime of the station directory
+    # to the time of its last use, for the eviction
+    if not os.path.exists(done):
+        return False
+    try:
+        os.utime(station)
+        return True
+    except OSError:
+        return False
+
+
+def split(path, known=()):
+    """
+    Parse the station file ``path`` once and write the slim file of each of
+    its parameters (the keys of toolbox.params, and ``known``). Return the
+    directory of the slim files, or None if the file cannot be split.
+    """
+    from .Magics import write_atomic
+    from .toolbox import params
+
+    global _evicted
+
+    try:
+        station, version = _keys(path)
+    except (IOError, OSError):
+        return None
+    station = os.path.join(directory(), station)
+    target = os.path.join(station, version)
+    done = os.path.join(target, "parameters.json")
+    if _used(station, done):
+        return target
+
+    with _lock:
+        if os.path.exists(done):
+            return target
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if not isinstance(data, dict):
+            return None
+
+        parameters = _parameters(data, set(params) | set(known))
+        os.makedirs(target, exist_ok=True)
+        for parameter in parameters:
+            write_atomic(
+                os.path.join(target, parameter + ".json"),
+                json.dumps(slim(data, parameter, parameters)),
+            )
+        write_atomic(done, json.dumps(sorted(parameters)))
+
+        _evict_versions(station, version)
+        if time.time() - _evicted > EVICTION_INTERVAL:
+            _evicted = time.time()
+            evict()
+    return target
+
+
+def input(path, parameter):
+    """
+    Return the slim file of ``parameter`` of the station file ``path``, or
+    ``path`` itself if the parameter is not found.
+    """
+    target = split(path, [parameter])
+    if target is not None:
+        result = os.path.join(target, parameter + ".json")
+        if os.path.exists(result):
+            return result
+    return path
+
+
+def clear():
+    """Remove the slim files."""
+    shutil.rmtree(directory(), ignore_errors=True)
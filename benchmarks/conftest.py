@@ -0,0 +1,9 @@
+import os
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+# Benchmark against the pure Python stand-in of libMagPlus by default, set
+# MAGICS_STANDIN=off to use the real library.
+os.environ.setdefault("MAGICS_STANDIN", "on")
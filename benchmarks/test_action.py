@@ -0,0 +1,65 @@
+#
+# Action.set with scalar, list and ndarray arguments of several sizes.
+#
+
+import numpy
+import pytest
+
+from Magics import Magics, macro
+
+SIZES = [1000, 100000, 1000000]
+
+
+def set_and_reset(action):
+    action.set()
+    for key in action.args:
+        Magics.reset(key)
+
+
+def test_scalars(benchmark):
+    benchmark.group = "action-scalars"
+    action = macro.mcont(
+        contour_line_colour="red",
+        contour_line_thickness=2,
+        contour_interval=5.0,
+        contour_label="on",
+        contour_highlight=False,
+        contour_shade_colour_list_policy="list",
+    )
+    benchmark(set_and_reset, action)
+
+
+@pytest.mark.parametrize("size", [10, 1000, 10000])
+def test_string_list(benchmark, size):
+    benchmark.group = "action-string-list"
+    action = macro.mcont(
+        contour_level_list=list(numpy.linspace(0.0, 100.0, size)),
+        contour_shade_colour_list=["rgb(%d,0,0)" % (i % 256) for i in range(size)],
+    )
+    benchmark(set_and_reset, action)
+
+
+@pytest.mark.parametrize("size", [10, 1000, 10000])
+def test_dict_list(benchmark, size):
+    benchmark.group = "action-dict-list"
+    action = macro.mtext(
+        text_lines=[{"line": i, "colour": "navy"} for i in range(size)]
+    )
+    benchmark(set_and_reset, action)
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("dtype", ["float64", "float32"])
+def test_ndarray_1d(benchmark, size, dtype):
+    benchmark.group = "action-ndarray-1d"
+    action = macro.minput(input_values=numpy.ones(size, dtype=dtype))
+    benchmark(set_and_reset, action)
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("dtype", ["float64", "float32"])
+def test_ndarray_2d(benchmark, size, dtype):
+    benchmark.group = "action-ndarray-2d"
+    rows = int(numpy.sqrt(size))
+    action = macro.minput(input_field=numpy.ones((rows, rows), dtype=dtype))
+    benchmark(set_and_reset, action)
@@ -0,0 +1,31 @@
+#
+# Decoding of MGB streams with BinaryDecoder.plot.
+#
+
+import pytest
+
+from Magics import synthetic
+
+pytest.importorskip("matplotlib")
+
+import matplotlib  # noqa: E402
+
+matplotlib.use("Agg")
+
+import matplotlib.pyplot as plt  # noqa: E402
+
+from Magics.binary import BinaryDecoder  # noqa: E402
+
+
+@pytest.mark.parametrize("lines", [10, 100, 1000])
+def test_decode(benchmark, tmp_path, lines):
+    benchmark.group = "mgb-decode"
+    path = str(tmp_path / "plot.mgb")
+    synthetic.mgb(path, lines=lines)
+    figure, axes = plt.subplots()
+
+    def decode():
+        BinaryDecoder(path).plot(axes)
+
+    benchmark(decode)
+    plt.close(figure)
@@ -0,0 +1,26 @@
+#
+# Compare the JSON encoders available to Magics.encoding.
+#
+#   pytest benchmarks/test_encoding.py
+#
+
+import numpy
+import pytest
+
+from Magics import encoding
+
+pytest.importorskip("pytest_benchmark")
+
+METADATA = dict(
+    ("attribute_%d" % i, numpy.float32(i) if i % 2 else numpy.int64(i))
+    for i in range(5000)
+)
+METADATA["history"] = "x" * 10000
+METADATA["levels"] = numpy.linspace(0.0, 1000.0, 5000)
+
+
+@pytest.mark.parametrize("name", sorted(encoding.encoders))
+def test_dumps_metadata(benchmark, name):
+    benchmark.group = "encoding"
+    encoder = encoding.encoders[name]
+    assert benchmark(encoder.dumps, METADATA)
@@ -0,0 +1,23 @@
+#
+# Conversion of xarray datasets to minput actions, at 1, 0.25 and 0.1 degree.
+#
+
+import pytest
+
+from Magics import macro, synthetic
+
+pytest.importorskip("xarray")
+
+
+@pytest.mark.parametrize("resolution", synthetic.RESOLUTIONS)
+def test_mxarray(benchmark, resolution):
+    benchmark.group = "mxarray"
+    dataset = synthetic.dataset(resolution)
+    benchmark(macro.mxarray, dataset, "t2m")
+
+
+@pytest.mark.parametrize("resolution", synthetic.RESOLUTIONS)
+def test_mxarray_set(benchmark, resolution):
+    benchmark.group = "mxarray-set"
+    action = macro.mxarray(synthetic.dataset(resolution), "t2m")
+    benchmark(action.set)
@@ -0,0 +1,58 @@
+#
+# End-to-end plots, against the stand-in or the real library.
+#
+
+import pytest
+
+from Magics import Magics, macro, synthetic, toolbox
+
+
+def output(tmp_path):
+    return macro.output(
+        output_formats=["png"],
+        output_name_first_page_number="off",
+        output_name=str(tmp_path / "plot"),
+    )
+
+
+@pytest.mark.parametrize("resolution", synthetic.RESOLUTIONS)
+def test_contour(benchmark, tmp_path, resolution):
+    benchmark.group = "plot-contour"
+    lat, lon, values = synthetic.field(resolution)
+    data = macro.minput(
+        input_field=values,
+        input_field_initial_latitude=float(lat[0]),
+        input_field_latitude_step=float(lat[1] - lat[0]),
+        input_field_initial_longitude=float(lon[0]),
+        input_field_longitude_step=float(lon[1] - lon[0]),
+    )
+    benchmark(
+        macro.plot,
+        output(tmp_path),
+        macro.mmap(),
+        macro.mcoast(),
+        data,
+        macro.mcont(contour_automatic_setting="ecmwf"),
+    )
+
+
+@pytest.mark.parametrize("resolution", synthetic.RESOLUTIONS)
+def test_geoplot(benchmark, tmp_path, resolution):
+    benchmark.group = "plot-toolbox"
+    path = str(tmp_path / "2m_temperature.grib")
+    synthetic.grib(path, resolution)
+    data = macro.mgrib(grib_input_file_name=path)
+    benchmark(toolbox.geoplot, data, output=output(tmp_path), title=["Title"])
+
+
+# The layout of the synthetic station file is only known to match the
+# stand-in, the real library would measure its error path
+@pytest.mark.skipif(
+    Magics.get_library_path() != "<standin>", reason="needs the stand-in library"
+)
+def test_epsgram(benchmark, tmp_path):
+    benchmark.group = "plot-toolbox"
+    station = str(tmp_path / "station.json")
+    synthetic.station(station)
+    path = str(tmp_path / "epsgram")
+    benchmark(toolbox.epsgram, "2t", station, output=path, climate=True)
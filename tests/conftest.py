@@ -0,0 +1,33 @@
+import os
+
+import pytest
+
+# Run the tests against the pure Python stand-in of libMagPlus, unless
+# MAGICS_STANDIN=off is set to use the real library.
+os.environ.setdefault("MAGICS_STANDIN", "on")
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers", "standin: the test needs the stand-in library, skipped otherwise"
+    )
+
+
+def pytest_collection_modifyitems(config, items):
+    from Magics import Magics
+
+    if Magics.get_library_path() == "<standin>":
+        return
+    skip = pytest.mark.skip(reason="needs the stand-in library")
+    for item in items:
+        if "standin" in item.keywords:
+            item.add_marker(skip)
+
+
+@pytest.fixture
+def dll():
+    """The stand-in library, with the calls recorded so far cleared."""
+    from Magics import Magics
+
+    Magics.dll.clear()
+    return Magics.dll
@@ -0,0 +1,49 @@
+import asyncio
+import time
+
+import pytest
+
+from Magics import aio, macro
+
+
+@pytest.fixture
+def pool():
+    pool = aio.PlotPool(workers=2, queue_size=2)
+    aio.set_pool(pool)
+    yield pool
+    aio.set_pool(None)
+
+
+@pytest.mark.standin
+def test_aplot(pool, tmp_path):
+    async def plots():
+        return await asyncio.gather(
+            *[
+                macro.aplot(
+                    macro.output(
+                        output_name=str(tmp_path / ("plot%d" % i)),
+                        output_name_first_page_number="off",
+                    ),
+                    macro.mmap(),
+                    macro.mcoast(),
+                )
+                for i in range(4)
+            ]
+        )
+
+    asyncio.run(plots())
+    for i in range(4):
+        assert (tmp_path / ("plot%d.png" % i)).exists()
+
+
+def test_timeout(pool):
+    async def run():
+        slow = [asyncio.ensure_future(pool.run(time.sleep, 1.0)) for i in range(2)]
+        await asyncio.sleep(0.1)
+        # No slot is free: the call times out while waiting for one
+        with pytest.raises(asyncio.TimeoutError):
+            await pool.run(time.sleep, 0.0, timeout=0.2)
+        await asyncio.gather(*slow)
+        return await pool.run(abs, -1, timeout=5)
+
+    assert asyncio.run(run()) == 1
@@ -0,0 +1,40 @@
+import time
+
+import numpy
+
+from Magics import Magics
+
+
+def test_buffer_pool():
+    pool = Magics.BufferPool(1024 * 1024)
+    with pool.borrow((10, 10), numpy.float64) as buffer:
+        assert buffer.shape == (10, 10)
+        assert buffer.ctypes.data % pool.ALIGNMENT == 0
+    with pool.borrow((100,), numpy.float64):
+        pass
+    stats = pool.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["bytes_held"] == pool.MIN_BUCKET
+
+
+def test_buffer_pool_idle():
+    # The buffers idle for more than max_idle seconds are released
+    pool = Magics.BufferPool(1024 * 1024, max_idle=60.0)
+    with pool.borrow((10,), numpy.float64):
+        pass
+    assert pool.stats()["bytes_held"] == pool.MIN_BUCKET
+    pool.expire(time.monotonic() + 30)
+    assert pool.stats()["buffers"] == 1
+    pool.expire(time.monotonic() + 61)
+    assert pool.stats()["buffers"] == 0
+    assert pool.stats()["bytes_held"] == 0
+
+
+def test_buffer_pool_resize():
+    pool = Magics.BufferPool(1024 * 1024)
+    with pool.borrow((1000,), numpy.float64):
+        pass
+    pool.resize(4096)
+    assert pool.stats()["bytes_held"] == 0
+    assert pool.stats()["max_bytes"] == 4096
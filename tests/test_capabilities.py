@@ -0,0 +1,17 @@
+import pytest
+
+from Magics import Magics
+
+
+def test_capabilities(tmp_path, monkeypatch):
+    library = tmp_path / "libMagPlus.so"
+    library.write_bytes(b"")
+    monkeypatch.setattr(Magics, "lib", str(library))
+    monkeypatch.setenv("MAGICS_CACHE_DIR", str(tmp_path / "cache"))
+
+    probed = Magics._capabilities()
+    assert (tmp_path / "cache" / "capabilities.json").exists()
+
+    monkeypatch.setattr(Magics, "_probe", lambda: pytest.fail("probed again"))
+    assert Magics._capabilities() == probed
+    assert set(Magics.capabilities()) == set(Magics.SYMBOLS)
@@ -0,0 +1,56 @@
+import pytest
+
+from Magics import Magics, logs, macro
+
+
+class Emit(object):
+    # An action sending messages from libMagPlus, then failing if asked
+    verb = "emit"
+
+    def __init__(self, fail=False):
+        self.fail = fail
+
+    def execute(self):
+        Magics.dll.emit("warning", "first")
+        Magics.dll.emit("error", "second")
+        if self.fail:
+            raise RuntimeError("plot failed")
+
+
+def output(tmp_path):
+    return macro.output(
+        output_name=str(tmp_path / "plot"), output_name_first_page_number="off"
+    )
+
+
+@pytest.mark.standin
+def test_plot(tmp_path):
+    result, diagnostics = macro.plot(
+        output(tmp_path), macro.mmap(), Emit(), diagnostics=True
+    )
+    assert result is None
+    assert isinstance(diagnostics, logs.Diagnostics)
+    assert diagnostics.warnings == 1 and diagnostics.errors == 1
+    assert diagnostics.messages == [("warning", "first"), ("error", "second")]
+    assert macro.diagnostics is None
+
+
+@pytest.mark.standin
+def test_failure(tmp_path):
+    with pytest.raises(RuntimeError) as e:
+        macro.plot(output(tmp_path), macro.mmap(), Emit(fail=True), diagnostics=True)
+    assert e.value.diagnostics.errors == 1
+    assert e.value.diagnostics.to_dict()["messages"][1] == dict(
+        level="error", message="second"
+    )
+
+
+@pytest.mark.standin
+def test_capture(dll):
+    with macro.capture() as diagnostics:
+        dll.emit("warning", "first")
+        dll.emit("warning", "second")
+        dll.emit("error", "third")
+    assert diagnostics.warnings == 2
+    assert diagnostics.errors == 1
+    assert diagnostics.messages[0] == ("warning", "first")
@@ -0,0 +1,53 @@
+import json
+import math
+
+import numpy
+import pytest
+
+from Magics import encoding
+
+pytest.importorskip("orjson")
+
+
+def document():
+    return {
+        "int": numpy.int32(3),
+        "float": numpy.float64(0.1),
+        "float32": numpy.float32(0.1),
+        "bool": numpy.bool_(True),
+        "values": numpy.linspace(0, 1, 11),
+        "values32": numpy.linspace(0, 1, 11, dtype=numpy.float32),
+        "matrix": numpy.arange(12, dtype=numpy.int64).reshape(3, 4),
+        "missing": numpy.array([1.5, numpy.nan]),
+        "text_lines": [{"text": "title", "size": numpy.float32(0.5)}],
+    }
+
+
+def same(a, b):
+    # float32 values are compared as float32, NaN is written as null by orjson
+    if isinstance(a, float) and math.isnan(a):
+        return b is None
+    if isinstance(a, float) and isinstance(b, float):
+        return a == b or numpy.float32(a) == numpy.float32(b)
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(same(a[k], b[k]) for k in a)
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(same(x, y) for x, y in zip(a, b))
+    return a == b
+
+
+def test_encoders():
+    doc = document()
+    decoded = json.loads(encoding.encoders["json"].dumps(doc))
+    fast = json.loads(encoding.encoders["orjson"].dumps(doc))
+    assert same(decoded, fast)
+
+    # The differences documented in Magics.encoding
+    assert math.isnan(decoded["missing"][1]) and fast["missing"][1] is None
+    assert decoded["float32"] != fast["float32"]
+    assert decoded["float"] == fast["float"] == 0.1
+    assert (
+        decoded["matrix"]
+        == fast["matrix"]
+        == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9, 10, 11]]
+    )
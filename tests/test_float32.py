@@ -0,0 +1,54 @@
+import numpy
+import pytest
+
+from Magics import Magics, macro, standin
+
+
+def test_passthrough(monkeypatch):
+    # float32 arrays reach a library providing py_set1f/py_set2f unconverted
+    library = standin.Library(float32=True)
+    py_set1f, py_set2f = Magics._float32(library)
+    monkeypatch.setattr(Magics, "py_set1f", py_set1f)
+    monkeypatch.setattr(Magics, "py_set2f", py_set2f)
+
+    values = numpy.linspace(0.0, 1.0, 12, dtype=numpy.float32)
+    Magics.set1r("input_values", values)
+    Magics.set2r("input_field", values.reshape(3, 4), 4, 3)
+
+    assert library.calls == {"py_set1f": 1, "py_set2f": 1}
+    assert library.parameters["input_values"].dtype == numpy.float32
+    assert library.parameters["input_values"].tolist() == values.tolist()
+    assert library.parameters["input_field"].dtype == numpy.float32
+    assert library.bytes["py_set2f"] == values.nbytes
+
+
+@pytest.mark.standin
+def test_upcast(dll, tmp_path):
+    # Without py_set2f, float32 fields are upcast into buffers of the pool,
+    # reused by the next plots
+    field = numpy.zeros((181, 360), dtype=numpy.float32)
+
+    def plot():
+        macro.plot(
+            macro.output(
+                output_formats=["png"],
+                output_name=str(tmp_path / "upcast"),
+                output_name_first_page_number="off",
+            ),
+            macro.minput(
+                input_field=field,
+                input_field_initial_latitude=90.0,
+                input_field_latitude_step=-1.0,
+                input_field_initial_longitude=0.0,
+                input_field_longitude_step=1.0,
+            ),
+            macro.mcont(),
+        )
+
+    plot()
+    hits = Magics.buffer_pool.stats()["hits"]
+    plot()
+    assert Magics.buffer_pool.stats()["hits"] > hits
+    assert dll.calls["py_set2r"] == 2
+    assert dll.bytes["py_set2r"] == 2 * field.size * 8
+    assert "py_set2f" not in dll.calls
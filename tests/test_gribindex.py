@@ -0,0 +1,131 @@
+import os
+
+import pytest
+
+from Magics import gribindex, synthetic
+
+
+def grib1(parameter, level_type, level, step, table=128):
+    return synthetic.grib1_message(
+        parameter, level_type, level, step, date=20201019, hour=12, table=table
+    )
+
+
+def grib2(discipline, category, number, surface, level, step):
+    return synthetic.grib2_message(
+        discipline, category, number, surface, level, step, date=20261019, hour=6
+    )
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / "data.grib")
+    with open(path, "wb") as f:
+        f.write(grib1(130, 100, 500, 12))
+        f.write(grib1(167, 1, 0, 12))
+        f.write(b"\0" * 7)
+        f.write(grib2(0, 0, 0, 103, 2, 24))
+        f.write(grib2(0, 2, 2, 100, 85000, 24))
+    return path
+
+
+def test_decode(path):
+    index = gribindex.GribIndex.build(path)
+    keys = [(m["shortName"], m["typeOfLevel"], m["level"], m["step"]) for m in index]
+    assert keys == [
+        ("t", "isobaricInhPa", 500, 12),
+        ("2t", "surface", 0, 12),
+        ("2t", "heightAboveGround", 2, 24),
+        ("u", "isobaricInhPa", 850, 24),
+    ]
+    assert [m["date"] for m in index] == [20201019, 20201019, 20261019, 20261019]
+    assert index.messages[2]["offset"] == 87
+
+
+def test_local_tables(tmp_path):
+    # The names of table 128 are not used for the other local tables, and
+    # the steps are converted to hours
+    path = str(tmp_path / "local.grib")
+    with open(path, "wb") as f:
+        f.write(synthetic.grib1_message(167, table=171, step=2, unit=10))
+        f.write(synthetic.grib1_message(167, table=128, step=1, unit=2))
+        f.write(synthetic.grib1_message(11, table=2, step=30, unit=0))
+    index = gribindex.GribIndex.build(path)
+    keys = [(m["shortName"], m["step"]) for m in index]
+    assert keys == [("171.167", 6), ("2t", 24), ("t", 0.5)]
+    assert [m["position"] for m in index.select(shortName="2t")] == [2]
+
+    with open(path, "wb") as f:
+        f.write(synthetic.grib1_message(167, step=1, unit=3))
+    with pytest.raises(ValueError):
+        gribindex.GribIndex.build(path)
+
+
+def test_select(path):
+    index = gribindex.index(path)
+    assert index.position(shortName="u", level=850, step=24) == 4
+    assert [m["position"] for m in index.select(shortName="2t")] == [2, 3]
+    assert [m["position"] for m in index.select(step=12)] == [1, 2]
+    with pytest.raises(KeyError):
+        index.position(shortName="v", level=850, step=24)
+
+    extract = index.extract(
+        str(os.path.dirname(path)), shortName="t", level=500, step=12
+    )
+    with open(extract, "rb") as f:
+        assert f.read() == gribindex.read(path, 1)
+
+
+def test_sidecar(path, monkeypatch):
+    index = gribindex.index(path)
+    assert os.path.exists(path + ".magidx")
+
+    def build(*args):
+        raise AssertionError("index rebuilt")
+
+    with monkeypatch.context() as m:
+        m.setattr(gribindex.GribIndex, "build", build)
+        assert gribindex.index(path).messages == index.messages
+
+    # The index is rebuilt when the file changes
+    with open(path, "ab") as f:
+        f.write(grib1(151, 102, 0, 0))
+    assert len(gribindex.index(path)) == 5
+
+
+def test_mgrib(path, tmp_path, monkeypatch):
+    monkeypatch.setenv("MAGICS_CACHE_DIR", str(tmp_path / "cache"))
+    index = gribindex.index(path)
+    action = index.mgrib(shortName="t", level=500, step=12)
+    assert action.args["grib_field_position"] == 1
+    action = index.mgrib(extract=True, shortName="u", level=850, step=24)
+    assert action.args["grib_input_file_name"].startswith(str(tmp_path / "cache"))
+
+
+def test_scan(tmp_path):
+    path = str(tmp_path / "data.grib")
+    with open(path, "wb") as f:
+        for i in range(3):
+            f.write(synthetic.grib1_message(130 + i) + b"\0" * 10)
+    assert gribindex.scan(path) == [(0, 40, 1), (50, 40, 1), (100, 40, 1)]
+    assert gribindex.read(path, 2)[16] == 131
+
+
+def test_corrupt(tmp_path):
+    path = str(tmp_path / "zero.grib")
+    with open(path, "wb") as f:
+        f.write(b"GRIB\0\0\0\x01" + bytes(32))
+    with pytest.raises(ValueError):
+        gribindex.scan(path)
+
+    # A template 4.8 section without the end of the statistical processing
+    path = str(tmp_path / "short.grib")
+    message = bytearray(grib2(0, 1, 8, 1, 0, 6))
+    start = 16 + 21 + 7
+    end = start + 2
+    message[start:end] = (8).to_bytes(2, "big")
+    with open(path, "wb") as f:
+        f.write(bytes(message))
+    with pytest.raises(ValueError) as e:
+        gribindex.GribIndex.build(path)
+    assert "template 4.8" in str(e.value)
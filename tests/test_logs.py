@@ -0,0 +1,58 @@
+import logging
+import time
+
+from Magics import logs
+
+
+class Recorder(logging.Handler):
+    def __init__(self):
+        super(Recorder, self).__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def logger():
+    recorder = Recorder()
+    log = logging.getLogger("test_logs")
+    log.handlers = [recorder]
+    log.propagate = False
+    log.setLevel(logging.DEBUG)
+    return log, recorder
+
+
+def test_burst():
+    log, recorder = logger()
+    pipeline = logs.LogPipeline(log, burst=1, period=0.2, interval=0.01).start()
+    try:
+        for i in range(10):
+            pipeline.push("warning", b"same")
+        pipeline.push("info", b"other")
+
+        # The summary is logged at the end of the period, before stop()
+        deadline = time.monotonic() + 5
+        while len(recorder.messages) < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert recorder.messages == ["same", "other", "same [repeated 9 more times]"]
+    finally:
+        pipeline.stop()
+
+    assert pipeline.stats() == dict(
+        received=11, delivered=2, dropped=0, suppressed=9, pending=0
+    )
+
+
+def test_capacity():
+    log, recorder = logger()
+    pipeline = logs.LogPipeline(log, capacity=3, burst=10)
+    for i in range(5):
+        pipeline.push("info", b"message %d" % (i,))
+    assert pipeline.stats()["dropped"] == 2
+    assert pipeline.stats()["pending"] == 3
+
+    pipeline.flush()
+    assert recorder.messages == ["message 0", "message 1", "message 2"]
+    assert pipeline.stats() == dict(
+        received=5, delivered=3, dropped=2, suppressed=0, pending=0
+    )
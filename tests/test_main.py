@@ -0,0 +1,21 @@
+def test_benchmark_command(capsys):
+    from Magics.__main__ import main
+
+    main(["benchmark", "--product", "contour", "--resolution", "1", "--repeat", "2"])
+    assert "contour" in capsys.readouterr().out
+
+
+def test_profile_command(tmp_path):
+    from Magics.__main__ import main
+
+    script = tmp_path / "script.py"
+    script.write_text(
+        "from Magics import macro\n"
+        "for i in range(5):\n"
+        "    macro.plot(macro.mmap(), macro.mcoast())\n"
+    )
+    output = tmp_path / "magics.folded"
+    main(["profile", "--output", str(output), str(script)])
+    for line in output.read_text().splitlines():
+        stack, count = line.rsplit(" ", 1)
+        assert int(count) > 0
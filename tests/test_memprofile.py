@@ -0,0 +1,43 @@
+import json
+import os
+import tracemalloc
+
+from Magics import macro, memprofile
+
+
+def test_report(tmp_path):
+    tracing = tracemalloc.is_tracing()
+    profiler = memprofile.enable(str(tmp_path))
+    try:
+        macro.plot(
+            macro.output(
+                output_name=str(tmp_path / "plot"),
+                output_name_first_page_number="off",
+            ),
+            macro.mmap(),
+            macro.mcoast(),
+        )
+    finally:
+        memprofile.disable()
+        if not tracing:
+            tracemalloc.stop()
+
+    path = tmp_path / ("magics-memprofile-%d-%d.json" % (os.getpid(), profiler.plots))
+    with open(path) as f:
+        report = json.load(f)
+    assert report["pid"] == os.getpid()
+    assert report["total"]["step"] == "plot"
+    assert report["peak_python"] > 0
+
+    steps = [(s["step"], s["verb"]) for s in report["steps"]]
+    assert steps == [
+        ("init", None),
+        ("execute", "output"),
+        ("execute", "mmap"),
+        ("execute", "mcoast"),
+        ("finalize", None),
+    ]
+    for step in report["steps"]:
+        assert "python" in step
+        if "rss" in step:
+            assert step["native"] >= 0
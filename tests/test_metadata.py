@@ -0,0 +1,17 @@
+import json
+
+from Magics import Magics, macro
+
+
+def test_predefined_areas(tmp_path, monkeypatch):
+    styles = tmp_path / "share" / "magics" / "styles"
+    styles.mkdir(parents=True)
+    (styles / "projections.json").write_text(json.dumps({"europe": {}}))
+    monkeypatch.setattr(Magics, "home", lambda: str(tmp_path).encode())
+    monkeypatch.setattr(macro, "_metadata", {})
+
+    assert macro.predefined_areas() == ["europe"]
+    assert macro.predefined_areas() == ["europe"]
+
+    (styles / "projections.json").write_text(json.dumps({"europe": {}, "africa": {}}))
+    assert macro.predefined_areas() == ["europe", "africa"]
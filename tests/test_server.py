@@ -0,0 +1,175 @@
+import concurrent.futures
+import threading
+import urllib.error
+import urllib.request
+
+import numpy
+import pytest
+
+from Magics import macro, server
+
+
+def layers():
+    data = macro.minput(
+        input_field=numpy.zeros((181, 360)),
+        input_field_initial_latitude=90.0,
+        input_field_latitude_step=-1.0,
+        input_field_initial_longitude=0.0,
+        input_field_longitude_step=1.0,
+    )
+    return [server.Layer("t2m", data)]
+
+
+GETMAP = dict(
+    service="WMS",
+    request="GetMap",
+    version="1.3.0",
+    layers="t2m",
+    crs="EPSG:4326",
+    bbox="-90,-180,90,180",
+    width="512",
+    height="256",
+    format="image/png",
+)
+
+
+@pytest.mark.standin
+def test_getmap(tmp_path):
+    magics = server.Server(layers(), workers=1, cache_directory=str(tmp_path))
+    try:
+        status, headers, body = magics.handle("/wms", GETMAP)
+        assert status == 200
+        assert body.startswith(b"\x89PNG")
+
+        status, _, _ = magics.handle("/wms", GETMAP, {"If-None-Match": headers["ETag"]})
+        assert status == 304
+        assert magics.renders == 1
+
+        status, _, body = magics.handle("/wms", dict(GETMAP, layers="unknown"))
+        assert status == 404
+
+        status, _, body = magics.handle("/tiles/t2m/EPSG-3857/1/0/1.png", {})
+        assert status == 200
+        assert magics.renders == 2
+    finally:
+        magics.close()
+
+    # The disk cache survives the server
+    magics = server.Server(layers(), workers=1, cache_directory=str(tmp_path))
+    try:
+        status, _, _ = magics.handle("/wms", GETMAP)
+        assert status == 200
+        assert magics.renders == 0
+        assert magics.cache.stats()["disk_hits"] == 1
+    finally:
+        magics.close()
+
+
+@pytest.mark.standin
+def test_revalidate_evicted():
+    # An If-None-Match request is answered without rendering the evicted map
+    magics = server.Server(layers(), workers=1, max_bytes=1)
+    try:
+        status, headers, _ = magics.handle("/wms", GETMAP)
+        magics.handle("/wms", dict(GETMAP, width="256"))
+        assert magics.cache.stats()["entries"] == 1
+
+        status, _, _ = magics.handle("/wms", GETMAP, {"If-None-Match": headers["ETag"]})
+        assert status == 304
+        assert magics.renders == 2
+    finally:
+        magics.close()
+
+
+@pytest.mark.standin
+def test_capabilities_lock_held():
+    # The styles are resolved by the workers, not under the LOCK of the server
+    magics = server.Server(layers(), workers=2)
+    held = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with macro.LOCK:
+            held.set()
+            release.wait(60)
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    held.wait()
+    try:
+        with concurrent.futures.ThreadPoolExecutor(1) as executor:
+            future = executor.submit(
+                magics.handle, "/wms", {"SERVICE": "WMS", "REQUEST": "GetCapabilities"}
+            )
+            status, _, body = future.result(30)
+        assert status == 200
+        assert b"<Name>t2m</Name>" in body
+    finally:
+        release.set()
+        thread.join()
+        magics.close()
+
+
+@pytest.mark.standin
+def test_capabilities():
+    magics = server.Server(layers(), workers=1)
+    try:
+        status, headers, body = magics.handle(
+            "/wms", {"SERVICE": "WMS", "REQUEST": "GetCapabilities"}
+        )
+        assert status == 200
+        assert b"<Name>t2m</Name>" in body
+        assert b"<CRS>EPSG:3857</CRS>" in body
+    finally:
+        magics.close()
+
+
+def test_coalescer():
+    coalescer = server.Coalescer()
+    future = concurrent.futures.Future()
+    submitted = []
+
+    def submit():
+        submitted.append(1)
+        return future
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(coalescer.run("key", submit)))
+        for i in range(8)
+    ]
+    for t in threads:
+        t.start()
+    while coalescer.coalesced < 7:
+        pass
+    future.set_result(b"png")
+    for t in threads:
+        t.join()
+
+    assert submitted == [1]
+    assert results == [b"png"] * 8
+    assert coalescer.pending == {}
+
+
+@pytest.mark.standin
+def test_http():
+    httpd = server.make_server(layers(), port=0, workers=1)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+        url = "http://localhost:%d/wms?%s" % (
+            httpd.server_port,
+            "&".join("%s=%s" % x for x in GETMAP.items()),
+        )
+        with urllib.request.urlopen(url) as response:
+            assert response.headers["Content-Type"] == "image/png"
+            etag = response.headers["ETag"]
+
+        request = urllib.request.Request(url, headers={"If-None-Match": etag})
+        with pytest.raises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(request)
+        assert e.value.code == 304
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+        httpd.magics.close()
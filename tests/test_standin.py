@@ -0,0 +1,47 @@
+import numpy
+import pytest
+
+from Magics import Magics, macro
+
+
+@pytest.mark.standin
+def test_plot(dll, tmp_path):
+    output = macro.output(
+        output_name=str(tmp_path / "plot"), output_name_first_page_number="off"
+    )
+    macro.plot(output, macro.mmap(), macro.mcoast(), macro.mcont())
+
+    assert dll.calls["py_open"] == 1
+    assert dll.calls["py_coast"] == 1
+    assert dll.calls["py_cont"] == 1
+    assert dll.calls["py_close"] == 1
+    assert (tmp_path / "plot.png").read_bytes().startswith(b"\x89PNG")
+
+
+@pytest.mark.standin
+def test_set1r(dll):
+    values = numpy.arange(10, dtype=numpy.float32)
+    Magics.set1r("input_values", values)
+    assert dll.parameters["input_values"].dtype == numpy.float64
+    assert (dll.parameters["input_values"] == values).all()
+    assert dll.bytes["py_set1r"] == 80
+
+
+@pytest.mark.standin
+def test_set2i(dll):
+    # py_set2i takes an int*: the values are passed as C ints
+    values = numpy.arange(6, dtype=numpy.int64).reshape(2, 3)
+    Magics.set2i("input_values", values, 2, 3)
+    assert dll.parameters["input_values"].dtype == numpy.intc
+    assert (dll.parameters["input_values"] == values).all()
+    assert dll.bytes["py_set2i"] == 6 * numpy.dtype(numpy.intc).itemsize
+    assert Magics.array_2d_int._dtype_ == numpy.intc
+
+
+@pytest.mark.standin
+def test_stats(dll):
+    with Magics.instrument():
+        macro.plot(macro.mcoast())
+    stats = Magics.stats()
+    assert stats["coast"]["calls"] == 1
+    assert stats["init"]["calls"] == 1
@@ -0,0 +1,40 @@
+import json
+
+import numpy
+import pytest
+
+from Magics import Magics, macro
+
+
+@pytest.mark.standin
+def test_set1c(dll):
+    Magics.set1c("text_lines", ["one", "", "three"])
+    assert dll.parameters["text_lines"] == ["one", "", "three"]
+
+    strings = macro.mtext(text_lines=[{"a": 1}, {"b": 2}]).encode_strings("text_lines")
+    Magics.set1c("text_lines", strings)
+    assert [json.loads(x) for x in dll.parameters["text_lines"]] == [{"a": 1}, {"b": 2}]
+
+
+@pytest.mark.standin
+def test_encode_strings_nested(dll):
+    # A nested value changed in place is encoded again
+    lines = [{"text": "title", "font": {"size": 1}}]
+    action = macro.mtext(text_lines=lines)
+    strings = action.encode_strings("text_lines")
+    assert action.encode_strings("text_lines") is strings
+
+    lines[0]["font"]["size"] = 2
+    Magics.set1c("text_lines", action.encode_strings("text_lines"))
+    assert json.loads(dll.parameters["text_lines"][0])["font"] == {"size": 2}
+
+
+@pytest.mark.standin
+def test_encode_strings_arrays(dll):
+    # Dictionaries holding arrays are encoded again, instead of compared
+    values = numpy.arange(3)
+    action = macro.mtext(text_lines=[{"values": values}])
+    action.encode_strings("text_lines")
+    values[0] = 5
+    Magics.set1c("text_lines", action.encode_strings("text_lines"))
+    assert json.loads(dll.parameters["text_lines"][0]) == {"values": [5, 1, 2]}
@@ -0,0 +1,71 @@
+import numpy
+import pytest
+
+from Magics import macro, styles, synthetic
+
+
+def grib1(path, parameter, date):
+    with open(path, "ab") as f:
+        f.write(synthetic.grib1_message(parameter, 100, date=date))
+
+
+def grib2(path, category, number, section4=34):
+    # A message with a large section 3, as the pl array of an O1280 grid
+    section3 = bytearray(5072)
+    section3[0:5] = len(section3).to_bytes(4, "big") + b"\x03"
+    section3[12:14] = (40).to_bytes(2, "big")
+    message = synthetic.grib2_message(
+        0, category, number, section3=bytes(section3), section4=section4
+    )
+    with open(path, "wb") as f:
+        f.write(message)
+
+
+def fingerprint(path):
+    return styles.fingerprint(macro.mgrib(grib_input_file_name=str(path)))
+
+
+def test_large_grid(tmp_path):
+    grib2(tmp_path / "t.grib", 0, 0)
+    grib2(tmp_path / "t2.grib", 0, 0)
+    grib2(tmp_path / "tp.grib", 1, 8)
+    assert styles.grib_identification(str(tmp_path / "t.grib")) is not None
+    assert fingerprint(tmp_path / "t.grib") == fingerprint(tmp_path / "t2.grib")
+    assert fingerprint(tmp_path / "t.grib") != fingerprint(tmp_path / "tp.grib")
+
+
+def test_truncated(tmp_path):
+    # Without a product definition, the files are identified by path
+    grib2(tmp_path / "a.grib", 0, 0, section4=8)
+    grib2(tmp_path / "b.grib", 0, 0, section4=8)
+    assert styles.grib_identification(str(tmp_path / "a.grib")) is None
+    assert fingerprint(tmp_path / "a.grib") != fingerprint(tmp_path / "b.grib")
+
+
+def test_style_fingerprint(tmp_path):
+    grib1(tmp_path / "a.grib", 130, 20240101)
+    grib1(tmp_path / "a.grib", 131, 20240101)
+    grib1(tmp_path / "b.grib", 130, 20250101)
+
+    def fingerprint(name, position=1):
+        return styles.fingerprint(
+            macro.mgrib(
+                grib_input_file_name=str(tmp_path / name),
+                grib_field_position=position,
+            )
+        )
+
+    assert fingerprint("a.grib") == fingerprint("b.grib")
+    assert fingerprint("a.grib", 2) != fingerprint("b.grib")
+
+
+@pytest.mark.standin
+def test_wmsstyles(dll):
+    styles.cache.clear()
+    layers = [macro.minput(input_field=numpy.zeros((10, 20))) for i in range(3)]
+    assert macro.wmsstyles_batch(layers) == [{}, {}, {}]
+    assert dll.calls["py_open"] == 1
+    assert dll.calls["py_meta"] == 1
+    assert macro.wmsstyles(layers[0]) == {}
+    assert dll.calls["py_open"] == 1
+    assert styles.cache.stats()["hits"] == 1
@@ -0,0 +1,88 @@
+import numpy
+import pytest
+
+from Magics import Magics, macro, thinning
+
+
+def test_thin():
+    data = macro.minput(
+        input_latitudes_list=[10.0, 10.01, 50.0, 60.0],
+        input_longitudes_list=[0.0, 0.01, 20.0, 400.0],
+        input_values=[1.0, 2.0, 3.0, 4.0],
+        input_thinning="on",
+    )
+    thinned = data.thin(macro.mmap(subpage_upper_right_latitude=55.0))
+    assert thinned.args["input_values"] == [1.0, 3.0]
+    assert data.args["input_values"] == [1.0, 2.0, 3.0, 4.0]
+
+
+def test_thin_arrays():
+    # The arrays are thinned, also with the input_*_values spelling
+    data = macro.minput(
+        input_latitude_values=numpy.array([10.0, 10.01, 50.0]),
+        input_longitude_values=numpy.array([0.0, 0.01, 20.0]),
+        input_values=numpy.array([1.0, 2.0, 3.0]),
+        input_thinning="on",
+    )
+    thinned = data.thin(macro.mmap())
+    assert isinstance(thinned.args["input_values"], numpy.ndarray)
+    assert thinned.args["input_values"].tolist() == [1.0, 3.0]
+    assert thinned.args["input_latitude_values"].tolist() == [10.0, 50.0]
+
+
+def test_thin_not_cylindrical():
+    data = macro.minput(
+        input_latitudes_list=[10.0, 10.01],
+        input_longitudes_list=[0.0, 0.01],
+        input_values=[1.0, 2.0],
+    )
+    assert data.thin(macro.mmap(subpage_map_projection="polar_stereographic")) is data
+
+
+def test_grid_thin_dateline():
+    # An area from 170E to 170W
+    index = thinning.grid_thin(
+        [0.0, 0.0, 0.0, 0.001, 0.0],
+        [175.0, -175.0, 0.0, 175.001, 185.0],
+        (-10.0, 170.0, 10.0, -170.0),
+        (10, 10),
+    )
+    assert index.tolist() == [0, 1]
+
+
+@pytest.mark.parametrize(
+    "corners", [(10.0, -20.0, 10.0, 20.0), (-10.0, 20.0, 10.0, 20.0)]
+)
+def test_grid_thin_empty_area(corners):
+    index = thinning.grid_thin([10.0, 10.0], [20.0, 20.0], corners, (10, 10))
+    assert index.tolist() == [0, 1]
+
+
+@pytest.mark.standin
+def test_plot(tmp_path, monkeypatch):
+    # The thinned values are sent to the library
+    sent = {}
+    set1r = Magics.set1r
+
+    def record(name, data):
+        sent[name] = list(data)
+        return set1r(name, data)
+
+    monkeypatch.setattr(Magics, "set1r", record)
+    macro.plot(
+        macro.output(
+            output_formats=["png"],
+            output_name=str(tmp_path / "thin"),
+            output_name_first_page_number="off",
+        ),
+        macro.mmap(),
+        macro.minput(
+            input_latitudes_list=[10.0, 10.01, 50.0],
+            input_longitudes_list=[0.0, 0.01, 20.0],
+            input_values=[1.0, 2.0, 3.0],
+            input_thinning="on",
+        ),
+        macro.msymb(),
+    )
+    assert sent["input_values"] == [1.0, 3.0]
+    assert sent["input_latitudes_list"] == [10.0, 50.0]
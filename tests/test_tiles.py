@@ -0,0 +1,120 @@
+import numpy
+import pytest
+
+from Magics import Magics, macro, tiles
+
+
+def layers():
+    # Valid values in the western hemisphere only
+    values = numpy.full((181, 360), numpy.nan)
+    values[:, 181:] = 280.0
+    return [
+        macro.minput(
+            input_field=values,
+            input_field_initial_latitude=90.0,
+            input_field_latitude_step=-1.0,
+            input_field_initial_longitude=0.0,
+            input_field_longitude_step=1.0,
+        ),
+        macro.mcont(),
+    ]
+
+
+def test_grid():
+    grid = tiles.Grid("EPSG:4326")
+    assert grid.shape(0) == (2, 1)
+    assert grid.shape(2) == (8, 4)
+    assert grid.bbox(tiles.Tile(0, 0, 0)) == (-180.0, -90.0, 0.0, 90.0)
+
+    grid = tiles.Grid("EPSG:3857")
+    assert grid.shape(3) == (8, 8)
+    assert grid.bbox(tiles.Tile(0, 0, 0)) == pytest.approx(
+        (-20037508.34, -20037508.34, 20037508.34, 20037508.34)
+    )
+    assert grid.bbox(tiles.Tile(1, 1, 0))[0] == 0.0
+    west, south, east, north = grid.geographic(tiles.Tile(0, 0, 0))
+    assert west == pytest.approx(-180.0)
+    assert north == pytest.approx(85.0511, abs=1e-4)
+
+    with pytest.raises(ValueError):
+        tiles.Grid("EPSG:0")
+
+
+def test_coverage_small_tiles():
+    # At zoom 8, the tiles are smaller than the 1 degree grid step
+    field = macro.minput(
+        input_field=numpy.zeros((181, 360)),
+        input_field_initial_latitude=90.0,
+        input_field_latitude_step=-1.0,
+        input_field_initial_longitude=0.0,
+        input_field_longitude_step=1.0,
+    )
+    grid = tiles.Grid("EPSG:4326")
+    pyramid = tiles.Pyramid(grid, [field], output=None)
+    assert not any(pyramid.empty(tiles.Tile(8, x, 100)) for x in range(512))
+
+
+def test_coverage_symbols():
+    # A point just outside a tile is drawn on it by its symbol
+    points = macro.minput(
+        input_latitudes_list=[45.0],
+        input_longitudes_list=[-90.5],
+        input_values=[1.0],
+    )
+    bbox = (-90.0, 0.0, 0.0, 90.0)
+    coverage = tiles.coverage([points, macro.msymb(symbol_height=0.5)])
+    assert coverage[0].intersects(bbox)
+    assert not coverage[0].intersects((0.0, 0.0, 90.0, 90.0))
+    coverage = tiles.coverage([points, macro.msymb()], size=4096)
+    assert not coverage[0].intersects(bbox)
+
+
+@pytest.mark.standin
+def test_generate(tmp_path):
+    output = str(tmp_path / "tiles")
+    stats = tiles.generate(layers(), "EPSG:4326", [0, 1, 2], workers=1, output=output)
+    # The eastern hemisphere is skipped, with all its children
+    assert stats["skipped"] == 1 + 4 + 16
+    assert stats["rendered"] == 1 + 4 + 16
+    assert (tmp_path / "tiles" / "2" / "0" / "0.png").exists()
+
+    stats = tiles.generate(layers(), "EPSG:4326", [0, 1, 2], workers=1, output=output)
+    assert stats["rendered"] == 0
+    assert stats["existing"] == 1 + 4 + 16
+
+
+@pytest.mark.standin
+def test_generate_mbtiles(tmp_path):
+    output = str(tmp_path / "tiles.mbtiles")
+
+    def skip(grid, tile):
+        return tile.z == 1 and tile.y == 1
+
+    stats = tiles.generate(
+        layers(), "EPSG:3857", [0, 1], workers=2, output=output, skip=skip
+    )
+    assert stats["failed"] == 0
+    assert stats["rendered"] == 1 + 1
+
+    store = tiles.MBTilesStore(output)
+    assert store.get(tiles.Tile(1, 0, 0)).startswith(b"\x89PNG")
+    assert tiles.Tile(1, 0, 1) not in store
+    assert tiles.Tile(1, 1, 0) not in store
+    store.close()
+
+
+@pytest.mark.standin
+def test_generate_metatiles(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+
+    Magics.dll.clear()
+    output = str(tmp_path / "tiles")
+    stats = tiles.generate(
+        layers(), "EPSG:3857", [2], workers=1, output=output, metatile=2, buffer=8
+    )
+    # 8 tiles of the western hemisphere, in 2 blocks of 2 x 2
+    assert stats["rendered"] == 8
+    assert Magics.dll.calls["py_open"] == 2
+
+    image = Image.open(str(tmp_path / "tiles" / "2" / "1" / "3.png"))
+    assert image.size == (256, 256)
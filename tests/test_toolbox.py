@@ -0,0 +1,110 @@
+import os
+
+import numpy
+import pytest
+
+from Magics import synthetic, toolbox
+
+
+def grib1(path, count):
+    with open(path, "wb") as f:
+        for i in range(count):
+            f.write(synthetic.grib1_message(130 + i))
+
+
+@pytest.mark.standin
+@pytest.mark.parametrize("workers", [None, 2])
+def test_geoplot_batch(tmp_path, workers):
+    path = str(tmp_path / "data.grib")
+    grib1(path, 5)
+    outputs, errors = toolbox.geoplot_batch(
+        path,
+        output_pattern=str(tmp_path / "t2m.{field}"),
+        workers=workers,
+        pages=2,
+    )
+    assert errors == {}
+    assert outputs == [str(tmp_path / ("t2m.%d.png" % i)) for i in range(1, 6)]
+    for output in outputs:
+        with open(output, "rb") as f:
+            assert f.read(4) == b"\x89PNG"
+
+
+@pytest.mark.standin
+def test_geoplot_batch_keys(tmp_path):
+    path = str(tmp_path / "data.grib")
+    grib1(path, 3)
+    outputs, errors = toolbox.geoplot_batch(
+        path,
+        fields=[dict(shortName="u", level=0, step=0)],
+        output_pattern=str(tmp_path / "{field}"),
+    )
+    assert errors == {}
+    assert outputs == [str(tmp_path / "u_0_0.png")]
+
+
+@pytest.mark.standin
+@pytest.mark.parametrize("workers", [None, 2])
+def test_epsgram_batch(tmp_path, workers):
+    # The images of the station "b" cannot be written
+    (tmp_path / "a").mkdir()
+    outputs, errors, stats = toolbox.epsgram_batch(
+        dict(a="a.json", b="b.json"),
+        ["2t", "dwi", "mwd"],
+        output_pattern=str(tmp_path / "{station}" / "{parameter}"),
+        workers=workers,
+        climate=True,
+    )
+    assert outputs == [str(tmp_path / "a" / (p + ".png")) for p in ("2t", "dwi", "mwd")]
+    assert list(errors) == ["b"]
+    assert sorted(errors["b"]) == ["2t", "dwi", "mwd"]
+    assert stats["plots"] == 3 and stats["failures"] == 3
+
+
+@pytest.mark.standin
+def test_geoplot_batch_netcdf(tmp_path):
+    # Detected from the magic bytes, whatever the extension
+    path = str(tmp_path / "data.nc4")
+    with open(path, "wb") as f:
+        f.write(b"\x89HDF\r\n\x1a\n" + bytes(64))
+    fields = [
+        dict(
+            netcdf_value_variable="t2m",
+            netcdf_dimension_setting_method="index",
+            netcdf_dimension_setting=["time:%d" % (i,)],
+        )
+        for i in range(2)
+    ]
+    outputs, errors = toolbox.geoplot_batch(
+        path, fields=fields, output_pattern=str(tmp_path / "{field}")
+    )
+    assert errors == {}
+    assert outputs == [str(tmp_path / ("t2m_time_%d.png" % i)) for i in range(2)]
+    assert all(os.path.exists(x) for x in outputs)
+
+
+def test_netcdf_fields(monkeypatch):
+    xarray = pytest.importorskip("xarray")
+    ds = xarray.Dataset(
+        {
+            "t": (("time", "level", "lat", "lon"), numpy.zeros((2, 3, 4, 5))),
+            "lsm": (("lat", "lon"), numpy.zeros((4, 5))),
+            "series": (("time",), numpy.zeros(2)),
+        }
+    )
+    monkeypatch.setattr(xarray, "open_dataset", lambda path: ds)
+    fields = toolbox._netcdf_fields("data.nc")
+
+    assert len(fields) == 2 * 3 + 1
+    assert fields[5] == dict(
+        netcdf_value_variable="t",
+        netcdf_latitude_variable="lat",
+        netcdf_longitude_variable="lon",
+        netcdf_dimension_setting_method="index",
+        netcdf_dimension_setting=["time:1", "level:2"],
+    )
+    assert fields[6] == dict(
+        netcdf_value_variable="lsm",
+        netcdf_latitude_variable="lat",
+        netcdf_longitude_variable="lon",
+    )
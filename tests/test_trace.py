@@ -0,0 +1,46 @@
+import json
+
+import numpy
+
+from Magics import macro, trace
+
+
+def test_tracing(tmp_path):
+    spans = []
+    callback = trace.add_listener(spans.append)
+    path = str(tmp_path / "trace.json")
+    try:
+        with trace.tracing(path) as recorded:
+            macro.plot(
+                macro.output(
+                    output_name=str(tmp_path / "plot"),
+                    output_name_first_page_number="off",
+                ),
+                macro.minput(
+                    input_field=numpy.zeros((10, 20)), input_type="geographical"
+                ),
+                macro.mcont(),
+            )
+    finally:
+        trace.remove_listener(callback)
+    assert trace.listeners == [] and not trace.enabled
+
+    names = [(s.verb, s.name) for s in spans]
+    for name in [(None, "plot"), (None, "init"), (None, "finalize")]:
+        assert name in names
+    for verb in ("output", "minput", "mcont"):
+        assert (verb, "execute") in names
+        assert (verb, "set") in names
+
+    minput = [s for s in spans if s.verb == "minput" and s.name == "set"][0]
+    assert minput.attributes() == dict(verb="minput", keys=2, bytes=200 * 8 + 12)
+
+    with open(path) as f:
+        saved = json.load(f)
+    assert saved == json.loads(json.dumps(recorded.to_json()))
+    assert saved["displayTimeUnit"] == "ms"
+    assert len(saved["traceEvents"]) == len(spans)
+    event = [e for e in saved["traceEvents"] if e["name"] == "minput set"][0]
+    assert event["cat"] == "set" and event["ph"] == "X"
+    assert event["args"] == dict(verb="minput", keys=2, bytes=200 * 8 + 12)
+    assert set(event) == {"name", "cat", "ph", "ts", "dur", "pid", "tid", "args"}
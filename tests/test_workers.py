@@ -0,0 +1,88 @@
+import os
+import threading
+import time
+
+import pytest
+
+from Magics import macro, workers
+
+
+@pytest.mark.standin
+def test_plot(tmp_path):
+    with workers.RenderPool(2) as pool:
+        futures = [
+            pool.plot(
+                macro.output(
+                    output_name=str(tmp_path / ("plot%d" % i)),
+                    output_name_first_page_number="off",
+                ),
+                macro.mmap(),
+                macro.mcoast(),
+            )
+            for i in range(4)
+        ]
+        for future in futures:
+            future.result()
+    for i in range(4):
+        assert (tmp_path / ("plot%d.png" % i)).exists()
+
+
+def test_recycle():
+    with workers.RenderPool(1, warm=False, max_plots=2) as pool:
+        pids = [pool.submit(os.getpid).result() for i in range(4)]
+    assert pids[0] == pids[1]
+    assert pids[1] != pids[2]
+    assert pool.recycled == 2
+
+
+def test_state():
+    # The initializer sets the state of each worker, by name
+    with workers.RenderPool(
+        1, warm=False, initializer=workers.set_state, initargs=("test", [1, 2])
+    ) as pool:
+        assert pool.submit(workers.state, "test").result() == [1, 2]
+
+
+def test_watchdog():
+    with workers.RenderPool(1, warm=False, timeout=0.5) as pool:
+        with pytest.raises(workers.WorkerTimeout) as e:
+            pool.submit(time.sleep, 10).result()
+        assert e.value.plan == "sleep(10)"
+
+        with pytest.raises(workers.WorkerCrashed):
+            pool.submit(os._exit, 1).result()
+
+        # The worker has been replaced
+        assert pool.submit(abs, -1).result() == 1
+        assert [f["kind"] for f in pool.failures] == ["killed", "crashed"]
+
+
+@pytest.mark.standin
+def test_lock_held(tmp_path):
+    # A worker started while another thread holds macro.LOCK can plot
+    held = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with macro.LOCK:
+            held.set()
+            release.wait(30)
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    held.wait()
+    try:
+        with workers.RenderPool(1, startup_timeout=20) as pool:
+            pool.plot(
+                macro.output(
+                    output_name=str(tmp_path / "plot"),
+                    output_name_first_page_number="off",
+                ),
+                macro.mmap(),
+                macro.mcoast(),
+            ).result(30)
+            assert pool.failures == []
+    finally:
+        release.set()
+        thread.join()
+    assert (tmp_path / "plot.png").exists()
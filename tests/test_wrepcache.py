@@ -0,0 +1,84 @@
+import json
+import os
+import time
+
+import pytest
+
+from Magics import Magics, toolbox, wrepcache
+
+STATION = {
+    "station_name": "Reading",
+    "location": {"lat": 51.4, "lon": -1.0},
+    "2t": {"eps": {"steps": [0, 6, 12], "median": [280.0, 281.5, 283.0]}},
+    "tp": {"eps": {"steps": [0, 6, 12], "median": [0.0, 0.001, 0.002]}},
+    "clim": {"2t": {"median": [279.0, 280.0]}, "tp": {"median": [0.0, 0.0]}},
+}
+
+
+@pytest.fixture
+def station(tmp_path, monkeypatch):
+    monkeypatch.setenv("MAGICS_WREPJSON_CACHE", str(tmp_path / "cache"))
+    path = str(tmp_path / "station.json")
+    with open(path, "w") as f:
+        json.dump(STATION, f)
+    return path
+
+
+def test_split(station, monkeypatch):
+    loads = []
+    load = json.load
+    monkeypatch.setattr(json, "load", lambda f: loads.append(f.name) or load(f))
+
+    inputs = [wrepcache.input(station, p) for p in ("2t", "tp", "2t")]
+    assert loads == [station]
+    assert wrepcache.input(station, "msl") == station
+
+    with open(inputs[0]) as f:
+        assert json.load(f) == {
+            "station_name": "Reading",
+            "location": {"lat": 51.4, "lon": -1.0},
+            "2t": STATION["2t"],
+            "clim": {"2t": {"median": [279.0, 280.0]}},
+        }
+
+
+def test_eviction(station, tmp_path):
+    first = wrepcache.input(station, "2t")
+    with open(station, "w") as f:
+        json.dump(dict(STATION, station_name="Shinfield"), f)
+    os.utime(station, (0, 0))
+
+    # The slim files of the previous version of the file are removed
+    second = wrepcache.input(station, "2t")
+    assert second != first
+    assert os.path.exists(second) and not os.path.exists(first)
+
+    # The station files used within a day are kept
+    directory = os.path.dirname(os.path.dirname(second))
+    os.utime(directory, (time.time() - 2 * 24 * 3600,) * 2)
+    assert wrepcache.input(station, "2t") == second
+    wrepcache.evict()
+    assert os.path.exists(second)
+
+    # The station files not used for a day are removed
+    os.utime(directory, (time.time() - 2 * 24 * 3600,) * 2)
+    wrepcache.evict()
+    assert not os.path.exists(directory)
+
+
+@pytest.mark.standin
+def test_epsgraph(station, tmp_path, monkeypatch):
+    inputs = []
+    setc = Magics.setc
+
+    def record(name, value):
+        if name == "wrepjson_input_filename":
+            inputs.append(value)
+        return setc(name, value)
+
+    monkeypatch.setattr(Magics, "setc", record)
+    toolbox.epsgram(
+        "2t", station, cache=True, climate=True, output=str(tmp_path / "2t")
+    )
+    assert inputs == [wrepcache.input(station, "2t")] * 2
+    assert (tmp_path / "2t.png").exists()